@@ -0,0 +1,177 @@
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from metrics import SSH_CONNECT_SECONDS
+
+try:
+    import asyncssh
+except ImportError:  # asyncssh 为可选依赖，未安装时只能使用线程后端
+    asyncssh = None
+
+class _AsyncPoolEntry:
+    """单个服务器的异步连接池条目"""
+
+    def __init__(self, max_sessions: int):
+        self.conn = None
+        self.last_used = 0.0
+        self.active = 0
+        self.connect_lock = asyncio.Lock()
+        self.slots = asyncio.Semaphore(max_sessions)
+
+class AsyncSSHConnectionPool:
+    """
+    基于 asyncssh 的 SSH 连接池，所有远程命令都直接运行在事件循环上
+
+    行为与 ssh_pool.SSHConnectionPool 保持一致：按服务器复用已认证的连接、
+    保活、空闲回收、会话数上限、复用前健康检查以及断线自动重连。
+    """
+
+    def __init__(self, keepalive: int = 30, idle_timeout: int = 300, max_sessions: int = 8, connect_timeout: int = 5):
+        if asyncssh is None:
+            raise RuntimeError("未安装 asyncssh，无法使用异步 SSH 后端")
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.connect_timeout = connect_timeout
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(server_info: dict) -> tuple:
+        return (server_info['host'], int(server_info['port']), server_info['username'], server_info['password'])
+
+    def _get_entry(self, server_info: dict) -> _AsyncPoolEntry:
+        key = self._key(server_info)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = _AsyncPoolEntry(int(server_info.get('max_sessions', self.max_sessions)))
+            self._entries[key] = entry
+        return entry
+
+    @staticmethod
+    def _is_healthy(conn) -> bool:
+        return conn is not None and not conn.is_closed()
+
+    async def _connect(self, server_info: dict):
+        logging.info(f"正在连接到服务器 {server_info['host']}:{server_info['port']}")
+        with SSH_CONNECT_SECONDS.time(server_info['name']):
+            return await asyncssh.connect(
+                server_info['host'],
+                port=int(server_info['port']),
+                username=server_info['username'],
+                password=server_info['password'],
+                known_hosts=None,
+                connect_timeout=self.connect_timeout,
+                keepalive_interval=self.keepalive
+            )
+
+    async def _acquire_conn(self, entry: _AsyncPoolEntry, server_info: dict):
+        async with entry.connect_lock:
+            if self._is_healthy(entry.conn):
+                self.hits += 1
+                return entry.conn
+            if entry.conn is not None:
+                self.reconnects += 1
+                entry.conn.close()
+                entry.conn = None
+            self.misses += 1
+            entry.conn = await self._connect(server_info)
+            return entry.conn
+
+    def discard(self, server_info: dict):
+        entry = self._entries.get(self._key(server_info))
+        if entry is not None and entry.conn is not None:
+            entry.conn.close()
+            entry.conn = None
+
+    def sweep_idle(self):
+        now = time.monotonic()
+        for key, entry in self._entries.items():
+            if entry.conn is None or entry.active > 0:
+                continue
+            if now - entry.last_used >= self.idle_timeout:
+                logging.info(f"关闭空闲 SSH 连接 {key[0]}:{key[1]}")
+                entry.conn.close()
+                entry.conn = None
+                self.evictions += 1
+
+    def close_all(self):
+        for entry in self._entries.values():
+            if entry.conn is not None:
+                entry.conn.close()
+                entry.conn = None
+        self._entries.clear()
+
+    @asynccontextmanager
+    async def session(self, server_info: dict, timeout: int):
+        """
+        获取一个会话名额和健康的连接
+
+        获取不到会话名额时最多等待 timeout 秒。
+        """
+        self.sweep_idle()
+        entry = self._get_entry(server_info)
+        try:
+            await asyncio.wait_for(entry.slots.acquire(), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise Exception(f"服务器 {server_info['name']} 的 SSH 会话数已达上限")
+        entry.active += 1
+        try:
+            yield await self._acquire_conn(entry, server_info)
+        finally:
+            entry.active -= 1
+            entry.last_used = time.monotonic()
+            entry.slots.release()
+
+    async def _reconnect(self, server_info: dict):
+        # 缓存的连接可能已被对端关闭，丢弃后重连一次
+        self.discard(server_info)
+        return await self._acquire_conn(self._get_entry(server_info), server_info)
+
+    async def exec_command(self, server_info: dict, cmd: str, timeout: int) -> tuple:
+        """执行远程命令，返回 (stdout, stderr) 文本"""
+        async with self.session(server_info, timeout) as conn:
+            logging.info(f"正在执行命令: {cmd}")
+            try:
+                result = await conn.run(cmd, timeout=timeout, encoding='utf-8', errors='ignore')
+            except (asyncssh.ChannelOpenError, asyncssh.ConnectionLost, ConnectionError):
+                conn = await self._reconnect(server_info)
+                result = await conn.run(cmd, timeout=timeout, encoding='utf-8', errors='ignore')
+            return result.stdout or "", result.stderr or ""
+
+    async def exec_command_stream(self, server_info: dict, cmd: str, timeout: int, on_line) -> tuple:
+        """执行远程命令，stdout 每到达一行就调用 on_line(line)，结束后返回 (stdout, stderr) 文本"""
+        async with self.session(server_info, timeout) as conn:
+            logging.info(f"正在执行命令: {cmd}")
+            try:
+                process = await conn.create_process(cmd, encoding='utf-8', errors='ignore')
+            except (asyncssh.ChannelOpenError, asyncssh.ConnectionLost, ConnectionError):
+                conn = await self._reconnect(server_info)
+                process = await conn.create_process(cmd, encoding='utf-8', errors='ignore')
+
+            async def consume():
+                chunks = []
+                async for line in process.stdout:
+                    chunks.append(line)
+                    on_line(line)
+                error = await process.stderr.read()
+                return "".join(chunks), error
+
+            try:
+                return await asyncio.wait_for(consume(), timeout=timeout)
+            finally:
+                process.close()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "reconnects": self.reconnects,
+            "evictions": self.evictions,
+            "connections": sum(1 for e in self._entries.values() if e.conn is not None),
+            "active_sessions": sum(e.active for e in self._entries.values()),
+        }
@@ -0,0 +1,131 @@
+"""
+Ping / NextTrace 输出解析器的基准测试
+
+    python bench/bench_parsers.py [--repeat 5] [--fuzz 2000]
+
+对 bench/corpus 中的每份真实输出样本：
+1. 检查当前实现（network.py）与原始实现（legacy_parsers.py）的输出是否逐字节一致
+   （ping 的结果在原有汇总之后追加了逐包统计，检查原有汇总部分是否一致）；
+2. 分别测量单次调用耗时（取 repeat 轮中最快的一轮）和单次调用的内存峰值（tracemalloc）。
+   ping 的当前实现额外做了逐包时延统计，耗时不能与原始实现直接比较。
+--fuzz N 会对样本做 N 次随机变形（插入空白、颜色控制符、打乱行等）后再比较输出，
+用来覆盖样本之外的边界情况。
+"""
+import os
+import sys
+import random
+import timeit
+import argparse
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+os.chdir(os.path.dirname(BENCH_DIR))
+
+import network
+import legacy_parsers
+
+CORPUS_DIR = os.path.join(BENCH_DIR, "corpus")
+
+def load_corpus() -> list:
+    corpus = []
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        with open(os.path.join(CORPUS_DIR, name), encoding="utf-8") as f:
+            corpus.append((name[:-len(".txt")], f.read()))
+    return corpus
+
+def callables_for(name: str, text: str):
+    """返回 (原始实现, 当前实现)，都是无参数函数"""
+    if name.startswith("ping_"):
+        return (lambda: legacy_parsers.parse_ping_output(text)), (lambda: network.parse_ping_output(text))
+    trace_mode = "tcp" if "tcp" in name else "icmp"
+    ip_type = "IPv6" if "ipv6" in name else "direct"
+    args = (text, "测试节点", "example.com", ip_type, trace_mode)
+    return (lambda: legacy_parsers.format_nexttrace_result(*args)), (lambda: network.format_nexttrace_result(*args))
+
+def time_per_call(func, repeat: int) -> float:
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def peak_per_call(func) -> int:
+    func()  # 预热，排除首次调用的缓存开销
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    func()
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return peak
+
+def mutate(text: str, rng: random.Random) -> str:
+    lines = text.split("\n")
+    for _ in range(rng.randint(1, 6)):
+        i = rng.randrange(len(lines))
+        op = rng.randrange(6)
+        if op == 0:
+            lines[i] = rng.choice([" ", "\t", "  　", "\r"]) + lines[i] + rng.choice(["", " ", "\t\t"])
+        elif op == 1:
+            lines[i] = "\x1b[1;3%dm" % rng.randrange(8) + lines[i] + "\x1b[0m"
+        elif op == 2:
+            lines.insert(i, "")
+        elif op == 3:
+            j = rng.randrange(len(lines))
+            lines[i], lines[j] = lines[j], lines[i]
+        elif op == 4:
+            lines[i] = lines[i].replace(" ", rng.choice(["  ", "\x0b", " ", "\x1c"]))
+        else:
+            del lines[i]
+            if not lines:
+                lines = [""]
+    return "\n".join(lines)
+
+def check_identity(corpus: list, fuzz: int) -> int:
+    mismatches = 0
+    rng = random.Random(0)
+    cases = list(corpus)
+    for _ in range(fuzz):
+        name, text = rng.choice(corpus)
+        cases.append((name, mutate(text, rng)))
+    for name, text in cases:
+        legacy, current = callables_for(name, text)
+        expected, actual = legacy(), current()
+        if name.startswith("ping_"):
+            # 当前实现在原有汇总之后追加逐包统计，并能解析原始实现不认识的格式：
+            # 原始实现能解析时要求其输出是当前输出的前缀
+            ok = expected == text or actual.startswith(expected)
+        else:
+            ok = expected == actual
+        if not ok:
+            mismatches += 1
+            print(f"输出不一致: {name}\n{text!r}")
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--fuzz", type=int, default=2000)
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    mismatches = check_identity(corpus, args.fuzz)
+    print(f"输出一致性: {len(corpus) + args.fuzz} 份样本，{mismatches} 份不一致\n")
+
+    print(f"{'sample':<28}{'bytes':>7}{'legacy(us)':>12}{'current(us)':>13}{'speedup':>9}{'legacy peak':>13}{'current peak':>14}")
+    total_legacy = total_current = 0.0
+    for name, text in corpus:
+        legacy, current = callables_for(name, text)
+        t_legacy = time_per_call(legacy, args.repeat)
+        t_current = time_per_call(current, args.repeat)
+        total_legacy += t_legacy
+        total_current += t_current
+        print(
+            f"{name:<28}{len(text.encode()):>7}{t_legacy * 1e6:>12.1f}{t_current * 1e6:>13.1f}"
+            f"{t_legacy / t_current:>8.2f}x{peak_per_call(legacy):>12}B{peak_per_call(current):>13}B"
+        )
+    print(f"\n合计: legacy {total_legacy * 1e6:.1f}us, current {total_current * 1e6:.1f}us, "
+          f"speedup {total_legacy / total_current:.2f}x")
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
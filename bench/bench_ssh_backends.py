@@ -0,0 +1,69 @@
+"""
+比较两种 SSH 执行后端在并发远程命令下的表现
+
+    python bench/bench_ssh_backends.py [--jobs 10 100 500] [--delay 0.5]
+
+thread: paramiko 连接池 + asyncio.to_thread（默认线程池）
+asyncssh: asyncssh 连接池，直接运行在事件循环上
+两者都连接到本地 SSH 替身服务器，每条命令固定耗时 delay 秒。
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ssh_pool import SSHConnectionPool
+from async_ssh_pool import AsyncSSHConnectionPool, asyncssh
+from fake_ssh_server import FakeSSHNode
+
+async def run_thread_backend(server_info: dict, jobs: int) -> float:
+    pool = SSHConnectionPool(max_sessions=jobs)
+    # 预热：建立连接，只比较执行阶段
+    await asyncio.to_thread(pool.exec_command, server_info, "ping -c 1 127.0.0.1", 30)
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        asyncio.to_thread(pool.exec_command, server_info, "ping -c 4 127.0.0.1", 60) for _ in range(jobs)
+    ])
+    elapsed = time.perf_counter() - start
+    pool.close_all()
+    return elapsed
+
+async def run_asyncssh_backend(server_info: dict, jobs: int) -> float:
+    pool = AsyncSSHConnectionPool(max_sessions=jobs)
+    await pool.exec_command(server_info, "ping -c 1 127.0.0.1", 30)
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        pool.exec_command(server_info, "ping -c 4 127.0.0.1", 60) for _ in range(jobs)
+    ])
+    elapsed = time.perf_counter() - start
+    pool.close_all()
+    return elapsed
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--delay", type=float, default=0.5)
+    args = parser.parse_args()
+
+    node = FakeSSHNode(delay=args.delay).start()
+    server_info = node.server_info(max_sessions=max(args.jobs))
+    backends = [("thread", run_thread_backend)]
+    if asyncssh is not None:
+        backends.append(("asyncssh", run_asyncssh_backend))
+    else:
+        print("未安装 asyncssh，跳过 asyncssh 后端")
+
+    print(f"命令耗时 {args.delay}s，默认线程池大小 {min(32, (os.cpu_count() or 1) + 4)}")
+    print(f"{'backend':<10}{'jobs':>6}{'wall(s)':>10}{'jobs/s':>10}")
+    for jobs in args.jobs:
+        for name, runner in backends:
+            elapsed = await runner(server_info, jobs)
+            print(f"{name:<10}{jobs:>6}{elapsed:>10.2f}{jobs / elapsed:>10.1f}")
+    node.stop()
+
+if __name__ == "__main__":
+    asyncio.run(main())
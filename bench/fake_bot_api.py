@@ -0,0 +1,140 @@
+"""
+本地 Telegram Bot API 替身，用于压测
+
+基于 asyncio 实现的最小 HTTP/1.1 服务器（支持 keep-alive），把 python-telegram-bot 的 base_url
+指向 http://127.0.0.1:<port>/bot 即可使用。支持 getMe、sendMessage、editMessageText、
+deleteMessage、answerCallbackQuery 和 setWebhook/deleteWebhook，内容未变化的编辑与真实 API 一样返回 400 "message is not modified"。
+每次发送或编辑消息都会调用 on_message(chat_id, message_id, text, reply_markup)，供压测脚本驱动用户操作。
+"""
+import json
+import time
+import asyncio
+import itertools
+from collections import Counter
+from urllib.parse import parse_qsl
+
+# 以 JSON 字符串提交的参数
+_JSON_PARAMS = {"reply_markup", "entities", "link_preview_options", "reply_parameters"}
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "LoadTestBot", "username": "load_test_bot"}
+
+class FakeBotAPI:
+    """
+    参数:
+        delay: 每个请求的模拟网络耗时（秒）
+        on_message: 可选，机器人发送或编辑消息时调用
+    """
+
+    def __init__(self, delay: float = 0.0, on_message=None):
+        self.delay = delay
+        self.on_message = on_message
+        self.calls = Counter()
+        # (chat_id, message_id) -> (text, reply_markup)
+        self.messages = {}
+        self._message_ids = itertools.count(1_000_000)
+        self._server = None
+        self.port = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def _message(self, chat_id: int, message_id: int, text: str, reply_markup) -> dict:
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": text,
+        }
+        if reply_markup:
+            message["reply_markup"] = reply_markup
+        return message
+
+    def _store(self, chat_id: int, message_id: int, text: str, reply_markup):
+        self.messages[(chat_id, message_id)] = (text, reply_markup)
+        if self.on_message is not None:
+            self.on_message(chat_id, message_id, text, reply_markup)
+
+    def call(self, method: str, params: dict):
+        """处理一次 API 调用，返回 (ok, result 或错误描述)"""
+        self.calls[method] += 1
+        if method == "getMe":
+            return True, BOT_USER
+        if method == "sendMessage":
+            chat_id = int(params["chat_id"])
+            message_id = next(self._message_ids)
+            reply_markup = params.get("reply_markup")
+            self._store(chat_id, message_id, params.get("text", ""), reply_markup)
+            return True, self._message(chat_id, message_id, params.get("text", ""), reply_markup)
+        if method == "editMessageText":
+            chat_id, message_id = int(params["chat_id"]), int(params["message_id"])
+            text, reply_markup = params.get("text", ""), params.get("reply_markup")
+            if self.messages.get((chat_id, message_id)) == (text, reply_markup):
+                return False, "Bad Request: message is not modified"
+            self._store(chat_id, message_id, text, reply_markup)
+            return True, self._message(chat_id, message_id, text, reply_markup)
+        if method == "deleteMessage":
+            self.messages.pop((int(params["chat_id"]), int(params["message_id"])), None)
+            return True, True
+        if method in ("answerCallbackQuery", "setWebhook", "deleteWebhook"):
+            return True, True
+        return False, f"Not Found: method {method} is not supported by the fake API"
+
+    @staticmethod
+    def _parse_params(headers: dict, body: bytes) -> dict:
+        if headers.get("content-type", "").startswith("application/json"):
+            return json.loads(body or b"{}")
+        params = {}
+        # python-telegram-bot 以表单提交参数，复杂类型（如 reply_markup）为 JSON 字符串
+        for key, value in parse_qsl(body.decode("utf-8"), keep_blank_values=True):
+            if key in _JSON_PARAMS:
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            params[key] = value
+        return params
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                method = request_line.decode("latin-1").split()[1].rsplit("/", 1)[-1]
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                ok, result = self.call(method, self._parse_params(headers, body))
+                if ok:
+                    status, payload = "200 OK", {"ok": True, "result": result}
+                else:
+                    status, payload = "400 Bad Request", {"ok": False, "error_code": 400, "description": result}
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode("latin-1")
+                    + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,172 @@
+"""
+本地 SSH 替身服务器，用于基准测试和压测
+
+基于 paramiko 实现，接受任意用户名/密码登录，对 ping 和 nexttrace 命令返回固定输出，
+并按配置延迟逐行输出，模拟真实节点上的执行耗时。也模拟 `nexttrace --version`、NextTrace 安装脚本和 MTR 报告的多轮循环。
+"""
+import re
+import json
+import socket
+import threading
+import time
+import paramiko
+
+PING_OUTPUT = """PING {target} ({target}) 56(84) bytes of data.
+{lines}
+--- {target} ping statistics ---
+{count} packets transmitted, {count} received, 0% packet loss, time {elapsed}ms
+rtt min/avg/max/mdev = 1.012/1.234/1.567/0.123 ms
+"""
+
+NEXTTRACE_OUTPUT = """NextTrace v1.3.0 2024-01-01T00:00:00Z abcdef0
+[NextTrace API] preferred API IP - 127.0.0.1 - 10.00ms - Misaka.LAX
+IP Geo Data Provider: LeoMoeAPI
+traceroute to {target}, 30 hops max, 52 bytes payload, ICMP mode
+1   10.0.0.1        *        RFC1918
+                                         1.01 ms / 0.98 ms / 1.02 ms
+2   203.0.113.1     AS64500  [EXAMPLE-NET]  Example City  example.net
+                                         5.12 ms / 5.20 ms / 5.08 ms
+3   {target}        AS15169  [GOOGLE]  United States  google.com
+                                         8.33 ms / 8.41 ms / 8.29 ms
+MapTrace URL: https://assets.nxtrace.org/tracemap/example.html
+"""
+
+# 模拟安装脚本安装的 nexttrace 版本
+INSTALLED_VERSION = "1.4.0"
+
+# build_mtr_command 生成的多轮循环
+_ROUNDS_RE = re.compile(r"^for i in \$\(seq (\d+)\); do (.+); echo '(.+)'; done$")
+
+def nexttrace_json(target: str) -> str:
+    """与 NEXTTRACE_OUTPUT 相同路径的 `nexttrace --json` 输出（RTT 单位为纳秒）"""
+    path = [
+        ("10.0.0.1", "", "", "", (1.01, 0.98, 1.02)),
+        ("203.0.113.1", "64500", "EXAMPLE-NET", "example.net", (5.12, 5.20, 5.08)),
+        (target, "15169", "GOOGLE", "google.com", (8.33, 8.41, 8.29)),
+    ]
+    hops = []
+    for ttl, (ip, asn, whois, owner, rtts) in enumerate(path, start=1):
+        geo = {"asnumber": asn, "whois": whois, "owner": owner, "country": "United States" if asn else "", "prov": "", "city": ""}
+        hops.append([
+            {"Success": True, "Address": {"IP": ip, "Zone": ""}, "Hostname": "", "TTL": ttl,
+             "RTT": int(rtt * 1e6), "Error": None, "Geo": geo, "Lang": "cn", "MPLS": None}
+            for rtt in rtts
+        ])
+    return json.dumps({"Hops": hops, "TraceMapUrl": "https://assets.nxtrace.org/tracemap/example.html"}) + "\n"
+
+class _FakeServer(paramiko.ServerInterface):
+    def __init__(self, node):
+        self.node = node
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.node.handle_command, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+class FakeSSHNode:
+    """
+    参数:
+        delay: 每条命令的模拟执行时间（秒）
+        host: 监听地址，端口自动分配
+        json_support: 是否模拟支持 --json 参数的新版 nexttrace
+        nexttrace_version: 节点上 nexttrace 的版本，None 表示未安装（运行安装脚本后变为 INSTALLED_VERSION）
+    """
+
+    def __init__(self, delay: float = 0.5, host: str = "127.0.0.1", json_support: bool = True, nexttrace_version: str = "1.3.0"):
+        self.delay = delay
+        self.json_support = json_support
+        self.nexttrace_version = nexttrace_version
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, 0))
+        self.sock.listen(128)
+        self.host, self.port = self.sock.getsockname()
+        self.commands = 0
+        self.connections = 0
+        self._stopped = False
+        self._transports = []
+
+    def server_info(self, name: str = "fake-node", **extra) -> dict:
+        info = {"name": name, "host": self.host, "port": self.port, "username": "bench", "password": "bench"}
+        info.update(extra)
+        return info
+
+    def start(self):
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopped = True
+        self.sock.close()
+        for transport in self._transports:
+            transport.close()
+
+    def _accept_loop(self):
+        while not self._stopped:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.host_key)
+            transport.start_server(server=_FakeServer(self))
+            self._transports.append(transport)
+
+    def render(self, command: str) -> str:
+        loop = _ROUNDS_RE.match(command)
+        if loop:
+            # MTR 报告：同一条命令中执行多轮，每轮后输出分隔行
+            rounds, inner, marker = loop.groups()
+            return "".join(self.render(inner) + marker + "\n" for _ in range(int(rounds)))
+        target = command.split()[-1]
+        if command.startswith("ping"):
+            match = re.search(r"-c\s+(\d+)", command)
+            count = int(match.group(1)) if match else 4
+            lines = "\n".join(
+                f"64 bytes from {target}: icmp_seq={i + 1} ttl=117 time=1.{234 + i} ms" for i in range(count)
+            )
+            return PING_OUTPUT.format(target=target, count=count, lines=lines, elapsed=count * 1000)
+        if command.startswith("nexttrace --version"):
+            if self.nexttrace_version is None:
+                return "bash: nexttrace: command not found\n"
+            return f"NextTrace v{self.nexttrace_version} 2024-01-01T00:00:00Z abcdef0\n"
+        if "nxtrace.org/nt" in command:
+            self.nexttrace_version = INSTALLED_VERSION
+            return "正在下载 NextTrace...\n一切准备就绪！使用 nexttrace 1.1.1.1 开始你的第一次路由测试吧\n"
+        if command.startswith("nexttrace"):
+            if "--json" in command.split():
+                return nexttrace_json(target)
+            return NEXTTRACE_OUTPUT.format(target=target)
+        return ""
+
+    def handle_command(self, channel, command: str):
+        self.commands += 1
+        try:
+            if "--json" in command.split() and not self.json_support:
+                # 等 exec 请求的应答先发出，再模拟旧版 nexttrace 的参数报错
+                time.sleep(0.05)
+                channel.sendall_stderr(b"flag provided but not defined: -json\n")
+                channel.send_exit_status(2)
+                return
+            # 像真实命令一样逐行输出，总耗时为 delay
+            lines = self.render(command).splitlines(True)
+            for line in lines:
+                time.sleep(self.delay / len(lines))
+                channel.sendall(line.encode())
+            channel.send_exit_status(0)
+        except Exception:
+            pass
+        finally:
+            channel.close()
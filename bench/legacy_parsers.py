@@ -0,0 +1,141 @@
+"""
+解析器的原始实现（未做预编译优化），仅供 bench_parsers.py 对比输出是否逐字节一致以及性能差异
+
+请勿在机器人代码中使用。
+"""
+import re
+
+def parse_ping_output(output: str) -> str:
+    lines = output.strip().split("\n")
+    packets_line = None
+    rtt_line = None
+
+    for line in lines:
+        if "packets transmitted" in line and "packet loss" in line:
+            packets_line = line.strip()
+        if "rtt min/avg/max/mdev" in line:
+            rtt_line = line.strip()
+
+    transmitted = received = packet_loss = None
+    min_rtt = avg_rtt = max_rtt = mdev = None
+
+    if packets_line:
+        pattern_packets = re.compile(r"(\d+)\s+packets transmitted,\s+(\d+)\s+received,\s+(\d+)% packet loss")
+        match = pattern_packets.search(packets_line)
+        if match:
+            transmitted, received, packet_loss = match.groups()
+
+    if rtt_line:
+        pattern_rtt = re.compile(r"rtt min/avg/max/mdev = ([\d\.]+)/([\d\.]+)/([\d\.]+)/([\d\.]+)\s+ms")
+        match = pattern_rtt.search(rtt_line)
+        if match:
+            min_rtt, avg_rtt, max_rtt, mdev = match.groups()
+
+    if transmitted and received and packet_loss and min_rtt and avg_rtt and max_rtt and mdev:
+        summary = (
+            f"传输包数量: {transmitted}\n"
+            f"接收包数量: {received}\n"
+            f"丢包率: {packet_loss}%\n"
+            f"最小延迟: {min_rtt} ms\n"
+            f"平均延迟: {avg_rtt} ms\n"
+            f"最大延迟: {max_rtt} ms\n"
+            f"标准差(mdev): {mdev} ms"
+        )
+        return summary
+    else:
+        return output
+
+def format_nexttrace_result(raw_output: str, server_name: str, target: str, ip_type: str, trace_mode: str = "icmp") -> str:
+    # 1. 删除 ANSI 颜色控制符
+    ansi_escape = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
+    clean_output = ansi_escape.sub('', raw_output)
+
+    # 2. 按行拆分
+    lines = clean_output.splitlines()
+    header_lines = []
+    hop_lines = []
+    map_url_line = None
+
+    in_hops = False
+    found_icmp_mode = False
+    found_tcp_mode = False
+
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("MapTrace URL:"):
+            map_url_line = stripped
+            in_hops = False
+            break
+
+        if "ICMP mode" in stripped:
+            found_icmp_mode = True
+            in_hops = True
+            continue
+            
+        if "TCP mode" in stripped or "TCP SYN" in stripped:  # 检测TCP模式
+            found_tcp_mode = True
+            in_hops = True
+            continue
+
+        if in_hops:
+            hop_lines.append(stripped)
+        else:
+            header_lines.append(stripped)
+
+    # 3. 合并同一 hop 的多行
+    condensed_hops = []
+    current_hop = ""
+    hop_start_pattern = re.compile(r'^\d+\s+')
+    for hl in hop_lines:
+        if not hl:
+            continue
+        if hop_start_pattern.match(hl):
+            if current_hop:
+                current_hop = re.sub(r'\s+', ' ', current_hop).strip()
+                condensed_hops.append(current_hop)
+            current_hop = hl
+        else:
+            current_hop += " " + hl
+    if current_hop:
+        current_hop = re.sub(r'\s+', ' ', current_hop).strip()
+        condensed_hops.append(current_hop)
+
+    # 4. 隐藏第一跳的 IP 地址
+    if condensed_hops:
+        pattern = r'\b((?:[0-9A-Fa-f]{1,4}(?::[0-9A-Fa-f]{1,4}){7}|(?:[0-9A-Fa-f]{1,4}(?::[0-9A-Fa-f]{1,4}){0,7})?::(?:[0-9A-Fa-f]{1,4}(?::[0-9A-Fa-f]{1,4}){0,7})?))\b'
+        condensed_hops[0] = re.sub(pattern, 'x.x.x.x', condensed_hops[0], count=1)
+
+    # 5. 拼接输出结果
+    result = "<b>【NextTrace 路由追踪结果】</b>\n\n"
+    result += f"节点: {server_name}\n"
+    result += f"目标: {target}\n"
+    trace_mode_text = "TCP模式" if trace_mode == "tcp" else "ICMP模式"
+    result += f"执行模式: {'直接执行' if ip_type=='direct' else ip_type} ({trace_mode_text})\n\n"
+
+    filtered_header = [h for h in header_lines if h]
+    if filtered_header:
+        result += "<b>头部信息</b>:\n"
+        result += "<pre>" + "\n".join(filtered_header) + "</pre>\n\n"
+
+    if not (found_icmp_mode or found_tcp_mode):
+        result += f"未找到路由信息，可能 NextTrace 输出异常。\n"
+        return result
+
+    if condensed_hops:
+        result += "<b>路由跳数</b>:\n"
+        formatted_hops = []
+        for hop in condensed_hops:
+            formatted_hops.append(hop)
+            if hop != condensed_hops[-1]:
+                formatted_hops.append("")
+        result += "<pre>" + "\n".join(formatted_hops) + "</pre>\n\n"
+    else:
+        result += "未捕获到路由跳数信息。\n"
+
+    if map_url_line:
+        result += f"<b>{map_url_line}</b>\n"
+    else:
+        result += "未发现 MapTrace URL\n"
+
+    return result
+
@@ -0,0 +1,243 @@
+"""
+端到端压测：本地 SSH 替身节点 + 本地 Telegram Bot API 替身 + bot.build_application()
+
+    python bench/load_test.py [--users 50] [--jobs 4] [--trace-ratio 0.3] [--nodes 3] [--ssh-delay 0.5]
+                              [--api-delay 0.0] [--telegram-rate 1000] [--backend thread] [--cache]
+                              [--concurrency 16] [--webhook]
+
+每个合成用户依次发起 jobs 次测试：发送 /ping <目标> 4 或 /nexttrace <目标> 命令，
+收到带按钮的消息后像真实用户一样点击（随机选择节点、ICMP 模式、IPv4），
+直到消息被编辑为最终结果。每次测试使用不同的目标，默认关闭结果缓存，避免缓存和相同测试合并影响结果。
+
+更新默认直接放入 application.update_queue（相当于轮询模式收到更新之后）；--webhook 时改为通过 HTTP
+推送到机器人的 webhook 监听（带密钥校验），覆盖 webhook 模式的完整路径。--concurrency 1 为逐个处理更新。
+
+报告吞吐（jobs/s）、端到端延迟（从发送命令到最终结果）的 P50/P90/P99，
+以及每次测试平均产生的 Telegram API 调用次数，用来衡量每项性能改动的效果。
+机器人使用临时目录中生成的 config.json，不会读取或修改项目中的配置。
+注意：SSH 替身节点与机器人运行在同一进程中，节点的 paramiko 线程也会占用 CPU。
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import itertools
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_ssh_server import FakeSSHNode
+from fake_bot_api import FakeBotAPI
+
+TOKEN = "123456:LOAD-TEST"
+WEBHOOK_SECRET = "load-test-secret"
+FIRST_USER_ID = 10_000_000
+
+def write_config(directory: str, nodes: list, args) -> None:
+    users = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+    # 压测只关心机器人本身的处理能力，放宽命令频率限制
+    unlimited = {"burst": 1_000_000, "per": 1}
+    config = {
+        "TELEGRAM_BOT_TOKEN": TOKEN,
+        "ADMIN_USERS": [],
+        "AUTHORIZED_USERS": users,
+        "SERVERS": [node.server_info(f"node-{i}", max_sessions=64) for i, node in enumerate(nodes)],
+        "SSH_BACKEND": args.backend,
+        "TELEGRAM_RATE_LIMITS": {"global_per_second": args.telegram_rate, "chat_per_second": 1, "chat_burst": 3},
+        "JOB_QUEUE": {"global_limit": 1000, "node_limit": 64},
+        "RESULT_CACHE": {} if args.cache else {"ping_ttl": 0, "trace_ttl": 0},
+        "RATE_LIMITS": {"commands": {"ping": unlimited, "pingall": unlimited, "nexttrace": unlimited}},
+        "CONFIG_PERSISTENCE": {"watch_interval": 0},
+        "UPDATE_CONCURRENCY": args.concurrency,
+    }
+    with open(os.path.join(directory, "config.json"), "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+def is_final(text: str) -> bool:
+    """测试结果消息的最终版本（进度、排队和等待中的版本都带有相应提示）"""
+    return "结果】" in text and not any(mark in text for mark in ("请稍候", "等待结果", "正在执行", "排队中"))
+
+def pick_button(keyboard: list, rng: random.Random):
+    buttons = [b["callback_data"] for row in keyboard for b in row if b.get("callback_data")]
+    for preferred in ("trace_mode_icmp", "iptype_ipv4"):
+        if preferred in buttons:
+            return preferred
+    servers = [b for b in buttons if b.startswith("server_") and b != "server_all"]
+    return rng.choice(servers) if servers else None
+
+class LoadTest:
+    def __init__(self, application, api: FakeBotAPI, args):
+        self.application = application
+        self.api = api
+        self.args = args
+        self.rng = random.Random(0)
+        self.update_ids = itertools.count(1)
+        self.user_message_ids = itertools.count(1)
+        self.callback_ids = itertools.count(1)
+        self.targets = itertools.count(1)
+        # user_id -> 当前测试完成时设置的 Event
+        self.active = {}
+        self.latencies = []
+        self.timeouts = 0
+        # webhook 模式下用来推送更新的 HTTP 客户端和地址
+        self.webhook_client = None
+        self.webhook_url = None
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def _put(self, data: dict):
+        from telegram import Update
+        data["update_id"] = next(self.update_ids)
+        if self.webhook_client is not None:
+            asyncio.get_running_loop().create_task(self.webhook_client.post(
+                self.webhook_url, json=data, headers={"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET}
+            ))
+            return
+        self.application.update_queue.put_nowait(Update.de_json(data, self.application.bot))
+
+    def send_command(self, user_id: int, text: str):
+        command = text.split()[0]
+        self._put({"message": {
+            "message_id": next(self.user_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+        }})
+
+    def click(self, user_id: int, message_id: int, text: str, reply_markup: dict, data: str):
+        self._put({"callback_query": {
+            "id": str(next(self.callback_ids)),
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "LoadTestBot"},
+                "text": text,
+                "reply_markup": reply_markup,
+            },
+        }})
+
+    def on_message(self, chat_id: int, message_id: int, text: str, reply_markup):
+        done = self.active.get(chat_id)
+        if done is None or done.is_set():
+            return
+        if is_final(text):
+            done.set()
+            return
+        keyboard = (reply_markup or {}).get("inline_keyboard")
+        if keyboard:
+            data = pick_button(keyboard, self.rng)
+            if data is not None:
+                self.click(chat_id, message_id, text, reply_markup, data)
+
+    async def run_user(self, user_id: int):
+        for _ in range(self.args.jobs):
+            n = next(self.targets)
+            target = f"10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}"
+            command = f"/nexttrace {target}" if self.rng.random() < self.args.trace_ratio else f"/ping {target} 4"
+            done = asyncio.Event()
+            self.active[user_id] = done
+            start = time.perf_counter()
+            self.send_command(user_id, command)
+            try:
+                await asyncio.wait_for(done.wait(), timeout=self.args.timeout)
+                self.latencies.append(time.perf_counter() - start)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+            self.active.pop(user_id, None)
+
+    async def run(self) -> float:
+        start = time.perf_counter()
+        await asyncio.gather(*(self.run_user(FIRST_USER_ID + i) for i in range(self.args.users)))
+        return time.perf_counter() - start
+
+async def main_async(args):
+    nodes = [FakeSSHNode(delay=args.ssh_delay).start() for _ in range(args.nodes)]
+    workdir = tempfile.mkdtemp(prefix="netbot-load-")
+    write_config(workdir, nodes, args)
+    # config.py 从当前目录读取 config.json
+    os.chdir(workdir)
+
+    from telegram.ext import ApplicationBuilder
+    import bot
+    from latency import percentile
+
+    api = await FakeBotAPI(delay=args.api_delay).start()
+    builder = (
+        ApplicationBuilder().token(TOKEN).base_url(api.base_url)
+        .connection_pool_size(512).pool_timeout(30)
+    )
+    application = bot.build_application(builder)
+    load = LoadTest(application, api, args)
+    api.on_message = load.on_message
+
+    async with application:
+        await application.post_init(application)
+        await application.start()
+        webhook = None
+        if args.webhook:
+            import httpx
+            from updates import WebhookServer
+            webhook = await WebhookServer(application, "telegram", WEBHOOK_SECRET).start("127.0.0.1", 0)
+            load.webhook_url = f"http://127.0.0.1:{webhook.port}/telegram"
+            load.webhook_client = httpx.AsyncClient(limits=httpx.Limits(max_connections=64))
+        api.calls.clear()
+        elapsed = await load.run()
+        if webhook is not None:
+            await load.webhook_client.aclose()
+            await webhook.stop()
+        await application.stop()
+        await application.post_shutdown(application)
+    await api.stop()
+    for node in nodes:
+        node.stop()
+
+    completed = len(load.latencies)
+    ordered = sorted(load.latencies)
+    calls = sum(api.calls.values())
+    print(f"用户 {args.users} × 每人 {args.jobs} 次，路由追踪占比 {args.trace_ratio:.0%}，"
+          f"{args.nodes} 个节点（命令耗时 {args.ssh_delay}s），后端 {args.backend}，"
+          f"{'webhook' if args.webhook else '轮询'}模式，更新并发 {args.concurrency}")
+    print(f"完成: {completed}，超时: {load.timeouts}，用时 {elapsed:.2f}s")
+    print(f"吞吐: {completed / elapsed:.2f} jobs/s")
+    if ordered:
+        print(f"端到端延迟: P50 {percentile(ordered, 50) * 1000:.0f}ms  P90 {percentile(ordered, 90) * 1000:.0f}ms  "
+              f"P99 {percentile(ordered, 99) * 1000:.0f}ms  最大 {ordered[-1] * 1000:.0f}ms")
+    per_job = completed or 1
+    print(f"Telegram 调用: 共 {calls} 次，平均每次测试 {calls / per_job:.1f} 次（"
+          + "，".join(f"{method} {count / per_job:.1f}" for method, count in api.calls.most_common()) + "）")
+    print(f"节点上执行的命令: {sum(node.commands for node in nodes)}")
+    return load.timeouts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--jobs", type=int, default=4, help="每个用户依次发起的测试数")
+    parser.add_argument("--trace-ratio", type=float, default=0.3, help="路由追踪占全部测试的比例")
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--ssh-delay", type=float, default=0.5, help="节点上每条命令的耗时（秒）")
+    parser.add_argument("--api-delay", type=float, default=0.0, help="每个 Telegram API 请求的模拟耗时（秒）")
+    parser.add_argument("--telegram-rate", type=float, default=1000, help="发送队列的全局限速（真实 Telegram 约为 30）")
+    parser.add_argument("--backend", choices=("thread", "asyncssh"), default="thread")
+    parser.add_argument("--cache", action="store_true", help="启用结果缓存（默认关闭）")
+    parser.add_argument("--timeout", type=float, default=120, help="单次测试的超时时间（秒）")
+    parser.add_argument("--concurrency", type=int, default=16, help="同时处理的更新数（UPDATE_CONCURRENCY），1 为逐个处理")
+    parser.add_argument("--webhook", action="store_true", help="通过 webhook 监听推送更新")
+    args = parser.parse_args()
+    timeouts = asyncio.run(main_async(args))
+    sys.exit(1 if timeouts else 0)
+
+if __name__ == "__main__":
+    main()
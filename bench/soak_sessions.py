@@ -0,0 +1,100 @@
+"""
+会话存储的浸泡测试：大量用户反复发起交互操作，其中大部分中途放弃
+
+    python bench/soak_sessions.py [--users 100000] [--rounds 6] [--abandon 0.7] [--ttl 0.5]
+
+每一轮有 users 个从未出现过的用户各自发起一次 /ping（写入冷却计时和会话），
+其中 abandon 比例的用户放弃操作，其余用户正常完成（删除会话）。
+后台清理任务与实际运行时相同（sweep_sessions），只是 ttl 和清理间隔缩短。
+每轮结束后记录 tracemalloc 统计的内存占用和条目数：
+SessionStore 的内存应在前几轮后保持平稳，作为对照的普通 dict 则随轮数线性增长。
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from state import SessionStore, sweep_sessions
+
+def new_session(user_id: int) -> dict:
+    # 与 /ping 交互模式写入的会话相同
+    return {
+        "operation": "ping",
+        "mode": "interactive",
+        "server_info": None,
+        "target": None,
+        "count": None,
+        "chat_id": user_id,
+        "message_id": user_id * 10,
+    }
+
+async def run_round(sessions, cooldowns, first_user: int, users: int, abandon: float, rng: random.Random):
+    for user_id in range(first_user, first_user + users):
+        cooldowns[user_id] = time.time()
+        sessions[user_id] = new_session(user_id)
+        if rng.random() >= abandon:
+            del sessions[user_id]
+        if user_id % 5000 == 0:
+            # 模拟真实运行时事件循环上的其它任务，让清理任务有机会执行
+            await asyncio.sleep(0)
+
+async def soak(kind: str, args) -> list:
+    evicted = []
+    if kind == "SessionStore":
+        sessions = SessionStore(args.ttl, args.max_entries, on_evict=lambda key, value: evicted.append(key))
+        cooldowns = SessionStore(args.ttl, args.max_entries)
+        sweeper = asyncio.create_task(sweep_sessions((sessions, cooldowns), interval=args.ttl / 2))
+    else:
+        sessions, cooldowns, sweeper = {}, {}, None
+
+    rng = random.Random(0)
+    rows = []
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for r in range(args.rounds):
+        start = time.perf_counter()
+        await run_round(sessions, cooldowns, r * args.users, args.users, args.abandon, rng)
+        elapsed = time.perf_counter() - start
+        # 等待本轮放弃的会话过期并被清理
+        await asyncio.sleep(args.ttl * 1.5)
+        # 过期回调只用来计数，清空列表避免把它自身的增长算进去
+        cleaned = len(evicted)
+        evicted.clear()
+        rows.append((r + 1, len(sessions), len(cooldowns), cleaned, tracemalloc.get_traced_memory()[0] - base, elapsed))
+    tracemalloc.stop()
+    if sweeper is not None:
+        sweeper.cancel()
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--rounds", type=int, default=6)
+    parser.add_argument("--abandon", type=float, default=0.7)
+    parser.add_argument("--ttl", type=float, default=0.5)
+    parser.add_argument("--max-entries", type=int, default=10000)
+    args = parser.parse_args()
+
+    results = {}
+    for kind in ("dict", "SessionStore"):
+        rows = asyncio.run(soak(kind, args))
+        results[kind] = rows
+        print(f"\n{kind}")
+        print(f"{'round':>6}{'sessions':>10}{'cooldowns':>11}{'cleaned':>9}{'memory':>12}{'ops/s':>11}")
+        for r, n_sessions, n_cooldowns, cleaned, memory, elapsed in rows:
+            print(f"{r:>6}{n_sessions:>10}{n_cooldowns:>11}{cleaned:>9}{memory / 1024:>10.0f}KB{args.users / elapsed:>11.0f}")
+
+    # 内存是否平稳：最后一轮不超过第二轮的 1.2 倍（第一轮包含 OrderedDict 扩容等一次性开销）
+    rows = results["SessionStore"]
+    flat = len(rows) < 2 or rows[-1][4] <= rows[1][4] * 1.2
+    print(f"\nSessionStore 内存{'保持平稳' if flat else '持续增长'}")
+    sys.exit(0 if flat else 1)
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,100 @@
+import asyncio
 from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, filters
-from config import BOT_TOKEN
-from commands import start_command, ping_command, nexttrace_command, add_user_command, rm_user_command, add_server_command, rm_server_command, install_nexttrace_command
+from config import BOT_TOKEN, SERVERS, METRICS, UPDATE_CONCURRENCY, WEBHOOK, watch_config, flush_config
+from commands import start_command, ping_command, pingall_command, nexttrace_command, add_user_command, rm_user_command, add_server_command, rm_server_command, install_nexttrace_command, stats_command, monitor_command, history_command, mtr_command
 from handlers import callback_handler, handle_message
+from network import ssh_pool, async_ssh_pool, active_pool, discard_server_connections
+from outbox import outbox
+from ratelimit import command_limiter
+from state import user_data, sweep_sessions
+from utils import delete_session_messages
+from node_queue import node_scheduler
+from singleflight import inflight
+from metrics import registry, serve_metrics
+from updates import PerUserUpdateProcessor, run_webhook
+from monitor import monitor
+from measurements import measurement_store, MEASUREMENTS_ENABLED
+from history import shutdown_chart_pool
 
-def main():
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+def _server_key(server_info: dict) -> tuple:
+    return (server_info['host'], int(server_info['port']), server_info['username'], server_info.get('password'))
+
+def on_config_reload(old_servers: list):
+    # 手动修改 config.json 后，关闭已删除或已修改的服务器的连接
+    current = {_server_key(s) for s in SERVERS}
+    for server_info in old_servers:
+        if _server_key(server_info) not in current:
+            discard_server_connections(server_info)
+    # 服务器或监测目标变化后立即增删探测任务
+    monitor.reconcile()
+
+def _thread_pool_queue_depth() -> int:
+    # asyncio.to_thread 使用事件循环的默认线程池，排队中的任务数即线程后端积压的远程命令数
+    executor = getattr(asyncio.get_running_loop(), "_default_executor", None)
+    work_queue = getattr(executor, "_work_queue", None)
+    return work_queue.qsize() if work_queue is not None else 0
+
+def register_gauges():
+    registry.gauge("netbot_jobs", "节点任务队列中的任务数", lambda: {
+        ("running",): node_scheduler.stats()["running"],
+        ("queued",): node_scheduler.stats()["queued"],
+    }, ("state",))
+    registry.gauge("netbot_inflight_tests", "正在执行的不同测试数（相同测试合并后）", lambda: inflight.stats()["in_flight"])
+    registry.gauge("netbot_thread_pool_queue_depth", "默认线程池中等待执行的任务数", _thread_pool_queue_depth)
+    registry.gauge("netbot_sessions", "交互会话数", lambda: {
+        ("waiting",): user_data.stats()["entries"],
+        ("running",): user_data.stats()["pinned"],
+    }, ("state",))
+    registry.gauge("netbot_telegram_pending", "Telegram 发送队列中等待发送的请求数", lambda: outbox.stats()["pending"])
+    registry.gauge("netbot_ssh_connections", "连接池中的 SSH 连接数", lambda: active_pool().stats()["connections"])
+
+_background_tasks = []
+_metrics_server = None
+
+async def on_startup(application):
+    global _metrics_server
+    # 会话过期或被淘汰时删除它留下的提示消息
+    user_data.on_evict = lambda user_id, info: application.create_task(delete_session_messages(application.bot, info))
+    _background_tasks.append(asyncio.create_task(watch_config(on_config_reload)))
+    _background_tasks.append(asyncio.create_task(sweep_sessions((user_data,) + command_limiter.stores())))
+    if MEASUREMENTS_ENABLED:
+        await measurement_store.start()
+    _background_tasks.append(monitor.start(application.bot))
+    if METRICS.get('enabled'):
+        register_gauges()
+        _metrics_server = await serve_metrics(METRICS.get('host', '127.0.0.1'), METRICS.get('port', 9108))
+
+async def on_shutdown(application):
+    for task in _background_tasks:
+        task.cancel()
+    monitor.stop()
+    if _metrics_server is not None:
+        _metrics_server.close()
+    await flush_config()
+    await measurement_store.close()
+    shutdown_chart_pool()
+    await outbox.close()
+    ssh_pool.close_all()
+    if async_ssh_pool is not None:
+        async_ssh_pool.close_all()
+
+def build_application(builder: ApplicationBuilder = None):
+    """
+    构建并注册好所有处理器的 Application
+
+    参数:
+        builder: 可选，预先配置好的 ApplicationBuilder（如压测时指向本地的 Bot API 替身），默认使用 BOT_TOKEN
+    """
+    if builder is None:
+        builder = ApplicationBuilder().token(BOT_TOKEN)
+    if UPDATE_CONCURRENCY > 1:
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY))
+    application = builder.post_init(on_startup).post_shutdown(on_shutdown).build()
 
     # 注册用户命令
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("ping", ping_command))
+    application.add_handler(CommandHandler("pingall", pingall_command))
     application.add_handler(CommandHandler("nexttrace", nexttrace_command))
 
     # 注册管理员命令
@@ -17,12 +103,22 @@ def main():
     application.add_handler(CommandHandler("addserver", add_server_command))
     application.add_handler(CommandHandler("rmserver", rm_server_command))
     application.add_handler(CommandHandler("install_nexttrace", install_nexttrace_command))
+    application.add_handler(CommandHandler("monitor", monitor_command))
+    application.add_handler(CommandHandler("history", history_command))
+    application.add_handler(CommandHandler("mtr", mtr_command))
+    application.add_handler(CommandHandler("stats", stats_command))
 
     # 注册回调和消息处理
     application.add_handler(CallbackQueryHandler(callback_handler))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    return application
 
-    application.run_polling()
+def main():
+    application = build_application()
+    if WEBHOOK.get('enabled'):
+        run_webhook(application, WEBHOOK)
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
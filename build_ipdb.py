@@ -0,0 +1,60 @@
+"""
+生成本地 IP 归属数据库的索引文件（供 ipdb.py 使用）
+
+    python build_ipdb.py ip2asn-combined.tsv.gz ipdb.bin
+    python build_ipdb.py prefixes.csv ipdb.bin
+
+支持两种输入（可以是 .gz 压缩文件）：
+  - iptoasn.com 的 TSV：起始地址<TAB>结束地址<TAB>ASN<TAB>国家代码<TAB>AS 名称（ASN 为 0 的未路由地址段会被跳过）
+  - CSV：前缀,ASN,AS 名称,地区（如 203.0.113.0/24,64500,EXAMPLE-NET,美国 加利福尼亚），嵌套的前缀按最长前缀匹配
+
+新文件先写入临时文件再原子替换，运行中的机器人会在下一次检查时自动切换，无需重启。
+"""
+import csv
+import gzip
+import time
+import argparse
+import ipaddress
+from ipdb import build_index
+
+def _open(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
+
+def read_records(path: str):
+    """逐行读取输入文件，生成 (起始地址, 结束地址, ASN, AS 名称, 地区)"""
+    with _open(path) as f:
+        for row in csv.reader(f, delimiter="\t" if ".tsv" in path else ","):
+            if not row or row[0].startswith("#"):
+                continue
+            try:
+                if "/" in row[0]:
+                    network = ipaddress.ip_network(row[0].strip(), strict=False)
+                    start, end = network.network_address, network.broadcast_address
+                    asn = int(row[1].strip().upper().removeprefix("AS"))
+                    name = row[2].strip() if len(row) > 2 else ""
+                    geo = row[3].strip() if len(row) > 3 else ""
+                else:
+                    start, end = ipaddress.ip_address(row[0].strip()), ipaddress.ip_address(row[1].strip())
+                    asn = int(row[2])
+                    geo = row[3].strip() if len(row) > 3 and row[3] != "None" else ""
+                    name = row[4].strip() if len(row) > 4 else ""
+            except (ValueError, IndexError):
+                continue
+            if asn == 0 or start.version != end.version:
+                continue
+            yield start, end, asn, name, geo
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="TSV 或 CSV 输入文件")
+    parser.add_argument("output", nargs="?", default="ipdb.bin", help="输出的索引文件（默认 ipdb.bin）")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    v4, v6 = build_index(read_records(args.input), args.output)
+    print(f"已生成 {args.output}：IPv4 {v4} 段，IPv6 {v6} 段，耗时 {time.perf_counter() - start:.1f} 秒")
+
+if __name__ == "__main__":
+    main()
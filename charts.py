@@ -0,0 +1,49 @@
+import io
+from datetime import datetime
+
+try:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+except ImportError:  # matplotlib 为可选依赖，未安装时 /history 只返回文字统计
+    matplotlib = None
+
+CHARTS_AVAILABLE = matplotlib is not None
+
+def _nan(values: list) -> list:
+    # 没有数据的点画成断开的线
+    return [float("nan") if v is None else v for v in values]
+
+def render_latency_chart(title: str, series: list) -> bytes:
+    """
+    绘制各节点平均延迟和丢包率随时间变化的 PNG 图
+
+    在进程池中执行，参数和返回值都只包含基本类型。
+
+    参数:
+        title: 图的标题
+        series: [(节点名称, [时间戳], [平均延迟（毫秒）或 None], [丢包率（%）或 None])]
+    """
+    fig, (ax_latency, ax_loss) = plt.subplots(
+        2, 1, figsize=(9, 5), sharex=True, gridspec_kw={"height_ratios": [3, 1]}
+    )
+    try:
+        for name, timestamps, avgs, losses in series:
+            times = [datetime.fromtimestamp(ts) for ts in timestamps]
+            ax_latency.plot(times, _nan(avgs), label=name, linewidth=1)
+            ax_loss.plot(times, _nan(losses), linewidth=1)
+        ax_latency.set_title(title)
+        ax_latency.set_ylabel("latency (ms)")
+        ax_loss.set_ylabel("loss (%)")
+        ax_loss.set_ylim(bottom=0)
+        for ax in (ax_latency, ax_loss):
+            ax.grid(True, alpha=0.3)
+        if len(series) > 1:
+            ax_latency.legend(fontsize="small")
+        fig.autofmt_xdate()
+        fig.tight_layout()
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", dpi=100)
+        return buf.getvalue()
+    finally:
+        plt.close(fig)
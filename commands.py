@@ -1,45 +1,68 @@
-import time
+import html
+import math
 import ipaddress
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from config import SERVERS, ADMIN_USERS, AUTHORIZED_USERS, save_config
-from state import user_data, last_ping_command_time
-from tasks import do_ping_in_background, do_nexttrace_in_background
-from utils import schedule_delete_message, check_authorization, check_is_admin
+from config import SERVERS, ADMIN_USERS, AUTHORIZED_USERS, MONITOR_TARGETS, save_config
+from state import user_data
+from tasks import do_ping_in_background, do_nexttrace_in_background, do_pingall_in_background, do_mtr_in_background
+from outbox import outbox
+from utils import schedule_delete_message, check_authorization, check_is_admin, server_label, install_keyboard, INSTALL_PROMPT
+from resilience import open_breakers
+from node_queue import node_scheduler
+from network import ACTIVE_BACKEND, active_pool, discard_server_connections
+from result_cache import result_cache
+from singleflight import inflight
+from ratelimit import command_limiter
+from monitor import monitor, valid_target
+from measurements import measurement_store
+from ipdb import ip_database
+from history import history_report, parse_range, DEFAULT_RANGE, MAX_RANGE
+from mtr import DEFAULT_ROUNDS as MTR_DEFAULT_ROUNDS, MAX_ROUNDS as MTR_MAX_ROUNDS
 
 async def start_command(update, context):
     user_id = update.effective_user.id
     if not check_authorization(user_id, AUTHORIZED_USERS):
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "对不起，你没有权限使用本机器人\n\n"
             f"当前用户ID：`{user_id}`",
             parse_mode="Markdown"
         )
         return
 
-    await update.message.reply_text(
+    await outbox.reply_text(
+        update.message,
         "欢迎使用网络测试机器人！\n\n"
         "使用说明：\n"
         "1）Ping 测试：/ping 后按提示进行\n"
-        "2）路由追踪：/nexttrace 后按提示进行\n\n"
-        "管理员命令：/adduser, /rmuser, /addserver, /rmserver"
+        "   多节点 Ping：/pingall <目标> [次数]\n"
+        "2）路由追踪：/nexttrace 后按提示进行\n"
+        "   MTR 报告：/mtr <目标> [节点] [轮数]\n\n"
+        "管理员命令：/adduser, /rmuser, /addserver, /rmserver, /stats"
     )
 
+async def rate_limited(update, user_id: int, command: str) -> bool:
+    """按 (用户, 命令) 的令牌桶检查频率限制（管理员不受限制），超出限制时回复需要等待的时间"""
+    wait = command_limiter.acquire(user_id, command, exempt=check_is_admin(user_id, ADMIN_USERS))
+    if not wait:
+        return False
+    await outbox.reply_text(
+        update.message,
+        f"请 {math.ceil(wait)} 秒后再使用 /{command} 命令（{command_limiter.describe(command)}）。"
+    )
+    return True
+
 async def ping_command(update, context):
     user_id = update.effective_user.id
     if not check_authorization(user_id, AUTHORIZED_USERS):
-        await update.message.reply_text("对不起，你没有权限使用本机器人")
+        await outbox.reply_text(update.message, "对不起，你没有权限使用本机器人")
         return
 
-    now_ts = time.time()
-    if user_id in last_ping_command_time:
-        elapsed = now_ts - last_ping_command_time[user_id]
-        if elapsed < 15:
-            await update.message.reply_text(f"你在 {15 - int(elapsed)} 秒后才能再次使用 /ping 命令（每15秒限制一次）。")
-            return
-    last_ping_command_time[user_id] = now_ts
+    if await rate_limited(update, user_id, "ping"):
+        return
 
     if not SERVERS:
-        await update.message.reply_text("当前没有配置可用的服务器，请联系管理员。")
+        await outbox.reply_text(update.message, "当前没有配置可用的服务器，请联系管理员。")
         return
 
     if user_id in user_data:
@@ -51,18 +74,19 @@ async def ping_command(update, context):
         try:
             ping_count = int(args[1]) if len(args) >= 2 else 4
         except ValueError:
-            await update.message.reply_text("输入的Ping次数无效，请输入数字！")
+            await outbox.reply_text(update.message, "输入的Ping次数无效，请输入数字！")
             return
         if ping_count > 50:
             ping_count = 50
 
         keyboard = []
         for idx, server_info in enumerate(SERVERS):
-            btn = InlineKeyboardButton(server_info['name'], callback_data=f"server_{idx}")
+            btn = InlineKeyboardButton(server_label(server_info), callback_data=f"server_{idx}")
             keyboard.append([btn])
+        keyboard.append([InlineKeyboardButton("全部节点", callback_data="server_all")])
         reply_markup = InlineKeyboardMarkup(keyboard)
         text = f"你输入了：目标= {ip_or_domain} , 次数= {ping_count} 次\n请选择服务器："
-        msg = await update.message.reply_text(text, reply_markup=reply_markup)
+        msg = await outbox.reply_text(update.message, text, reply_markup=reply_markup)
         user_data[user_id] = {
             "operation": "ping",
             "mode": "cmd",
@@ -75,11 +99,12 @@ async def ping_command(update, context):
     else:
         keyboard = []
         for idx, server_info in enumerate(SERVERS):
-            btn = InlineKeyboardButton(server_info['name'], callback_data=f"server_{idx}")
+            btn = InlineKeyboardButton(server_label(server_info), callback_data=f"server_{idx}")
             keyboard.append([btn])
+        keyboard.append([InlineKeyboardButton("全部节点", callback_data="server_all")])
         reply_markup = InlineKeyboardMarkup(keyboard)
         text = "请选择要进行 Ping 测试的服务器："
-        msg = await update.message.reply_text(text, reply_markup=reply_markup)
+        msg = await outbox.reply_text(update.message, text, reply_markup=reply_markup)
         user_data[user_id] = {
             "operation": "ping",
             "mode": "interactive",
@@ -93,19 +118,14 @@ async def ping_command(update, context):
 async def nexttrace_command(update, context):
     user_id = update.effective_user.id
     if not check_authorization(user_id, AUTHORIZED_USERS):
-        await update.message.reply_text("对不起，你没有权限使用本机器人")
+        await outbox.reply_text(update.message, "对不起，你没有权限使用本机器人")
         return
 
-    now_ts = time.time()
-    if user_id in last_ping_command_time:
-        elapsed = now_ts - last_ping_command_time[user_id]
-        if elapsed < 10:
-            await update.message.reply_text(f"你在 {10 - int(elapsed)} 秒后才能再次使用命令（每10秒限制一次）。")
-            return
-    last_ping_command_time[user_id] = now_ts
+    if await rate_limited(update, user_id, "nexttrace"):
+        return
 
     if not SERVERS:
-        await update.message.reply_text("当前没有配置可用的服务器，请联系管理员。")
+        await outbox.reply_text(update.message, "当前没有配置可用的服务器，请联系管理员。")
         return
 
     if user_id in user_data:
@@ -124,7 +144,7 @@ async def nexttrace_command(update, context):
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         text = f"你输入了目标： {target}\n请选择追踪模式："
-        msg = await update.message.reply_text(text, reply_markup=reply_markup)
+        msg = await outbox.reply_text(update.message, text, reply_markup=reply_markup)
         user_data[user_id] = {
             "operation": "nexttrace",
             "mode": "cmd",
@@ -145,7 +165,7 @@ async def nexttrace_command(update, context):
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         text = "请选择路由追踪模式："
-        msg = await update.message.reply_text(text, reply_markup=reply_markup)
+        msg = await outbox.reply_text(update.message, text, reply_markup=reply_markup)
         user_data[user_id] = {
             "operation": "nexttrace",
             "mode": "interactive",
@@ -157,11 +177,55 @@ async def nexttrace_command(update, context):
             "message_id": msg.message_id
         }
 
+async def pingall_command(update, context):
+    user_id = update.effective_user.id
+    if not check_authorization(user_id, AUTHORIZED_USERS):
+        await outbox.reply_text(update.message, "对不起，你没有权限使用本机器人")
+        return
+
+    args = context.args
+    if len(args) < 1:
+        await outbox.reply_text(update.message, "用法：/pingall <目标IP或域名> [次数]\n将从所有节点同时 Ping 目标。")
+        return
+    if not valid_target(args[0]):
+        await outbox.reply_text(update.message, f"无效的目标：{args[0]}\n请输入 IP 地址或域名。")
+        return
+
+    if await rate_limited(update, user_id, "pingall"):
+        return
+
+    if not SERVERS:
+        await outbox.reply_text(update.message, "当前没有配置可用的服务器，请联系管理员。")
+        return
+
+    target = args[0]
+    try:
+        ping_count = int(args[1]) if len(args) >= 2 else 4
+    except ValueError:
+        await outbox.reply_text(update.message, "输入的Ping次数无效，请输入数字！")
+        return
+    if ping_count > 50:
+        ping_count = 50
+
+    msg = await outbox.reply_text(update.message, f"已收到请求，正在从 {len(SERVERS)} 个节点同时执行 Ping 操作，请稍候...")
+    user_data[user_id] = {
+        "operation": "pingall",
+        "mode": "cmd",
+        "target": target,
+        "count": ping_count,
+        "chat_id": msg.chat_id,
+        "message_id": msg.message_id
+    }
+    context.application.create_task(
+        do_pingall_in_background(context, msg.chat_id, list(SERVERS), target, ping_count, user_id)
+    )
+
 # ---------------- 管理员命令 ----------------
 async def add_user_command(update, context):
     user_id = update.effective_user.id
     if not check_is_admin(user_id, ADMIN_USERS):
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "你不是管理员，无法执行此操作。\n\n"
             f"当前用户ID：`{user_id}`",
             parse_mode="Markdown"
@@ -170,26 +234,27 @@ async def add_user_command(update, context):
 
     args = context.args
     if len(args) < 1:
-        await update.message.reply_text("用法：/adduser <user_id>")
+        await outbox.reply_text(update.message, "用法：/adduser <user_id>")
         return
 
     try:
         new_user_id = int(args[0])
     except ValueError:
-        await update.message.reply_text("请输入正确的 user_id（数字）。")
+        await outbox.reply_text(update.message, "请输入正确的 user_id（数字）。")
         return
 
     if new_user_id in AUTHORIZED_USERS:
-        await update.message.reply_text(f"用户 {new_user_id} 已经在授权名单中。")
+        await outbox.reply_text(update.message, f"用户 {new_user_id} 已经在授权名单中。")
     else:
         AUTHORIZED_USERS.append(new_user_id)
         save_config()
-        await update.message.reply_text(f"成功添加用户 {new_user_id} 到授权名单。")
+        await outbox.reply_text(update.message, f"成功添加用户 {new_user_id} 到授权名单。")
 
 async def rm_user_command(update, context):
     user_id = update.effective_user.id
     if not check_is_admin(user_id, ADMIN_USERS):
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "你不是管理员，无法执行此操作。\n\n"
             f"当前用户ID：`{user_id}`",
             parse_mode="Markdown"
@@ -198,26 +263,27 @@ async def rm_user_command(update, context):
 
     args = context.args
     if len(args) < 1:
-        await update.message.reply_text("用法：/rmuser <user_id>")
+        await outbox.reply_text(update.message, "用法：/rmuser <user_id>")
         return
 
     try:
         del_user_id = int(args[0])
     except ValueError:
-        await update.message.reply_text("请输入正确的 user_id（数字）。")
+        await outbox.reply_text(update.message, "请输入正确的 user_id（数字）。")
         return
 
     if del_user_id in AUTHORIZED_USERS:
         AUTHORIZED_USERS.remove(del_user_id)
         save_config()
-        await update.message.reply_text(f"已将用户 {del_user_id} 从授权名单中移除。")
+        await outbox.reply_text(update.message, f"已将用户 {del_user_id} 从授权名单中移除。")
     else:
-        await update.message.reply_text(f"用户 {del_user_id} 不在授权名单中。")
+        await outbox.reply_text(update.message, f"用户 {del_user_id} 不在授权名单中。")
 
 async def add_server_command(update, context):
     user_id = update.effective_user.id
     if not check_is_admin(user_id, ADMIN_USERS):
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "你不是管理员，无法执行此操作。\n\n"
             f"当前用户ID：`{user_id}`",
             parse_mode="Markdown"
@@ -229,7 +295,8 @@ async def add_server_command(update, context):
     # 如果命令没有带参数，启动交互式添加服务器流程
     if message_text == "/addserver":
         # 启动交互式添加服务器流程
-        msg = await update.message.reply_text(
+        msg = await outbox.reply_text(
+            update.message,
             "欢迎使用交互式添加服务器向导！\n\n"
             "请按照提示一步一步输入服务器信息。\n"
             "步骤 1/5: 请输入服务器名称（如：日本 - Acck）：\n\n"
@@ -247,7 +314,8 @@ async def add_server_command(update, context):
         
         # 删除用户的命令消息，保持界面整洁
         try:
-            await context.bot.delete_message(
+            await outbox.delete_message(
+                context.bot,
                 chat_id=update.message.chat_id,
                 message_id=update.message.message_id
             )
@@ -262,7 +330,8 @@ async def add_server_command(update, context):
             # 删除上一条提示消息
             if user_data[user_id].get("prompt_message_id"):
                 try:
-                    await context.bot.delete_message(
+                    await outbox.delete_message(
+                        context.bot,
                         chat_id=update.message.chat_id,
                         message_id=user_data[user_id]["prompt_message_id"]
                     )
@@ -270,28 +339,30 @@ async def add_server_command(update, context):
                     pass  # 忽略删除失败的错误
                     
             del user_data[user_id]
-            cancel_msg = await update.message.reply_text("✅ 已取消添加服务器操作。")
+            cancel_msg = await outbox.reply_text(update.message, "✅ 已取消添加服务器操作。")
             
             # 5秒后自动删除取消消息
             context.application.create_task(schedule_delete_message(context, update.message.chat_id, cancel_msg.message_id, delay=5))
             
             # 删除用户的取消命令
             try:
-                await context.bot.delete_message(
+                await outbox.delete_message(
+                    context.bot,
                     chat_id=update.message.chat_id,
                     message_id=update.message.message_id
                 )
             except Exception:
                 pass  # 忽略删除失败的错误
         else:
-            await update.message.reply_text("当前没有正在进行的添加服务器操作。")
+            await outbox.reply_text(update.message, "当前没有正在进行的添加服务器操作。")
         return
     
     # 处理带参数的情况（兼容原有的一次性添加方式）
     if ' ' in message_text:
         args_text = message_text.split(' ', 1)[1]
     else:
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "您可以通过以下两种方式添加服务器：\n\n"
             "1. 直接输入 /addserver 启动交互式添加向导\n"
             "2. 一次性提供所有参数：\n"
@@ -305,11 +376,12 @@ async def add_server_command(update, context):
         import shlex
         args = shlex.split(args_text)
     except Exception as e:
-        await update.message.reply_text(f"参数解析错误：{str(e)}\n\n请确保如果名称中包含空格，应该用引号括起来。")
+        await outbox.reply_text(update.message, f"参数解析错误：{str(e)}\n\n请确保如果名称中包含空格，应该用引号括起来。")
         return
     
     if len(args) < 5:
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "您可以通过以下两种方式添加服务器：\n\n"
             "1. 直接输入 /addserver 启动交互式添加向导\n"
             "2. 一次性提供所有参数：\n"
@@ -324,7 +396,7 @@ async def add_server_command(update, context):
     try:
         port = int(args[2])
     except ValueError:
-        await update.message.reply_text("端口号必须是数字，请重新输入。")
+        await outbox.reply_text(update.message, "端口号必须是数字，请重新输入。")
         return
     username = args[3]
     password = args[4]
@@ -340,12 +412,13 @@ async def add_server_command(update, context):
     SERVERS.append(new_server)
     save_config()
 
-    await update.message.reply_text(f"成功添加服务器：{name} ({host}:{port})")
+    await outbox.reply_text(update.message, f"成功添加服务器：{name} ({host}:{port})")
 
 async def rm_server_command(update, context):
     user_id = update.effective_user.id
     if not check_is_admin(user_id, ADMIN_USERS):
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "你不是管理员，无法执行此操作。\n\n"
             f"当前用户ID：`{user_id}`",
             parse_mode="Markdown"
@@ -357,13 +430,13 @@ async def rm_server_command(update, context):
     # 如果命令没有带参数，显示可选的服务器列表
     if message_text == "/rmserver":
         if not SERVERS:
-            await update.message.reply_text("当前没有配置任何服务器。")
+            await outbox.reply_text(update.message, "当前没有配置任何服务器。")
             return
             
         keyboard = []
         for idx, server_info in enumerate(SERVERS):
             btn = InlineKeyboardButton(
-                f"{server_info['name']} ({server_info['host']}:{server_info['port']})", 
+                server_label(server_info, with_address=True),
                 callback_data=f"rmserver_{idx}"
             )
             keyboard.append([btn])
@@ -372,7 +445,8 @@ async def rm_server_command(update, context):
         keyboard.append([InlineKeyboardButton("取消", callback_data="rmserver_cancel")])
         
         reply_markup = InlineKeyboardMarkup(keyboard)
-        msg = await update.message.reply_text(
+        msg = await outbox.reply_text(
+            update.message,
             "请选择要删除的服务器：",
             reply_markup=reply_markup
         )
@@ -386,7 +460,8 @@ async def rm_server_command(update, context):
         
         # 删除用户的命令消息，保持界面整洁
         try:
-            await context.bot.delete_message(
+            await outbox.delete_message(
+                context.bot,
                 chat_id=update.message.chat_id,
                 message_id=update.message.message_id
             )
@@ -402,14 +477,14 @@ async def rm_server_command(update, context):
             import shlex
             args = shlex.split(args_text)
         except Exception as e:
-            await update.message.reply_text(f"参数解析错误：{str(e)}\n\n请确保如果名称中包含空格，应该用引号括起来。")
+            await outbox.reply_text(update.message, f"参数解析错误：{str(e)}\n\n请确保如果名称中包含空格，应该用引号括起来。")
             return
     else:
-        await update.message.reply_text("直接输入 /rmserver 可以查看所有服务器并选择要删除的服务器。\n\n如果要直接指定删除，用法：/rmserver <服务器名字>\n如果服务器名称包含空格，请用引号括起来，例如：\n/rmserver \"日本 - Acck\"")
+        await outbox.reply_text(update.message, "直接输入 /rmserver 可以查看所有服务器并选择要删除的服务器。\n\n如果要直接指定删除，用法：/rmserver <服务器名字>\n如果服务器名称包含空格，请用引号括起来，例如：\n/rmserver \"日本 - Acck\"")
         return
     
     if len(args) < 1:
-        await update.message.reply_text("直接输入 /rmserver 可以查看所有服务器并选择要删除的服务器。\n\n如果要直接指定删除，用法：/rmserver <服务器名字>\n如果服务器名称包含空格，请用引号括起来，例如：\n/rmserver \"日本 - Acck\"")
+        await outbox.reply_text(update.message, "直接输入 /rmserver 可以查看所有服务器并选择要删除的服务器。\n\n如果要直接指定删除，用法：/rmserver <服务器名字>\n如果服务器名称包含空格，请用引号括起来，例如：\n/rmserver \"日本 - Acck\"")
         return
 
     target_name = args[0]
@@ -420,18 +495,20 @@ async def rm_server_command(update, context):
             break
 
     if found_index is None:
-        await update.message.reply_text(f"未找到服务器名称：{target_name}，请确认输入是否正确。")
+        await outbox.reply_text(update.message, f"未找到服务器名称：{target_name}，请确认输入是否正确。")
     else:
         removed_server = SERVERS.pop(found_index)
         save_config()
-        result_msg = await update.message.reply_text(f"成功删除服务器：{removed_server['name']} (host={removed_server['host']})")
+        discard_server_connections(removed_server)
+        result_msg = await outbox.reply_text(update.message, f"成功删除服务器：{removed_server['name']} (host={removed_server['host']})")
         
         # 5秒后自动删除结果消息
         context.application.create_task(schedule_delete_message(context, update.message.chat_id, result_msg.message_id, delay=5))
         
         # 删除用户的命令消息，保持界面整洁
         try:
-            await context.bot.delete_message(
+            await outbox.delete_message(
+                context.bot,
                 chat_id=update.message.chat_id,
                 message_id=update.message.message_id
             )
@@ -441,7 +518,8 @@ async def rm_server_command(update, context):
 async def install_nexttrace_command(update, context):
     user_id = update.effective_user.id
     if not check_is_admin(user_id, ADMIN_USERS):
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "你不是管理员，无法执行此操作。\n\n"
             f"当前用户ID：`{user_id}`",
             parse_mode="Markdown"
@@ -449,39 +527,259 @@ async def install_nexttrace_command(update, context):
         return
 
     if not SERVERS:
-        await update.message.reply_text("当前没有配置任何服务器。\n请先使用 /addserver 添加服务器。")
+        await outbox.reply_text(update.message, "当前没有配置任何服务器。\n请先使用 /addserver 添加服务器。")
         return
         
     # 删除用户的命令消息
     try:
-        await context.bot.delete_message(
+        await outbox.delete_message(
+            context.bot,
             chat_id=update.message.chat_id,
             message_id=update.message.message_id
         )
     except Exception:
         pass  # 忽略删除失败的错误
         
-    # 显示服务器列表供用户选择要安装的服务器
-    keyboard = []
-    for idx, server_info in enumerate(SERVERS):
-        btn = InlineKeyboardButton(
-            f"{server_info['name']} ({server_info['host']}:{server_info['port']})", 
-            callback_data=f"installnexttrace_{idx}"
-        )
-        keyboard.append([btn])
-    
-    # 添加取消按钮
-    keyboard.append([InlineKeyboardButton("取消", callback_data="installnexttrace_cancel")])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    msg = await update.message.reply_text(
-        "请选择要安装 NextTrace 的服务器：",
-        reply_markup=reply_markup
+    # 显示服务器列表，可以选择多台服务器或全部安装
+    msg = await outbox.reply_text(
+        update.message,
+        INSTALL_PROMPT,
+        reply_markup=install_keyboard(SERVERS, set())
     )
     
     user_data[user_id] = {
         "operation": "installnexttrace",
         "chat_id": msg.chat_id,
         "message_id": msg.message_id,
-        "prompt_message_id": msg.message_id  # 保存消息ID，方便后续删除
+        "prompt_message_id": msg.message_id,  # 保存消息ID，方便后续删除
+        "selected": set()
     }
+
+async def stats_command(update, context):
+    user_id = update.effective_user.id
+    if not check_is_admin(user_id, ADMIN_USERS):
+        await outbox.reply_text(
+            update.message,
+            "你不是管理员，无法执行此操作。\n\n"
+            f"当前用户ID：`{user_id}`",
+            parse_mode="Markdown"
+        )
+        return
+
+    pool_stats = active_pool().stats()
+    outbox_stats = outbox.stats()
+    queue_stats = node_scheduler.stats()
+    cache_stats = result_cache.stats()
+    flight_stats = inflight.stats()
+    session_stats = user_data.stats()
+    monitor_stats = monitor.stats()
+    store_stats = measurement_store.stats()
+    ipdb_stats = ip_database.stats()
+    if ipdb_stats['loaded']:
+        ipdb_text = (f"IPv4 {ipdb_stats['v4_ranges']} 段，IPv6 {ipdb_stats['v6_ranges']} 段\n"
+                     f"已查询: {ipdb_stats['lookups']} 个地址（加载 {ipdb_stats['reloads']} 次）\n")
+    else:
+        ipdb_text = "未加载\n"
+    total = pool_stats["hits"] + pool_stats["misses"]
+    hit_rate = f"{pool_stats['hits'] / total * 100:.1f}%" if total else "-"
+    await outbox.reply_text(
+        update.message,
+        "<b>【运行统计】</b>\n\n"
+        f"<b>SSH 连接池</b> ({ACTIVE_BACKEND}):\n"
+        f"复用命中: {pool_stats['hits']}\n"
+        f"新建连接: {pool_stats['misses']}\n"
+        f"命中率: {hit_rate}\n"
+        f"断线重连: {pool_stats['reconnects']}\n"
+        f"空闲回收: {pool_stats['evictions']}\n"
+        f"当前连接数: {pool_stats['connections']}\n"
+        f"活跃会话数: {pool_stats['active_sessions']}\n\n"
+        "<b>Telegram 发送队列</b>:\n"
+        f"已发送: {outbox_stats['sent']}\n"
+        f"合并的编辑: {outbox_stats['coalesced']}\n"
+        f"跳过的重复编辑: {outbox_stats['skipped']}\n"
+        f"触发频率限制: {outbox_stats['rate_limited']}\n"
+        f"排队中: {outbox_stats['pending']}\n\n"
+        "<b>节点任务队列</b>:\n"
+        f"运行中: {queue_stats['running']}\n"
+        f"排队中: {queue_stats['queued']}\n"
+        f"繁忙节点数: {queue_stats['busy_nodes']}\n\n"
+        "<b>结果缓存</b>:\n"
+        f"命中: {cache_stats['hits']}\n"
+        f"未命中: {cache_stats['misses']}\n"
+        f"缓存条目: {cache_stats['entries']}（约 {cache_stats['bytes'] // 1024} KB）\n"
+        f"容量淘汰: {cache_stats['evictions']}\n\n"
+        "<b>相同测试合并</b>:\n"
+        f"远程执行次数: {flight_stats['executions']}\n"
+        f"合并节省的执行: {flight_stats['saved']}\n"
+        f"进行中: {flight_stats['in_flight']}\n\n"
+        "<b>交互会话</b>:\n"
+        f"等待输入: {session_stats['entries']}\n"
+        f"执行中: {session_stats['pinned']}\n"
+        f"超时清理: {session_stats['expired']}\n"
+        f"超出上限淘汰: {session_stats['evicted']}\n\n"
+        "<b>命令频率限制</b>:\n"
+        f"拒绝的请求: {command_limiter.rejected}\n\n"
+        "<b>定时监测</b>:\n"
+        f"目标数: {monitor_stats['targets']}（探测任务 {monitor_stats['tasks']} 个）\n"
+        f"已完成探测: {monitor_stats['probes']}\n"
+        f"告警中: {monitor_stats['alerting']}（累计告警 {monitor_stats['alerts']} 次）\n"
+        f"路由追踪: {monitor_stats['traces']} 次（路径变化 {monitor_stats['route_changes']} 次）\n\n"
+        "<b>测量结果存储</b>:\n"
+        f"已写入: {store_stats['written']} 条（{store_stats['batches']} 批）\n"
+        f"待写入: {store_stats['pending']}，丢弃: {store_stats['dropped']}\n"
+        f"数据库大小: {store_stats['bytes'] // 1024} KB\n\n"
+        "<b>本地 IP 数据库</b>:\n"
+        f"{ipdb_text}\n"
+        "<b>熔断中的节点</b>:\n"
+        + ("\n".join(f"{html.escape(b.name)}（剩余 {int(b.remaining())} 秒）" for b in open_breakers()) or "无"),
+        parse_mode="HTML"
+    )
+
+MONITOR_USAGE = (
+    "用法：\n"
+    "/monitor add <目标> - 添加监测目标，所有节点定时 Ping 该目标\n"
+    "/monitor rm <目标> - 删除监测目标\n"
+    "/monitor list - 查看监测目标和各节点的最近结果"
+)
+
+async def monitor_command(update, context):
+    user_id = update.effective_user.id
+    if not check_is_admin(user_id, ADMIN_USERS):
+        await outbox.reply_text(
+            update.message,
+            "你不是管理员，无法执行此操作。\n\n"
+            f"当前用户ID：`{user_id}`",
+            parse_mode="Markdown"
+        )
+        return
+
+    args = context.args
+    action = args[0].lower() if args else "list"
+
+    if action == "list":
+        await outbox.reply_text(update.message, monitor.render_status(), parse_mode="HTML")
+        return
+
+    if action not in ("add", "rm") or len(args) < 2:
+        await outbox.reply_text(update.message, MONITOR_USAGE)
+        return
+
+    target = args[1]
+    if action == "add":
+        if not valid_target(target):
+            await outbox.reply_text(update.message, f"无效的目标：{target}\n请输入 IP 地址或域名。")
+            return
+        if target in MONITOR_TARGETS:
+            await outbox.reply_text(update.message, f"{target} 已在监测列表中。")
+            return
+        MONITOR_TARGETS.append(target)
+        save_config()
+        monitor.reconcile()
+        await outbox.reply_text(
+            update.message,
+            f"已添加监测目标：{target}\n将每 {monitor.interval:g} 秒从 {len(SERVERS)} 个节点 Ping 一次，超过阈值时通知管理员。"
+        )
+    else:
+        if target not in MONITOR_TARGETS:
+            await outbox.reply_text(update.message, f"{target} 不在监测列表中。")
+            return
+        MONITOR_TARGETS.remove(target)
+        save_config()
+        monitor.reconcile()
+        await outbox.reply_text(update.message, f"已删除监测目标：{target}")
+
+async def history_command(update, context):
+    user_id = update.effective_user.id
+    if not check_authorization(user_id, AUTHORIZED_USERS):
+        await outbox.reply_text(update.message, "对不起，你没有权限使用本机器人")
+        return
+
+    args = context.args
+    if not args:
+        await outbox.reply_text(
+            update.message,
+            "用法：/history <目标> [节点] [时间范围]\n"
+            f"时间范围如 30m、6h、24h、7d、4w，默认 {DEFAULT_RANGE}，最长 {MAX_RANGE}。\n"
+            "不指定节点时显示所有节点。"
+        )
+        return
+
+    if not measurement_store.running:
+        await outbox.reply_text(update.message, "未启用测量结果存储，没有历史数据。")
+        return
+
+    target = args[0]
+    range_text = DEFAULT_RANGE
+    node_name = None
+    for arg in args[1:]:
+        if parse_range(arg) is not None:
+            range_text = arg
+        else:
+            node_name = arg
+
+    if parse_range(range_text) > parse_range(MAX_RANGE):
+        await outbox.reply_text(update.message, f"时间范围最长为 {MAX_RANGE}。")
+        return
+    if node_name is not None and not any(s['name'] == node_name for s in SERVERS):
+        await outbox.reply_text(update.message, f"未找到节点：{node_name}")
+        return
+
+    if await rate_limited(update, user_id, "history"):
+        return
+
+    node_names = [node_name] if node_name is not None else [s['name'] for s in SERVERS]
+    report = await history_report(target, node_names, range_text)
+    await outbox.reply_text(update.message, report.text, parse_mode="HTML")
+    if report.chart is not None:
+        await outbox.reply_photo(update.message, report.chart)
+
+async def mtr_command(update, context):
+    user_id = update.effective_user.id
+    if not check_authorization(user_id, AUTHORIZED_USERS):
+        await outbox.reply_text(update.message, "对不起，你没有权限使用本机器人")
+        return
+
+    args = context.args
+    if not args:
+        await outbox.reply_text(
+            update.message,
+            "用法：/mtr <目标> [节点] [轮数]\n"
+            "在节点上连续执行多轮路由追踪，统计每一跳的丢包率和延迟（最好/平均/最差/标准差）。\n"
+            f"默认 {MTR_DEFAULT_ROUNDS} 轮，最多 {MTR_MAX_ROUNDS} 轮；只有一个节点时可以不指定节点。"
+        )
+        return
+
+    target = args[0]
+    if not valid_target(target):
+        await outbox.reply_text(update.message, f"无效的目标：{target}\n请输入 IP 地址或域名。")
+        return
+    rounds = MTR_DEFAULT_ROUNDS
+    node_name = None
+    for arg in args[1:]:
+        if arg.isdigit():
+            rounds = int(arg)
+        else:
+            node_name = arg
+    if not 1 <= rounds <= MTR_MAX_ROUNDS:
+        await outbox.reply_text(update.message, f"轮数需在 1 到 {MTR_MAX_ROUNDS} 之间。")
+        return
+
+    if node_name is None:
+        if len(SERVERS) != 1:
+            names = "、".join(s['name'] for s in SERVERS) or "（无）"
+            await outbox.reply_text(update.message, f"请指定节点，可用节点：{names}")
+            return
+        server_info = SERVERS[0]
+    else:
+        server_info = next((s for s in SERVERS if s['name'] == node_name), None)
+        if server_info is None:
+            await outbox.reply_text(update.message, f"未找到节点：{node_name}")
+            return
+
+    if await rate_limited(update, user_id, "mtr"):
+        return
+
+    msg = await outbox.reply_text(update.message, f"已收到请求，正在 {server_info['name']} 上执行 {rounds} 轮路由追踪，请稍候...")
+    context.application.create_task(
+        do_mtr_in_background(context, msg.chat_id, msg.message_id, server_info, target, rounds, user_id)
+    )
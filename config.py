@@ -1,15 +1,201 @@
-import json
-
-with open('config.json', 'r', encoding='utf-8') as f:
-    config_data = json.load(f)
-
-BOT_TOKEN = config_data.get('TELEGRAM_BOT_TOKEN')
-ADMIN_USERS = config_data.get('ADMIN_USERS', [])
-AUTHORIZED_USERS = config_data.get('AUTHORIZED_USERS', [])
-SERVERS = config_data.get('SERVERS', [])
-
-def save_config():
-    config_data['AUTHORIZED_USERS'] = AUTHORIZED_USERS
-    config_data['SERVERS'] = SERVERS
-    with open('config.json', 'w', encoding='utf-8') as f:
-        json.dump(config_data, f, indent=2, ensure_ascii=False)
+import os
+import json
+import asyncio
+import logging
+import tempfile
+
+CONFIG_PATH = 'config.json'
+
+with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+    config_data = json.load(f)
+
+BOT_TOKEN = config_data.get('TELEGRAM_BOT_TOKEN')
+ADMIN_USERS = config_data.get('ADMIN_USERS', [])
+AUTHORIZED_USERS = config_data.get('AUTHORIZED_USERS', [])
+SERVERS = config_data.get('SERVERS', [])
+# SSH 连接池参数（可选）：keepalive, idle_timeout, max_sessions, connect_timeout
+SSH_POOL = config_data.get('SSH_POOL', {})
+# SSH 执行后端："thread"（paramiko + 线程池，默认）或 "asyncssh"（原生 asyncio）
+SSH_BACKEND = config_data.get('SSH_BACKEND', 'thread')
+# /pingall 同时测试的节点数上限
+PINGALL_CONCURRENCY = config_data.get('PINGALL_CONCURRENCY', 10)
+# Telegram 发送频率限制（可选）：global_per_second, chat_per_second, chat_burst
+TELEGRAM_RATE_LIMITS = config_data.get('TELEGRAM_RATE_LIMITS', {})
+# 远程操作重试策略（可选）：retries, base_delay, max_delay
+RETRY_POLICY = config_data.get('RETRY_POLICY', {})
+# 节点熔断器参数（可选）：failure_threshold, cooldown
+CIRCUIT_BREAKER = config_data.get('CIRCUIT_BREAKER', {})
+# 节点任务队列（可选）：global_limit（全局同时运行的任务数）, node_limit（单节点默认并发数，可用服务器条目的 max_jobs 覆盖）
+JOB_QUEUE = config_data.get('JOB_QUEUE', {})
+# 批量安装 NextTrace 时同时安装的节点数上限
+INSTALL_CONCURRENCY = config_data.get('INSTALL_CONCURRENCY', 5)
+# 批量安装时，节点上已安装的 nexttrace 不低于此版本则跳过；留空时只要已安装就跳过
+NEXTTRACE_MIN_VERSION = config_data.get('NEXTTRACE_MIN_VERSION', '')
+# NextTrace 结果格式："json"（默认，请求结构化输出，追踪结束后一次性返回）或 "text"（解析文本输出，可实时显示已发现的跳数）
+NEXTTRACE_FORMAT = config_data.get('NEXTTRACE_FORMAT', 'json')
+# 测试结果缓存（可选）：ping_ttl, trace_ttl（秒，0 表示不缓存）, max_bytes（缓存占用内存上限）
+RESULT_CACHE = config_data.get('RESULT_CACHE', {})
+# 交互会话（可选）：ttl（闲置多少秒后过期并删除提示消息）, max_entries, sweep_interval
+SESSIONS = config_data.get('SESSIONS', {})
+# 命令频率限制（可选）：commands（按命令的 {"burst", "per"}）, node（每个节点的远程执行次数限制，默认不限制）
+RATE_LIMITS = config_data.get('RATE_LIMITS', {})
+# 指标导出（可选）：enabled, host, port（Prometheus 文本格式，GET /metrics）
+METRICS = config_data.get('METRICS', {})
+# 定时监测（可选）：interval（每轮间隔秒数）, ping_count, loss_threshold（丢包率 %）, latency_threshold（平均延迟 ms）,
+# consecutive（连续多少次超过阈值才告警）, max_points（每个节点-目标保留的采样数）, trace_interval（定时路由追踪间隔秒数，0 不追踪）
+MONITOR = config_data.get('MONITOR', {})
+# 定时监测的目标列表，由 /monitor add|rm 管理
+MONITOR_TARGETS = config_data.get('MONITOR_TARGETS', [])
+# 测量结果存储（可选）：enabled, path（SQLite 数据库文件）, flush_interval, batch_size, rollup_interval,
+# raw_days / minute_days / hour_days（原始记录、分钟汇总、小时汇总的保留天数，天汇总永久保留）
+MEASUREMENTS = config_data.get('MEASUREMENTS', {})
+# /history（可选）：default_range, max_range, cache_ttl（相同查询的缓存秒数）, charts（是否绘图，需要 matplotlib）, chart_workers
+HISTORY = config_data.get('HISTORY', {})
+# 路径变化检测（可选）：max_entries（保存的路径数）, latency_threshold（显示的最小延迟变化，毫秒）, max_lines
+ROUTE_DIFF = config_data.get('ROUTE_DIFF', {})
+# /mtr（可选）：rounds（默认轮数）, max_rounds, queries（每轮每跳的探测包数）, round_timeout（每轮的超时秒数）
+MTR = config_data.get('MTR', {})
+# 本地 IP 归属数据库（可选）：path（build_ipdb.py 生成的索引文件）, check_interval（检查文件是否被替换的间隔秒数）,
+# disable_remote_geoip（索引可用时让 nexttrace 不再查询远程地理信息接口）
+IPDB = config_data.get('IPDB', {})
+# 同时处理的更新数（不同用户并发，同一用户按顺序），1 表示逐个处理
+UPDATE_CONCURRENCY = config_data.get('UPDATE_CONCURRENCY', 16)
+# Webhook 模式（可选）：enabled, url（Telegram 推送的公网地址）, listen, port, path, secret_token；未启用时使用轮询
+WEBHOOK = config_data.get('WEBHOOK', {})
+
+# 配置保存（可选）：save_delay（修改后延迟多少秒写入，期间的多次修改合并为一次写入）,
+# watch_interval（检查 config.json 是否被手动修改的间隔秒数，0 表示不检查）
+CONFIG_PERSISTENCE = config_data.get('CONFIG_PERSISTENCE', {})
+SAVE_DELAY = CONFIG_PERSISTENCE.get('save_delay', 1.0)
+WATCH_INTERVAL = CONFIG_PERSISTENCE.get('watch_interval', 2.0)
+
+_save_handle = None
+_save_lock = None
+
+def _file_stat():
+    try:
+        st = os.stat(CONFIG_PATH)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+# 最近一次读取或写入后 config.json 的状态，用来区分机器人自己的写入和手动修改
+_known_stat = _file_stat()
+
+def _dump_config() -> str:
+    config_data['AUTHORIZED_USERS'] = AUTHORIZED_USERS
+    config_data['SERVERS'] = SERVERS
+    config_data['MONITOR_TARGETS'] = MONITOR_TARGETS
+    return json.dumps(config_data, indent=2, ensure_ascii=False)
+
+def _write_atomic(text: str):
+    """先写入同目录下的临时文件并 fsync，再原子替换 config.json，写入中途崩溃也不会损坏原文件"""
+    global _known_stat
+    directory = os.path.dirname(os.path.abspath(CONFIG_PATH))
+    fd, tmp_path = tempfile.mkstemp(prefix='.config.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(CONFIG_PATH):
+            # 保留原文件的权限（其中包含服务器密码）
+            os.chmod(tmp_path, os.stat(CONFIG_PATH).st_mode & 0o777)
+        os.replace(tmp_path, CONFIG_PATH)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    # 同步目录，确保重命名本身也已落盘
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+    _known_stat = _file_stat()
+
+def save_config():
+    """
+    保存 AUTHORIZED_USERS、SERVERS 和 MONITOR_TARGETS 到 config.json
+
+    在事件循环中调用时不会阻塞：写入延迟 SAVE_DELAY 秒后在线程中执行，期间的多次调用合并为一次写入。
+    没有运行中的事件循环时（如独立脚本）直接同步写入。
+    """
+    global _save_handle
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _write_atomic(_dump_config())
+        return
+    if _save_handle is not None:
+        _save_handle.cancel()
+    _save_handle = loop.call_later(SAVE_DELAY, lambda: loop.create_task(flush_config()))
+
+def save_pending() -> bool:
+    return _save_handle is not None
+
+async def flush_config():
+    """立即写入尚未保存的修改（关闭机器人前调用）"""
+    global _save_handle, _save_lock
+    if _save_handle is None:
+        return
+    _save_handle.cancel()
+    _save_handle = None
+    if _save_lock is None:
+        _save_lock = asyncio.Lock()
+    # 在事件循环上生成快照，避免写入过程中列表被修改；写文件放到线程中
+    text = _dump_config()
+    async with _save_lock:
+        try:
+            await asyncio.to_thread(_write_atomic, text)
+        except Exception as e:
+            logging.error(f"保存配置文件失败: {e}")
+
+def _read_config() -> dict:
+    with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+async def watch_config(on_reload=None):
+    """
+    定期检查 config.json，被手动修改后原地更新 SERVERS、AUTHORIZED_USERS、ADMIN_USERS 和 MONITOR_TARGETS，无需重启
+
+    参数:
+        on_reload: 可选，重新加载后调用 on_reload(old_servers)，old_servers 为重新加载前的服务器列表
+    """
+    global _known_stat
+    if WATCH_INTERVAL <= 0:
+        return
+    while True:
+        await asyncio.sleep(WATCH_INTERVAL)
+        stat = _file_stat()
+        if stat is None or stat == _known_stat:
+            continue
+        if _save_lock is not None and _save_lock.locked():
+            # 机器人自己正在写入
+            continue
+        if save_pending():
+            # 尚有未写入的修改，写入时会覆盖手动修改
+            logging.warning("config.json 被手动修改，但机器人有尚未保存的修改，将以机器人的修改为准")
+            continue
+        try:
+            new_data = await asyncio.to_thread(_read_config)
+        except Exception as e:
+            # 可能正在编辑中，下次检查时再试
+            logging.error(f"重新加载配置文件失败: {e}")
+            continue
+        _known_stat = stat
+        old_servers = list(SERVERS)
+        config_data.clear()
+        config_data.update(new_data)
+        SERVERS[:] = new_data.get('SERVERS', [])
+        AUTHORIZED_USERS[:] = new_data.get('AUTHORIZED_USERS', [])
+        ADMIN_USERS[:] = new_data.get('ADMIN_USERS', [])
+        MONITOR_TARGETS[:] = new_data.get('MONITOR_TARGETS', [])
+        logging.info(f"已重新加载 config.json：{len(SERVERS)} 个服务器，{len(AUTHORIZED_USERS)} 个授权用户（其它配置项需重启后生效）")
+        if on_reload is not None:
+            on_reload(old_servers)
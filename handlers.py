@@ -1,17 +1,79 @@
+import math
 import ipaddress
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from state import user_data
-from tasks import do_ping_in_background, do_nexttrace_in_background
-from utils import schedule_delete_message
+from tasks import do_ping_in_background, do_nexttrace_in_background, do_pingall_in_background, do_install_nexttrace_in_background
+from outbox import outbox
+from utils import schedule_delete_message, server_label, check_authorization, check_is_admin, install_keyboard, INSTALL_PROMPT
+from network import discard_server_connections
+from monitor import valid_target
+from result_cache import get_refresh
+from ratelimit import command_limiter
 import asyncio
 
+async def refresh_cached_result(update, context, token: str):
+    """
+    处理缓存结果上的“点击刷新”按钮：跳过缓存，在原消息上重新执行一次测试
+
+    刷新按钮不依赖 user_data 中的进行中操作，因此在回调处理的最前面单独处理。
+    """
+    from config import AUTHORIZED_USERS, SERVERS, ADMIN_USERS
+    query = update.callback_query
+    user_id = query.from_user.id
+    if not check_authorization(user_id, AUTHORIZED_USERS):
+        await outbox.answer_callback_query(context.bot, query.id, text="你没有权限执行此操作。")
+        return
+    if user_id in user_data:
+        await outbox.answer_callback_query(context.bot, query.id, text="你当前有进行中的操作，请稍后再刷新。")
+        return
+    request = get_refresh(token)
+    server_info = None
+    if request is not None:
+        server_info = next((s for s in SERVERS if (s['host'], int(s['port'])) == request["server"]), None)
+    if server_info is None:
+        await outbox.answer_callback_query(context.bot, query.id, text="刷新已失效，请重新发起测试。")
+        return
+    # 刷新同样会在节点上执行测试，与对应的命令共用频率限制
+    wait = command_limiter.acquire(user_id, request["operation"], exempt=check_is_admin(user_id, ADMIN_USERS))
+    if wait:
+        await outbox.answer_callback_query(context.bot, query.id, text=f"请 {math.ceil(wait)} 秒后再刷新。")
+        return
+    await outbox.answer_callback_query(context.bot, query.id)
+
+    chat_id = query.message.chat_id
+    message_id = query.message.message_id
+    user_data[user_id] = {
+        "operation": request["operation"],
+        "mode": "cmd",
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "target": request["target"],
+    }
+    if request["operation"] == "ping":
+        context.application.create_task(
+            do_ping_in_background(context, chat_id, server_info, request["target"], request["ping_count"], user_id, use_cache=False)
+        )
+    else:
+        context.application.create_task(
+            do_nexttrace_in_background(context, chat_id, server_info, request["target"], request["ip_type"], user_id,
+                                       request["trace_mode"], use_cache=False)
+        )
+
 async def callback_handler(update, context):
     query = update.callback_query
-    await query.answer()
+    if query.data.startswith("refresh_"):
+        await refresh_cached_result(update, context, query.data[len("refresh_"):])
+        return
+    await outbox.answer_callback_query(context.bot, query.id)
     user_id = query.from_user.id
 
     if user_id not in user_data:
-        await query.edit_message_text("你当前没有进行中的操作，请使用 /ping 或 /nexttrace 重新开始。")
+        await outbox.edit_message_text(
+            context.bot,
+            "你当前没有进行中的操作，请使用 /ping 或 /nexttrace 重新开始。",
+            chat_id=query.message.chat_id,
+            message_id=query.message.message_id
+        )
         return
 
     data = query.data
@@ -21,8 +83,11 @@ async def callback_handler(update, context):
 
     # 处理安装NextTrace的回调
     if data.startswith("installnexttrace_"):
+        if info.get("operation") == "installnexttrace_running":
+            return  # 安装已经开始，忽略重复点击
         if info.get("operation") != "installnexttrace":
-            await context.bot.edit_message_text(
+            await outbox.edit_message_text(
+                context.bot,
                 chat_id=chat_id,
                 message_id=message_id,
                 text="当前操作不支持安装NextTrace。"
@@ -30,7 +95,8 @@ async def callback_handler(update, context):
             return
             
         if data == "installnexttrace_cancel":
-            await context.bot.edit_message_text(
+            await outbox.edit_message_text(
+                context.bot,
                 chat_id=chat_id,
                 message_id=message_id,
                 text="已取消安装 NextTrace 操作。"
@@ -42,12 +108,35 @@ async def callback_handler(update, context):
             del user_data[user_id]
             return
             
-        # 解析服务器索引
-        server_idx = int(data.split("_")[1])
         from config import SERVERS
+        selected = info.setdefault("selected", set())
         
+        if data in ("installnexttrace_all", "installnexttrace_start"):
+            indexes = range(len(SERVERS)) if data == "installnexttrace_all" else sorted(selected)
+            # 选择之后服务器列表可能已更新，忽略已经不存在的索引
+            servers = [SERVERS[idx] for idx in indexes if idx < len(SERVERS)]
+            if not servers:
+                await outbox.edit_message_text(
+                    context.bot,
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    text=f"{INSTALL_PROMPT}\n\n⚠️ 请先选择至少一台服务器。",
+                    reply_markup=install_keyboard(SERVERS, selected)
+                )
+                return
+            
+            # 安装可能需要一分钟，放到后台并行执行，消息中实时显示每台服务器的状态
+            info["operation"] = "installnexttrace_running"
+            context.application.create_task(
+                do_install_nexttrace_in_background(context, chat_id, message_id, servers, user_id)
+            )
+            return
+            
+        # 点击服务器：切换选中状态
+        server_idx = int(data.split("_")[1])
         if server_idx < 0 or server_idx >= len(SERVERS):
-            await context.bot.edit_message_text(
+            await outbox.edit_message_text(
+                context.bot,
                 chat_id=chat_id,
                 message_id=message_id,
                 text="无效的服务器索引，可能服务器列表已更新，请重新执行 /install_nexttrace 命令。"
@@ -58,45 +147,25 @@ async def callback_handler(update, context):
             )
             del user_data[user_id]
             return
-            
-        server_info = SERVERS[server_idx]
         
-        # 显示安装中消息
-        await context.bot.edit_message_text(
+        if server_idx in selected:
+            selected.discard(server_idx)
+        else:
+            selected.add(server_idx)
+        await outbox.edit_message_text(
+            context.bot,
             chat_id=chat_id,
             message_id=message_id,
-            text=f"正在服务器 {server_info['name']} 上安装 NextTrace...\n请耐心等待，这可能需要一些时间。"
+            text=INSTALL_PROMPT,
+            reply_markup=install_keyboard(SERVERS, selected)
         )
-        
-        # 执行安装命令
-        from network import install_nexttrace_on_server
-        try:
-            result = await asyncio.to_thread(install_nexttrace_on_server, server_info)
-            
-            # 显示安装结果
-            await context.bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=message_id,
-                text=f"在服务器 {server_info['name']} 上安装 NextTrace 的结果：\n\n{result}"
-            )
-        except Exception as e:
-            await context.bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=message_id,
-                text=f"在服务器 {server_info['name']} 上安装 NextTrace 时出错：\n\n{str(e)}"
-            )
-        
-        # 5秒后删除消息
-        context.application.create_task(
-            schedule_delete_message(context, chat_id, message_id, delay=15)  # 安装结果显示时间更长
-        )
-        del user_data[user_id]
         return
 
     # 处理服务器删除回调
     if data.startswith("rmserver_"):
         if info.get("operation") != "rmserver":
-            await context.bot.edit_message_text(
+            await outbox.edit_message_text(
+                context.bot,
                 chat_id=chat_id,
                 message_id=message_id,
                 text="当前操作不支持删除服务器。"
@@ -105,7 +174,8 @@ async def callback_handler(update, context):
             
         if data == "rmserver_cancel":
             # 编辑现有消息，然后5秒后删除它
-            await context.bot.edit_message_text(
+            await outbox.edit_message_text(
+                context.bot,
                 chat_id=chat_id,
                 message_id=message_id,
                 text="已取消删除服务器操作。"
@@ -124,7 +194,8 @@ async def callback_handler(update, context):
             from config import SERVERS, save_config
             
             if server_idx < 0 or server_idx >= len(SERVERS):
-                await context.bot.edit_message_text(
+                await outbox.edit_message_text(
+                    context.bot,
                     chat_id=chat_id,
                     message_id=message_id,
                     text="无效的服务器索引，可能服务器列表已更新，请重新执行 /rmserver 命令。"
@@ -138,8 +209,10 @@ async def callback_handler(update, context):
                 
             removed_server = SERVERS.pop(server_idx)
             save_config()
+            discard_server_connections(removed_server)
             
-            await context.bot.edit_message_text(
+            await outbox.edit_message_text(
+                context.bot,
                 chat_id=chat_id,
                 message_id=message_id,
                 text=f"成功删除服务器：{removed_server['name']} (host={removed_server['host']})"
@@ -157,7 +230,8 @@ async def callback_handler(update, context):
             from config import SERVERS
             
             if server_idx < 0 or server_idx >= len(SERVERS):
-                await context.bot.edit_message_text(
+                await outbox.edit_message_text(
+                    context.bot,
                     chat_id=chat_id,
                     message_id=message_id,
                     text="无效的服务器索引，可能服务器列表已更新，请重新执行 /rmserver 命令。"
@@ -183,7 +257,8 @@ async def callback_handler(update, context):
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            await context.bot.edit_message_text(
+            await outbox.edit_message_text(
+                context.bot,
                 chat_id=chat_id,
                 message_id=message_id,
                 text=f"你确定要删除以下服务器吗？\n\n名称: {server_info['name']}\nHost: {server_info['host']}:{server_info['port']}\n\n此操作不可撤销！",
@@ -199,7 +274,8 @@ async def callback_handler(update, context):
             server_idx = info["server_idx"]
             server_info = SERVERS[server_idx]
             
-            await context.bot.edit_message_text(
+            await outbox.edit_message_text(
+                context.bot,
                 chat_id=chat_id,
                 message_id=message_id,
                 text=f"正在删除服务器：{server_info['name']}..."
@@ -209,8 +285,10 @@ async def callback_handler(update, context):
             from config import SERVERS, save_config
             removed_server = SERVERS.pop(server_idx)
             save_config()
+            discard_server_connections(removed_server)
             
-            await context.bot.edit_message_text(
+            await outbox.edit_message_text(
+                context.bot,
                 chat_id=chat_id,
                 message_id=message_id,
                 text=f"成功删除服务器：{removed_server['name']} (host={removed_server['host']})"
@@ -223,7 +301,8 @@ async def callback_handler(update, context):
             return
             
         if data == "rmserver_abort":
-            await context.bot.edit_message_text(
+            await outbox.edit_message_text(
+                context.bot,
                 chat_id=chat_id,
                 message_id=message_id,
                 text="已取消删除服务器操作。"
@@ -238,7 +317,7 @@ async def callback_handler(update, context):
     # 处理trace_mode选择
     if data.startswith("trace_mode_"):
         if info.get("operation") != "nexttrace":
-            await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id,
+            await outbox.edit_message_text(context.bot, chat_id=chat_id, message_id=message_id,
                                               text="当前操作不支持选择追踪模式。")
             return
         
@@ -249,11 +328,12 @@ async def callback_handler(update, context):
         keyboard = []
         from config import SERVERS
         for idx, server_info in enumerate(SERVERS):
-            btn = InlineKeyboardButton(server_info['name'], callback_data=f"server_{idx}")
+            btn = InlineKeyboardButton(server_label(server_info), callback_data=f"server_{idx}")
             keyboard.append([btn])
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await context.bot.edit_message_text(
+        await outbox.edit_message_text(
+            context.bot,
             chat_id=chat_id, 
             message_id=message_id,
             text=f"你选择了{('ICMP' if trace_mode == 'icmp' else 'TCP')}模式追踪，请选择服务器：",
@@ -261,11 +341,43 @@ async def callback_handler(update, context):
         )
         return
 
+    if data == "server_all":
+        if info.get("operation") != "ping":
+            await outbox.edit_message_text(context.bot, chat_id=chat_id, message_id=message_id,
+                                                  text="当前操作不支持选择全部节点。")
+            return
+
+        from config import SERVERS
+        info["all_servers"] = True
+        if info["mode"] == "cmd":
+            if not valid_target(info["target"]):
+                await outbox.edit_message_text(context.bot, chat_id=chat_id, message_id=message_id,
+                                               text=f"无效的目标：{info['target']}\n请输入 IP 地址或域名。")
+                user_data.pop(user_id, None)
+                return
+            await outbox.edit_message_text(
+                context.bot,
+                chat_id=chat_id,
+                message_id=message_id,
+                text=f"已收到请求，正在从 {len(SERVERS)} 个节点同时执行 Ping 操作，请稍候..."
+            )
+            context.application.create_task(
+                do_pingall_in_background(context, chat_id, list(SERVERS), info["target"], info["count"], user_id)
+            )
+        else:
+            await outbox.edit_message_text(
+                context.bot,
+                chat_id=chat_id,
+                message_id=message_id,
+                text="你选择了全部节点。\n请发送目标IP或域名（例如：8.8.8.8 或 google.com）。"
+            )
+        return
+
     if data.startswith("server_"):
         idx = int(data.split("_")[1])
         from config import SERVERS
         if idx < 0 or idx >= len(SERVERS):
-            await context.bot.edit_message_text("无效的服务器下标。", chat_id=chat_id, message_id=message_id)
+            await outbox.edit_message_text(context.bot, "无效的服务器下标。", chat_id=chat_id, message_id=message_id)
             return
 
         server_info = SERVERS[idx]
@@ -273,7 +385,8 @@ async def callback_handler(update, context):
         if info.get("operation") == "ping":
             mode = info["mode"]
             if mode == "cmd":
-                await context.bot.edit_message_text(
+                await outbox.edit_message_text(
+                    context.bot,
                     chat_id=chat_id,
                     message_id=message_id,
                     text="已收到请求，正在后台执行 Ping 操作，请稍候..."
@@ -282,7 +395,8 @@ async def callback_handler(update, context):
                     do_ping_in_background(context, chat_id, server_info, info["target"], info["count"], user_id)
                 )
             elif mode == "interactive":
-                await context.bot.edit_message_text(
+                await outbox.edit_message_text(
+                    context.bot,
                     chat_id=chat_id,
                     message_id=message_id,
                     text=f"你选择了 {server_info['name']}。\n请发送目标IP或域名（例如：8.8.8.8 或 google.com）。"
@@ -293,7 +407,8 @@ async def callback_handler(update, context):
                 try:
                     ipaddress.ip_address(info["target"])
                     trace_mode = info.get("trace_mode", "icmp")  # 默认为icmp
-                    await context.bot.edit_message_text(
+                    await outbox.edit_message_text(
+                        context.bot,
                         chat_id=chat_id, message_id=message_id,
                         text=f"你选择了 {server_info['name']}。\n目标： {info['target']} 为IP地址，正在后台执行{('ICMP' if trace_mode == 'icmp' else 'TCP')}模式路由追踪操作，请稍候..."
                     )
@@ -308,7 +423,8 @@ async def callback_handler(update, context):
                         ]
                     ]
                     reply_markup = InlineKeyboardMarkup(keyboard)
-                    await context.bot.edit_message_text(
+                    await outbox.edit_message_text(
+                        context.bot,
                         chat_id=chat_id, message_id=message_id,
                         text=f"你选择了 {server_info['name']}。\n目标： {info['target']}\n请选择 IP 协议类型：",
                         reply_markup=reply_markup
@@ -317,7 +433,8 @@ async def callback_handler(update, context):
                 try:
                     ipaddress.ip_address(info["target"])
                     trace_mode = info.get("trace_mode", "icmp")  # 默认为icmp
-                    await context.bot.edit_message_text(
+                    await outbox.edit_message_text(
+                        context.bot,
                         chat_id=chat_id, message_id=message_id,
                         text=f"你选择了 {server_info['name']}。\n目标： {info['target']} 为IP地址，正在后台执行{('ICMP' if trace_mode == 'icmp' else 'TCP')}模式路由追踪操作，请稍候..."
                     )
@@ -325,38 +442,53 @@ async def callback_handler(update, context):
                         do_nexttrace_in_background(context, chat_id, server_info, info["target"], "direct", user_id, trace_mode)
                     )
                 except ValueError:
-                    await context.bot.edit_message_text(
+                    await outbox.edit_message_text(
+                        context.bot,
                         chat_id=chat_id,
                         message_id=message_id,
                         text=f"你选择了 {server_info['name']}。\n请发送目标IP或域名。"
                     )
     elif data.startswith("count_"):
         if info.get("operation") != "ping":
-            await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id,
+            await outbox.edit_message_text(context.bot, chat_id=chat_id, message_id=message_id,
                                                   text="当前操作不支持选择 Ping 次数。")
             return
 
         count = int(data.split("_")[1])
         info["count"] = count
+        if info.get("all_servers") and info.get("target"):
+            from config import SERVERS
+            if not valid_target(info["target"]):
+                await outbox.edit_message_text(context.bot, chat_id=chat_id, message_id=message_id,
+                                               text=f"无效的目标：{info['target']}\n请输入 IP 地址或域名。")
+                user_data.pop(user_id, None)
+                return
+            await outbox.edit_message_text(context.bot, chat_id=chat_id, message_id=message_id,
+                                                text=f"已收到请求，正在从 {len(SERVERS)} 个节点同时执行 Ping 操作，请稍候...")
+            context.application.create_task(
+                do_pingall_in_background(context, chat_id, list(SERVERS), info["target"], count, user_id)
+            )
+            return
         if not info.get("server_info") or not info.get("target"):
-            await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id,
+            await outbox.edit_message_text(context.bot, chat_id=chat_id, message_id=message_id,
                                                   text="服务器或目标IP信息不完整，请重新开始 /ping 流程。")
             return
 
-        await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id,
+        await outbox.edit_message_text(context.bot, chat_id=chat_id, message_id=message_id,
                                             text="已收到请求，正在后台执行 Ping 操作，请稍候...")
         context.application.create_task(
             do_ping_in_background(context, chat_id, info["server_info"], info["target"], count, user_id)
         )
     elif data.startswith("iptype_"):
         if info.get("operation") != "nexttrace":
-            await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id,
+            await outbox.edit_message_text(context.bot, chat_id=chat_id, message_id=message_id,
                                                   text="当前操作不支持 IP 协议类型选择。")
             return
         ip_type = "IPv4" if data == "iptype_ipv4" else "IPv6"
         info["ip_type"] = ip_type
         trace_mode = info.get("trace_mode", "icmp")  # 默认为icmp
-        await context.bot.edit_message_text(
+        await outbox.edit_message_text(
+            context.bot,
             chat_id=chat_id, message_id=message_id,
             text=f"已收到请求，正在后台执行{('ICMP' if trace_mode == 'icmp' else 'TCP')}模式路由追踪操作，请稍候..."
         )
@@ -367,7 +499,7 @@ async def callback_handler(update, context):
 async def handle_message(update, context):
     user_id = update.effective_user.id
     if user_id not in user_data:
-        await update.message.reply_text("请先使用 /ping 或 /nexttrace 重新开始流程。")
+        await outbox.reply_text(update.message, "请先使用 /ping 或 /nexttrace 重新开始流程。")
         return
     info = user_data[user_id]
     
@@ -380,7 +512,8 @@ async def handle_message(update, context):
             # 删除上一条提示消息
             if info.get("prompt_message_id"):
                 try:
-                    await context.bot.delete_message(
+                    await outbox.delete_message(
+                        context.bot,
                         chat_id=update.effective_chat.id,
                         message_id=info["prompt_message_id"]
                     )
@@ -388,7 +521,8 @@ async def handle_message(update, context):
                     pass  # 忽略删除失败的错误
                     
             del user_data[user_id]
-            await context.bot.send_message(
+            await outbox.send_message(
+                context.bot,
                 chat_id=update.effective_chat.id,
                 text="✅ 已取消添加服务器操作。"
             )
@@ -403,7 +537,8 @@ async def handle_message(update, context):
         # 删除上一条提示消息
         if info.get("prompt_message_id"):
             try:
-                await context.bot.delete_message(
+                await outbox.delete_message(
+                    context.bot,
                     chat_id=update.effective_chat.id,
                     message_id=info["prompt_message_id"]
                 )
@@ -412,7 +547,8 @@ async def handle_message(update, context):
         
         if step == 1:  # 处理服务器名称
             server_data["name"] = text
-            msg = await context.bot.send_message(
+            msg = await outbox.send_message(
+                context.bot,
                 chat_id=update.effective_chat.id,
                 text=f"步骤 2/5: 服务器名称已设置为 \"{text}\"。\n\n请输入服务器IP地址：\n\n🔹 输入 /cancel 可随时取消"
             )
@@ -422,7 +558,8 @@ async def handle_message(update, context):
             
         elif step == 2:  # 处理服务器IP地址
             server_data["host"] = text
-            msg = await context.bot.send_message(
+            msg = await outbox.send_message(
+                context.bot,
                 chat_id=update.effective_chat.id,
                 text=f"步骤 3/5: 服务器IP已设置为 \"{text}\"。\n\n请输入SSH端口号（通常为22）：\n\n🔹 输入 /cancel 可随时取消"
             )
@@ -434,7 +571,8 @@ async def handle_message(update, context):
             try:
                 port = int(text)
                 server_data["port"] = port
-                msg = await context.bot.send_message(
+                msg = await outbox.send_message(
+                    context.bot,
                     chat_id=update.effective_chat.id,
                     text=f"步骤 4/5: 端口号已设置为 {port}。\n\n请输入SSH用户名：\n\n🔹 输入 /cancel 可随时取消"
                 )
@@ -442,7 +580,8 @@ async def handle_message(update, context):
                 info["server_data"] = server_data
                 info["prompt_message_id"] = msg.message_id  # 保存当前提示消息ID
             except ValueError:
-                msg = await context.bot.send_message(
+                msg = await outbox.send_message(
+                    context.bot,
                     chat_id=update.effective_chat.id,
                     text="端口号必须是数字，请重新输入端口号：\n\n🔹 输入 /cancel 可随时取消"
                 )
@@ -450,7 +589,8 @@ async def handle_message(update, context):
                 
         elif step == 4:  # 处理用户名
             server_data["username"] = text
-            msg = await context.bot.send_message(
+            msg = await outbox.send_message(
+                context.bot,
                 chat_id=update.effective_chat.id,
                 text=f"步骤 5/5: 用户名已设置为 \"{text}\"。\n\n请输入SSH密码：\n\n🔹 输入 /cancel 可随时取消"
             )
@@ -472,7 +612,8 @@ async def handle_message(update, context):
                 f"确认添加吗？(输入 yes 确认，输入其他内容取消)"
             )
             
-            msg = await context.bot.send_message(
+            msg = await outbox.send_message(
+                context.bot,
                 chat_id=update.effective_chat.id,
                 text=summary
             )
@@ -485,7 +626,8 @@ async def handle_message(update, context):
             # 删除确认提示消息
             if info.get("prompt_message_id"):
                 try:
-                    await context.bot.delete_message(
+                    await outbox.delete_message(
+                        context.bot,
                         chat_id=update.effective_chat.id,
                         message_id=info["prompt_message_id"]
                     )
@@ -498,12 +640,14 @@ async def handle_message(update, context):
                 SERVERS.append(server_data)
                 save_config()
                 
-                await context.bot.send_message(
+                await outbox.send_message(
+                    context.bot,
                     chat_id=update.effective_chat.id,
                     text=f"服务器添加成功！服务器 \"{server_data['name']}\" 已添加到系统。"
                 )
             else:
-                await context.bot.send_message(
+                await outbox.send_message(
+                    context.bot,
                     chat_id=update.effective_chat.id,
                     text="已取消添加服务器。"
                 )
@@ -516,9 +660,9 @@ async def handle_message(update, context):
     # 其他原有的消息处理逻辑
     if info["mode"] != "interactive":
         if info.get("operation") == "ping":
-            await update.message.reply_text("命令式模式无需输入IP，如需重新测试，请使用 /ping。")
+            await outbox.reply_text(update.message, "命令式模式无需输入IP，如需重新测试，请使用 /ping。")
         elif info.get("operation") == "nexttrace":
-            await update.message.reply_text("命令式模式无需输入IP，如需重新测试，请使用 /nexttrace。")
+            await outbox.reply_text(update.message, "命令式模式无需输入IP，如需重新测试，请使用 /nexttrace。")
         return
 
     if not info.get("target"):
@@ -536,7 +680,8 @@ async def handle_message(update, context):
                 ]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.bot.edit_message_text(
+            await outbox.edit_message_text(
+                context.bot,
                 chat_id=info["chat_id"],
                 message_id=info["message_id"],
                 text="请选择要 Ping 的次数：",
@@ -546,7 +691,8 @@ async def handle_message(update, context):
             try:
                 ipaddress.ip_address(target)
                 trace_mode = info.get("trace_mode", "icmp")  # 默认为icmp
-                await context.bot.edit_message_text(
+                await outbox.edit_message_text(
+                    context.bot,
                     chat_id=info["chat_id"],
                     message_id=info["message_id"],
                     text=f"目标： {target} 为IP地址，正在后台执行{('ICMP' if trace_mode == 'icmp' else 'TCP')}模式路由追踪操作，请稍候..."
@@ -562,11 +708,12 @@ async def handle_message(update, context):
                     ]
                 ]
                 reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.bot.edit_message_text(
+                await outbox.edit_message_text(
+                    context.bot,
                     chat_id=info["chat_id"],
                     message_id=info["message_id"],
                     text="请选择 IP 协议类型：",
                     reply_markup=reply_markup
                 )
     else:
-        await update.message.reply_text("你已输入过目标IP，如需重新测试，请使用相应的命令。")
+        await outbox.reply_text(update.message, "你已输入过目标IP，如需重新测试，请使用相应的命令。")
@@ -0,0 +1,176 @@
+import re
+import sys
+import html
+import time
+import asyncio
+import logging
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from config import HISTORY
+from measurements import measurement_store
+from latency import percentile
+from result_cache import TTLCache
+from charts import render_latency_chart, CHARTS_AVAILABLE
+
+CHARTS_ENABLED = HISTORY.get('charts', True) and CHARTS_AVAILABLE
+CHART_WORKERS = HISTORY.get('chart_workers', 1)
+HISTORY_CACHE_TTL = HISTORY.get('cache_ttl', 60)
+DEFAULT_RANGE = HISTORY.get('default_range', '24h')
+MAX_RANGE = HISTORY.get('max_range', '90d')
+
+_RANGE_RE = re.compile(r"^(\d+)([mhdw])$", re.IGNORECASE)
+_UNITS = {"m": (60, "分钟"), "h": (3600, "小时"), "d": (86400, "天"), "w": (604800, "周")}
+_RESOLUTION_NAMES = {0: "原始记录", 60: "按分钟汇总", 3600: "按小时汇总", 86400: "按天汇总"}
+
+def parse_range(text: str):
+    """把 30m、24h、7d、2w 这样的时间范围转换为秒数，格式不正确时返回 None"""
+    match = _RANGE_RE.match(text)
+    if not match:
+        return None
+    return int(match.group(1)) * _UNITS[match.group(2).lower()][0]
+
+def describe_range(text: str) -> str:
+    match = _RANGE_RE.match(text)
+    return f"最近 {match.group(1)} {_UNITS[match.group(2).lower()][1]}"
+
+class HistoryReport:
+    """/history 的结果：文字统计和可选的 PNG 图"""
+
+    __slots__ = ("text", "chart")
+
+    def __init__(self, text: str, chart: bytes = None):
+        self.text = text
+        self.chart = chart
+
+    def approx_size(self) -> int:
+        return sys.getsizeof(self) + sys.getsizeof(self.text) + (sys.getsizeof(self.chart) if self.chart else 0)
+
+# 相同的查询（目标、节点、时间范围）在 HISTORY_CACHE_TTL 秒内直接返回上次的结果
+history_cache = TTLCache(HISTORY.get('cache_bytes', 4 * 1024 * 1024))
+_chart_pool = None
+
+# 进程池创建时机器人中已经有 SSH、线程池和 SQLite 写入线程，直接 fork 的子进程可能卡在 fork 时被其他线程持有的锁上；
+# forkserver（不支持时用 spawn）从干净的进程创建绘图进程
+_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+def _get_chart_pool() -> ProcessPoolExecutor:
+    global _chart_pool
+    if _chart_pool is None:
+        _chart_pool = ProcessPoolExecutor(max_workers=CHART_WORKERS, mp_context=multiprocessing.get_context(_START_METHOD))
+    return _chart_pool
+
+def shutdown_chart_pool():
+    global _chart_pool
+    if _chart_pool is not None:
+        _chart_pool.shutdown(wait=False, cancel_futures=True)
+        _chart_pool = None
+
+def summarize(resolution: int, points: list):
+    """
+    汇总一个节点在时间范围内的测量结果
+
+    次数、丢包和平均延迟由各点（SQLite 中已经聚合好的桶）按成功次数加权合并；
+    原始记录时百分位按逐包时延计算，汇总数据时按各桶的平均延迟计算。
+
+    返回:
+        统计字典；没有数据时返回 None
+    """
+    if not points:
+        return None
+    count = sum(p["count"] for p in points)
+    failures = sum(p["failures"] for p in points)
+    loss_points = [(p["loss"], p["count"] - p["failures"]) for p in points if p["loss"] is not None]
+    avg_points = [(p["avg"], p["count"] - p["failures"]) for p in points if p["avg"] is not None]
+    loss_weight = sum(w for _, w in loss_points)
+    avg_weight = sum(w for _, w in avg_points)
+
+    values = array('f')
+    per_packet = resolution == 0
+    if per_packet:
+        for p in points:
+            values.extend(p["rtts"])
+    if not values:
+        # 没有逐包数据（汇总数据或旧记录）时按各点的平均延迟计算百分位
+        per_packet = False
+        values.extend(avg for avg, _ in avg_points)
+    ordered = sorted(values)
+
+    mins = [p["min"] for p in points if p["min"] is not None]
+    maxs = [p["max"] for p in points if p["max"] is not None]
+    return {
+        "count": count,
+        "failures": failures,
+        "loss": sum(loss * w for loss, w in loss_points) / loss_weight if loss_weight else None,
+        "avg": sum(avg * w for avg, w in avg_points) / avg_weight if avg_weight else None,
+        "p50": percentile(ordered, 50) if ordered else None,
+        "p90": percentile(ordered, 90) if ordered else None,
+        "p99": percentile(ordered, 99) if ordered else None,
+        "per_packet": per_packet,
+        "min": min(mins) if mins else None,
+        "max": max(maxs) if maxs else None,
+    }
+
+def _format_summary(name: str, summary) -> str:
+    text = f"<b>{html.escape(name)}</b>\n"
+    if summary is None:
+        return text + "没有数据\n"
+    text += f"测试 {summary['count']} 次，失败 {summary['failures']} 次"
+    if summary["loss"] is not None:
+        text += f"，平均丢包 {summary['loss']:.1f}%"
+    text += "\n"
+    if summary["avg"] is not None:
+        basis = "逐包" if summary["per_packet"] else "按时段平均值"
+        text += (
+            f"平均延迟 {summary['avg']:.1f} ms，"
+            f"P50/P90/P99（{basis}）{summary['p50']:.1f} / {summary['p90']:.1f} / {summary['p99']:.1f} ms\n"
+            f"最低 {summary['min']:.1f} ms，最高 {summary['max']:.1f} ms\n"
+        )
+    return text
+
+async def _render_chart(title: str, series: list):
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_chart_pool(), render_latency_chart, title, series)
+    except Exception as e:
+        logging.error(f"绘制历史数据图失败: {e}")
+        return None
+
+async def history_report(target: str, node_names: list, range_text: str) -> HistoryReport:
+    """
+    生成目标在各节点上的历史统计（以及可选的延迟图），结果缓存 HISTORY_CACHE_TTL 秒
+
+    参数:
+        node_names: 要统计的节点名称
+        range_text: 时间范围，如 24h（需先用 parse_range 校验）
+    """
+    key = (target, tuple(node_names), range_text.lower())
+    cached = history_cache.get(key)
+    if cached is not None:
+        return cached[0]
+
+    until = time.time()
+    since = until - parse_range(range_text)
+    results = await asyncio.gather(*(
+        measurement_store.query_async(name, target, since, until) for name in node_names
+    ))
+    resolution = max((res for res, _ in results), default=0)
+
+    text = (
+        "<b>【历史数据】</b>\n\n"
+        f"目标: {html.escape(target)}\n"
+        f"时间范围: {describe_range(range_text)}（{_RESOLUTION_NAMES[resolution]}）\n\n"
+    )
+    text += "\n".join(_format_summary(name, summarize(res, points)) for name, (res, points) in zip(node_names, results))
+
+    chart = None
+    series = [
+        (name, [p["ts"] for p in points], [p["avg"] for p in points], [p["loss"] for p in points])
+        for name, (_, points) in zip(node_names, results) if points
+    ]
+    if CHARTS_ENABLED and series:
+        chart = await _render_chart(f"{target} - {range_text}", series)
+
+    report = HistoryReport(text, chart)
+    history_cache.set(key, report, HISTORY_CACHE_TTL)
+    return report
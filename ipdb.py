@@ -0,0 +1,295 @@
+import os
+import sys
+import mmap
+import time
+import struct
+import logging
+import ipaddress
+from array import array
+from bisect import bisect_right
+from config import IPDB
+
+IPDB_PATH = IPDB.get('path', 'ipdb.bin')
+# 每隔多少秒检查一次索引文件是否被替换
+CHECK_INTERVAL = IPDB.get('check_interval', 30)
+
+# 文件格式（小端序）：
+#   文件头：魔数、IPv4/IPv6 区间数，以及各段的偏移
+#   IPv4：起始地址 u32[n]、结束地址 u32[n]、信息偏移 u32[n]
+#   IPv6：起始地址 16 字节大端[n]、结束地址 16 字节大端[n]、信息偏移 u32[n]
+#   信息区：每条为 ASN u32、长度 u16、UTF-8 的 "AS 名称\t地区"
+# 区间按起始地址排序且互不重叠，嵌套的前缀在生成时已拆分，最长前缀匹配只需一次二分查找
+MAGIC = b"NTIPDB01"
+_HEADER = struct.Struct("<8sII8Q")
+_INFO = struct.Struct("<IH")
+
+class IpInfo:
+    """一个地址所在前缀的归属信息"""
+
+    __slots__ = ("asn", "name", "geo")
+
+    def __init__(self, asn: int, name: str, geo: str):
+        self.asn = asn
+        self.name = name
+        self.geo = geo
+
+def _flatten(ranges: list) -> list:
+    """
+    把可能嵌套的区间 [(起始, 结束, 值)] 拆分为互不重叠的区间，重叠部分取最内层（即最长前缀）的值
+
+    区间之间只能嵌套或不相交（CIDR 前缀总是如此）。
+    """
+    flat = []
+
+    def emit(start, end, value):
+        if start > end:
+            return
+        if flat and flat[-1][2] == value and flat[-1][1] + 1 == start:
+            flat[-1] = (flat[-1][0], end, value)
+        else:
+            flat.append((start, end, value))
+
+    stack = []
+    cursor = 0
+    for start, end, value in sorted(ranges, key=lambda r: (r[0], -r[1])):
+        while stack and stack[-1][1] < start:
+            top = stack.pop()
+            emit(cursor, top[1], top[2])
+            cursor = top[1] + 1
+        if stack:
+            emit(cursor, start - 1, stack[-1][2])
+        stack.append((start, end, value))
+        cursor = start
+    while stack:
+        top = stack.pop()
+        emit(cursor, top[1], top[2])
+        cursor = top[1] + 1
+    return flat
+
+def _u32(values) -> bytes:
+    data = array('I', values)
+    if sys.byteorder != "little":
+        data.byteswap()
+    return data.tobytes()
+
+def build_index(records, path: str) -> tuple:
+    """
+    生成索引文件（先写入临时文件再替换，运行中的机器人会自动切换到新文件）
+
+    参数:
+        records: 可迭代的 (起始地址, 结束地址, ASN, AS 名称, 地区)，地址为 ipaddress 对象
+        path: 输出文件
+
+    返回:
+        (IPv4 区间数, IPv6 区间数)
+    """
+    blob = bytearray()
+    offsets = {}
+    v4, v6 = [], []
+    for start, end, asn, name, geo in records:
+        key = (asn, name, geo)
+        offset = offsets.get(key)
+        if offset is None:
+            text = f"{name}\t{geo}".encode()[:0xFFFF]
+            offset = offsets[key] = len(blob)
+            blob += _INFO.pack(asn, len(text)) + text
+        (v4 if start.version == 4 else v6).append((int(start), int(end), offset))
+    v4, v6 = _flatten(v4), _flatten(v6)
+
+    sections = [
+        _u32(r[0] for r in v4),
+        _u32(r[1] for r in v4),
+        _u32(r[2] for r in v4),
+        b"".join(r[0].to_bytes(16, "big") for r in v6),
+        b"".join(r[1].to_bytes(16, "big") for r in v6),
+        _u32(r[2] for r in v6),
+        bytes(blob),
+    ]
+    layout = []
+    position = _HEADER.size
+    for data in sections:
+        position = (position + 7) & ~7
+        layout.append(position)
+        position += len(data)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, len(v4), len(v6), *layout, len(blob)))
+        for offset, data in zip(layout, sections):
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(data)
+    os.replace(tmp_path, path)
+    return len(v4), len(v6)
+
+class _Index:
+    """一个已映射到内存的索引文件（只读，多个进程映射同一文件时共享页缓存）"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.v4_count, self.v6_count, *layout, self.blob_size = _HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} 不是 IP 索引文件")
+        self.v4_starts_at, self.v4_ends_at, self.v4_infos_at, self.v6_starts_at, self.v6_ends_at, self.v6_infos_at, self.blob_at = layout
+        view = memoryview(self.mm)
+        v4_starts = view[self.v4_starts_at:self.v4_starts_at + 4 * self.v4_count]
+        if sys.byteorder == "little":
+            # 直接在映射的内存上二分查找（bisect 在 C 中执行），不复制
+            self.v4_starts = v4_starts.cast("I")
+        else:
+            self.v4_starts = array('I', v4_starts)
+            self.v4_starts.byteswap()
+
+    def _info(self, offset: int) -> IpInfo:
+        at = self.blob_at + offset
+        asn, length = _INFO.unpack_from(self.mm, at)
+        name, _, geo = self.mm[at + _INFO.size:at + _INFO.size + length].decode(errors="replace").partition("\t")
+        return IpInfo(asn, name, geo)
+
+    def lookup_v4(self, ip: int, lo: int = 0):
+        """返回 (信息或 None, 下一次查找可用的下界)；按地址从小到大查找时传入上一次的下界可以缩小范围"""
+        i = bisect_right(self.v4_starts, ip, lo) - 1
+        if i < 0:
+            return None, 0
+        end, = struct.unpack_from("<I", self.mm, self.v4_ends_at + 4 * i)
+        if ip > end:
+            return None, i
+        offset, = struct.unpack_from("<I", self.mm, self.v4_infos_at + 4 * i)
+        return self._info(offset), i
+
+    def lookup_v6(self, ip: int, lo: int = 0):
+        key = ip.to_bytes(16, "big")
+        mm, base = self.mm, self.v6_starts_at
+        hi = self.v6_count
+        # 16 字节大端序的字节串比较与数值比较一致
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if mm[base + 16 * mid:base + 16 * mid + 16] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        i = lo - 1
+        if i < 0:
+            return None, 0
+        if mm[self.v6_ends_at + 16 * i:self.v6_ends_at + 16 * i + 16] < key:
+            return None, i
+        offset, = struct.unpack_from("<I", mm, self.v6_infos_at + 4 * i)
+        return self._info(offset), i
+
+class IpDatabase:
+    """
+    本地 IP 归属数据库：按前缀查找地址所属的 ASN、AS 名称和地区，不依赖 nexttrace 的远程地理信息接口
+
+    索引文件以只读方式映射到内存，多个机器人进程共享同一份页缓存；
+    查找时每隔 CHECK_INTERVAL 秒检查一次文件，被替换（如 build_ipdb.py 生成了新文件）后自动切换，正在进行的查找不受影响。
+
+    参数:
+        path: build_ipdb.py 生成的索引文件
+    """
+
+    def __init__(self, path: str = IPDB_PATH, check_interval: float = CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self.lookups = 0
+        self.reloads = 0
+        self._index = None
+        self._stat = None
+        self._checked = float("-inf")
+
+    def _file_stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _current(self):
+        now = time.monotonic()
+        if now - self._checked >= self.check_interval:
+            self._checked = now
+            stat = self._file_stat()
+            if stat != self._stat:
+                self._stat = stat
+                self._load()
+        return self._index
+
+    def _load(self):
+        if self._stat is None:
+            if self._index is not None:
+                logging.warning(f"IP 索引文件 {self.path} 已被删除，停止本地查询")
+            self._index = None
+            return
+        try:
+            index = _Index(self.path)
+        except Exception as e:
+            logging.error(f"加载 IP 索引文件 {self.path} 失败: {e}")
+            return
+        # 旧的映射在最后一个引用释放后才会关闭，不影响正在进行的查找
+        self._index = index
+        self.reloads += 1
+        logging.info(f"已加载 IP 索引文件 {self.path}：IPv4 {index.v4_count} 段，IPv6 {index.v6_count} 段")
+
+    @property
+    def available(self) -> bool:
+        return self._current() is not None
+
+    def lookup_many(self, addresses) -> dict:
+        """
+        批量查找一组地址（如一次追踪的所有跳），返回 {地址: IpInfo}，查不到或无效的地址不在结果中
+
+        地址按数值排序后依次查找，每次二分查找从上一个结果的位置开始。
+        """
+        index = self._current()
+        if index is None:
+            return {}
+        parsed = []
+        for address in set(addresses):
+            try:
+                ip = ipaddress.ip_address(address)
+            except ValueError:
+                continue
+            parsed.append((ip.version, int(ip), address))
+        parsed.sort()
+        results = {}
+        lo = {4: 0, 6: 0}
+        for version, ip, address in parsed:
+            lookup = index.lookup_v4 if version == 4 else index.lookup_v6
+            info, lo[version] = lookup(ip, lo[version])
+            if info is not None:
+                results[address] = info
+        self.lookups += len(parsed)
+        return results
+
+    def lookup(self, address: str):
+        return self.lookup_many((address,)).get(address)
+
+    def enrich(self, trace) -> int:
+        """
+        用本地数据补全追踪结果中缺少的 ASN、AS 名称和地区（已有的字段不覆盖），返回补全的跳数
+        """
+        infos = self.lookup_many(hop.ip for hop in trace.hops if hop.ip)
+        enriched = 0
+        for hop in trace.hops:
+            info = infos.get(hop.ip) if hop.ip else None
+            if info is None or (hop.asn and hop.geo):
+                continue
+            if not hop.asn and info.asn:
+                hop.asn = str(info.asn)
+                if not hop.whois:
+                    hop.whois = info.name
+            if not hop.geo:
+                hop.geo = info.geo
+            enriched += 1
+        return enriched
+
+    def stats(self) -> dict:
+        index = self._index
+        return {
+            "loaded": index is not None,
+            "v4_ranges": index.v4_count if index else 0,
+            "v6_ranges": index.v6_count if index else 0,
+            "lookups": self.lookups,
+            "reloads": self.reloads,
+        }
+
+ip_database = IpDatabase()
@@ -0,0 +1,160 @@
+import re
+import math
+import operator
+from array import array
+
+# 每个回复包一行：iputils（含 IPv6）、BSD/macOS 为 icmp_seq=，BusyBox 为 seq=；
+# 时间可能写作 time=1.23 ms 或 time<1 ms，重复包带 (DUP!)
+# （以字面量 "seq=" 开头，正则引擎可以直接跳到候选位置）
+_REPLY_RE = re.compile(r'seq=(\d+)[^\n]*time[=<]([\d.]+) ?ms([^\n]*)')
+# BusyBox 和 BSD 的首行为 "PING 主机 (地址): 56 data bytes"，序号从 0 开始；
+# iputils 为 "PING 主机 (地址) 56(84) bytes of data."（IPv6 为 "PING 地址(地址) 56 data bytes"），序号从 1 开始
+_ZERO_BASED_HEADER_RE = re.compile(r'\): \d+ data bytes')
+
+_SPARK_LEVELS = "▁▂▃▄▅▆▇█"
+_SPARK_LOST = "×"
+
+class PingSamples:
+    """
+    一次 ping 中每个回复包的序号和往返时延（毫秒），按序号排列
+
+    属性:
+        seqs: 序号（array('l')）
+        rtts: 往返时延（array('d')），与 seqs 一一对应
+        transmitted: 发送的包数（未知时为 None）
+        base: 第一个包的序号（iputils 为 1，BusyBox 和 BSD 为 0）
+    """
+
+    __slots__ = ("seqs", "rtts", "transmitted", "base")
+
+    def __init__(self, seqs: array, rtts: array, transmitted: int = None, base: int = 1):
+        self.seqs = seqs
+        self.rtts = rtts
+        self.transmitted = transmitted
+        self.base = base
+
+    def __len__(self) -> int:
+        return len(self.rtts)
+
+    def lost_mask(self) -> list:
+        """按发送顺序排列的丢包标记，True 表示该序号没有收到回复"""
+        if not self.seqs and not self.transmitted:
+            return []
+        first = self.base
+        count = self.transmitted if self.transmitted else self.seqs[-1] - first + 1
+        mask = [True] * count
+        for seq in self.seqs:
+            if 0 <= seq - first < count:
+                mask[seq - first] = False
+        return mask
+
+class RunningStats:
+    """
+    流式累计时延统计（Welford 算法），只保存常数个数值，数据量增长时内存不变
+
+    属性:
+        count: 样本数
+        mean: 平均值
+        best / worst: 最小值 / 最大值（没有样本时为 None）
+    """
+
+    __slots__ = ("count", "mean", "_m2", "best", "worst")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.best = None
+        self.worst = None
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if self.best is None or value < self.best:
+            self.best = value
+        if self.worst is None or value > self.worst:
+            self.worst = value
+
+    @property
+    def stdev(self) -> float:
+        """总体标准差（与 mtr 的 StDev 和 iputils 的 mdev 一致）"""
+        return math.sqrt(self._m2 / self.count) if self.count else 0.0
+
+def seq_base(output: str) -> int:
+    """根据 ping 输出的首行判断第一个包的序号（第一个包丢失时无法从回复中推断）"""
+    start = output.find("PING ")
+    if start < 0:
+        return 1
+    stop = output.find("\n", start)
+    header = output[start:] if stop < 0 else output[start:stop]
+    return 0 if _ZERO_BASED_HEADER_RE.search(header) else 1
+
+def extract_samples(output: str, transmitted: int = None) -> PingSamples:
+    """一次扫描提取 ping 输出中所有回复包的序号和时延（重复包只取第一次）"""
+    by_seq = {}
+    for seq, rtt, rest in _REPLY_RE.findall(output):
+        seq = int(seq)
+        if seq not in by_seq and "DUP!" not in rest:
+            by_seq[seq] = float(rtt)
+    seqs = sorted(by_seq)
+    return PingSamples(array('l', seqs), array('d', [by_seq[seq] for seq in seqs]), transmitted, seq_base(output))
+
+def percentile(sorted_values, q: float) -> float:
+    """最近秩法百分位数，sorted_values 需已升序排列"""
+    # round 避免 0.9 * 10 这类浮点误差把秩多算一位
+    index = max(0, math.ceil(round(q * len(sorted_values) / 100, 9)) - 1)
+    return sorted_values[index]
+
+def analyze(samples: PingSamples) -> dict:
+    """
+    计算时延分布统计
+
+    返回:
+        包含 p50/p90/p99/jitter/mdev（毫秒）、longest_loss_burst（个）和 sparkline 的字典；
+        没有收到任何回复时只包含 longest_loss_burst 和 sparkline
+    """
+    rtts = samples.rtts
+    mask = samples.lost_mask()
+
+    # 最长连续丢包：把标记拼成字符串后按收到的包切分
+    longest = max(map(len, "".join("x" if lost else " " for lost in mask).split(" ")), default=0)
+
+    stats = {"longest_loss_burst": longest, "sparkline": sparkline(rtts, mask)}
+    if not rtts:
+        return stats
+
+    ordered = sorted(rtts)
+    n = len(rtts)
+    mean = math.fsum(rtts) / n
+    stats.update({
+        "p50": percentile(ordered, 50),
+        "p90": percentile(ordered, 90),
+        "p99": percentile(ordered, 99),
+        # 抖动：相邻两个回复包时延之差的平均绝对值
+        "jitter": math.fsum(map(abs, map(operator.sub, rtts[1:], rtts[:-1]))) / (n - 1) if n > 1 else 0.0,
+        # 与 iputils 的 mdev 相同（总体标准差）
+        "mdev": math.sqrt(max(0.0, math.fsum(map(operator.mul, rtts, rtts)) / n - mean * mean)),
+    })
+    return stats
+
+def sparkline(rtts, mask: list, width: int = 50) -> str:
+    """
+    按发送顺序把每个包的时延画成一行字符，丢失的包显示为 ×
+
+    包数超过 width 时相邻的包合并为一格（取时延最大值，有丢包则显示丢包）。
+    """
+    if not mask:
+        return ""
+    low = min(rtts) if rtts else 0.0
+    span = (max(rtts) - low) if rtts else 0.0
+    scale = (len(_SPARK_LEVELS) - 1) / span if span else 0.0
+    values = iter(rtts)
+    # 丢失的包记为 -1，合并时只要有 -1 就显示为丢包
+    cells = [-1 if lost else int((next(values) - low) * scale + 0.5) for lost in mask]
+
+    group = max(1, math.ceil(len(cells) / width))
+    if group > 1:
+        cells = [-1 if min(chunk) < 0 else max(chunk) for chunk in (cells[i:i + group] for i in range(0, len(cells), group))]
+    return "".join(_SPARK_LOST if level < 0 else _SPARK_LEVELS[level] for level in cells)
@@ -0,0 +1,369 @@
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from array import array
+from config import MEASUREMENTS
+
+MEASUREMENTS_ENABLED = MEASUREMENTS.get('enabled', True)
+MEASUREMENTS_PATH = MEASUREMENTS.get('path', 'measurements.db')
+FLUSH_INTERVAL = MEASUREMENTS.get('flush_interval', 1.0)
+BATCH_SIZE = MEASUREMENTS.get('batch_size', 500)
+ROLLUP_INTERVAL = MEASUREMENTS.get('rollup_interval', 60)
+RAW_DAYS = MEASUREMENTS.get('raw_days', 7)
+MINUTE_DAYS = MEASUREMENTS.get('minute_days', 30)
+HOUR_DAYS = MEASUREMENTS.get('hour_days', 365)
+
+# 汇总粒度（秒）及其数据来源：分钟汇总来自原始记录，小时汇总来自分钟汇总，天汇总来自小时汇总
+MINUTE, HOUR, DAY = 60, 3600, 86400
+_ROLLUP_SOURCES = ((MINUTE, None), (HOUR, MINUTE), (DAY, HOUR))
+# 各汇总粒度的保留天数（天汇总永久保留）
+_ROLLUP_RETENTION = {MINUTE: MINUTE_DAYS, HOUR: HOUR_DAYS}
+# 查询跨度不超过该值（秒）时直接读取原始记录
+RAW_QUERY_SPAN = 6 * 3600
+# 写入线程处理不过来时最多积压的记录数，超出后丢弃最旧的
+_MAX_PENDING = BATCH_SIZE * 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS measurements (
+    ts REAL NOT NULL,
+    node TEXT NOT NULL,
+    target TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    mode TEXT NOT NULL DEFAULT '',
+    ok INTEGER NOT NULL,
+    loss REAL,
+    min REAL,
+    avg REAL,
+    max REAL,
+    mdev REAL,
+    rtts BLOB,
+    hops INTEGER,
+    path_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS measurements_node_target_ts ON measurements (node, target, ts);
+CREATE INDEX IF NOT EXISTS measurements_ts ON measurements (ts);
+CREATE TABLE IF NOT EXISTS rollups (
+    resolution INTEGER NOT NULL,
+    node TEXT NOT NULL,
+    target TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    failures INTEGER NOT NULL,
+    loss_sum REAL NOT NULL,
+    loss_count INTEGER NOT NULL,
+    avg_sum REAL NOT NULL,
+    avg_count INTEGER NOT NULL,
+    min REAL,
+    max REAL,
+    PRIMARY KEY (resolution, node, target, kind, mode, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_state (
+    resolution INTEGER PRIMARY KEY,
+    done_until INTEGER NOT NULL
+);
+"""
+
+_INSERT = (
+    "INSERT INTO measurements (ts, node, target, kind, mode, ok, loss, min, avg, max, mdev, rtts, hops, path_hash) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+# 汇总的列可以逐级合并：次数和总和相加，最小值取最小，最大值取最大
+_ROLLUP_FROM_RAW = """
+INSERT OR REPLACE INTO rollups
+SELECT ?, node, target, kind, mode, CAST(ts / ? AS INTEGER) * ?, COUNT(*), SUM(ok = 0),
+       TOTAL(loss), COUNT(loss), TOTAL(avg), COUNT(avg), MIN(min), MAX(max)
+FROM measurements WHERE ts >= ? AND ts < ?
+GROUP BY node, target, kind, mode, CAST(ts / ? AS INTEGER)
+"""
+_ROLLUP_FROM_ROLLUP = """
+INSERT OR REPLACE INTO rollups
+SELECT ?, node, target, kind, mode, bucket / ? * ?, SUM(count), SUM(failures),
+       SUM(loss_sum), SUM(loss_count), SUM(avg_sum), SUM(avg_count), MIN(min), MAX(max)
+FROM rollups WHERE resolution = ? AND bucket >= ? AND bucket < ?
+GROUP BY node, target, kind, mode, bucket / ?
+"""
+
+def _float(value):
+    return float(value) if value is not None else None
+
+def _point(bucket, count, failures, loss_sum, loss_count, avg_sum, avg_count, min_rtt, max_rtt) -> dict:
+    return {
+        "ts": bucket,
+        "count": count,
+        "failures": failures,
+        "loss": loss_sum / loss_count if loss_count else None,
+        "avg": avg_sum / avg_count if avg_count else None,
+        "min": min_rtt,
+        "max": max_rtt,
+    }
+
+def unpack_rtts(blob) -> array:
+    """还原 rtts 列中保存的逐包时延（毫秒）"""
+    rtts = array('f')
+    if blob:
+        rtts.frombytes(blob)
+    return rtts
+
+class MeasurementStore:
+    """
+    把每次 Ping/路由追踪的结构化结果保存到本地 SQLite（WAL 模式）
+
+    record_* 只把记录追加到内存中的待写列表，不做任何 IO；后台任务每 flush_interval 秒
+    （或积压达到 batch_size 条时）在线程中以一个事务批量写入，并定期生成分钟、小时、天三级汇总，
+    长时间跨度的查询读取汇总而不是原始记录。原始记录和分钟、小时汇总按保留天数定期清理。
+
+    参数:
+        path: 数据库文件路径
+        flush_interval: 批量写入的间隔（秒）
+        batch_size: 积压达到该数量时立即写入
+    """
+
+    def __init__(self, path: str, flush_interval: float = FLUSH_INTERVAL, batch_size: int = BATCH_SIZE):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self._pending = []
+        self._conn = None
+        # 写入和汇总共用一个连接，在线程中执行时加锁串行化
+        self._lock = threading.Lock()
+        self._wakeup = None
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL 模式下 NORMAL 已能保证崩溃后数据库一致，只可能丢失最后几个事务
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    async def start(self):
+        """打开数据库并启动后台写入任务"""
+        self._conn = await asyncio.to_thread(self._open)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logging.info(f"测量结果数据库: {os.path.abspath(self.path)}")
+
+    async def close(self):
+        """停止后台任务并写入剩余的记录（关闭机器人前调用）"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+        await asyncio.to_thread(self._close_connection)
+        self._conn = None
+
+    def _close_connection(self):
+        # 取消后台任务不会中断已经在线程中执行的写入或汇总，等它们释放锁后再关闭连接
+        with self._lock:
+            self._conn.close()
+
+    def _append(self, row: tuple):
+        if self._task is None:
+            return
+        if len(self._pending) >= _MAX_PENDING:
+            del self._pending[0]
+            self.dropped += 1
+        self._pending.append(row)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def record_ping(self, node: str, target: str, ok: bool, stats: dict = None, samples=None):
+        """
+        记录一次 Ping
+
+        参数:
+            stats: parse_ping_stats 的结果，远程执行失败时为 None
+            samples: extract_samples 的结果（逐包时延），可选
+        """
+        if stats is None or stats.get("packet_loss") is None:
+            self._append((time.time(), node, target, "ping", "", 0, None, None, None, None, None, None, None, None))
+            return
+        rtts = array('f', samples.rtts).tobytes() if samples is not None and len(samples) else None
+        self._append((
+            time.time(), node, target, "ping", "", int(ok), float(stats["packet_loss"]),
+            _float(stats["min"]), _float(stats["avg"]), _float(stats["max"]), _float(stats["mdev"]),
+            rtts, None, None,
+        ))
+
+    def record_trace(self, node: str, target: str, mode: str, trace=None):
+        """
+        记录一次路由追踪：跳数、路径哈希，以及最后一跳（通常是目标）的时延
+
+        参数:
+            mode: 追踪参数，如 "ipv4/icmp"
+            trace: TraceResult，追踪失败时为 None
+        """
+        if trace is None:
+            self._append((time.time(), node, target, "trace", mode, 0, None, None, None, None, None, None, None, None))
+            return
+        last = next((hop for hop in reversed(trace.hops) if hop.ip and hop.rtts), None)
+        rtts = tuple(last.rtts) if last is not None else ()
+        self._append((
+            time.time(), node, target, "trace", mode, 1, None,
+            min(rtts) if rtts else None, sum(rtts) / len(rtts) if rtts else None, max(rtts) if rtts else None, None,
+            array('f', rtts).tobytes() if rtts else None, len(trace.hops), trace.path_hash(),
+        ))
+
+    async def flush(self):
+        if not self._pending or self._conn is None:
+            return
+        rows, self._pending = self._pending, []
+        try:
+            await asyncio.to_thread(self._write, rows)
+        except Exception as e:
+            logging.error(f"写入测量结果失败（{len(rows)} 条）: {e}")
+
+    def _write(self, rows: list):
+        with self._lock, self._conn:
+            self._conn.executemany(_INSERT, rows)
+        self.written += len(rows)
+        self.batches += 1
+
+    async def _run(self):
+        next_rollup = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+            if time.monotonic() >= next_rollup:
+                next_rollup = time.monotonic() + ROLLUP_INTERVAL
+                try:
+                    await asyncio.to_thread(self._rollup, time.time())
+                except Exception as e:
+                    logging.error(f"生成测量结果汇总失败: {e}")
+
+    def _rollup(self, now: float):
+        # 分钟汇总只处理已经结束、且记录都已写入的分钟
+        complete = int(now - self.flush_interval * 2 - 5)
+        with self._lock, self._conn:
+            for resolution, source in _ROLLUP_SOURCES:
+                row = self._conn.execute("SELECT done_until FROM rollup_state WHERE resolution = ?", (resolution,)).fetchone()
+                if source is None:
+                    end = complete // resolution * resolution
+                    if row is None:
+                        first = self._conn.execute("SELECT MIN(ts) FROM measurements").fetchone()[0]
+                        row = (int(first) // resolution * resolution if first is not None else end,)
+                    if row[0] < end:
+                        self._conn.execute(_ROLLUP_FROM_RAW, (resolution, resolution, resolution, row[0], end, resolution))
+                else:
+                    # 上一级汇总完成到哪里，这一级就只能汇总到哪里
+                    source_done = self._conn.execute(
+                        "SELECT done_until FROM rollup_state WHERE resolution = ?", (source,)
+                    ).fetchone()
+                    if source_done is None:
+                        continue
+                    end = source_done[0] // resolution * resolution
+                    if row is None:
+                        first = self._conn.execute("SELECT MIN(bucket) FROM rollups WHERE resolution = ?", (source,)).fetchone()[0]
+                        row = (first // resolution * resolution if first is not None else end,)
+                    if row[0] < end:
+                        self._conn.execute(_ROLLUP_FROM_ROLLUP, (resolution, resolution, resolution, source, row[0], end, resolution))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rollup_state (resolution, done_until) VALUES (?, ?)", (resolution, max(row[0], end))
+                )
+
+            self._conn.execute("DELETE FROM measurements WHERE ts < ?", (now - RAW_DAYS * 86400,))
+            for resolution, days in _ROLLUP_RETENTION.items():
+                self._conn.execute("DELETE FROM rollups WHERE resolution = ? AND bucket < ?", (resolution, now - days * 86400))
+
+    @staticmethod
+    def choose_resolution(since: float, until: float, max_points: int = 500) -> int:
+        """按查询跨度选择读取的粒度：0 表示原始记录，否则为汇总的秒数"""
+        span = until - since
+        now = time.time()
+        if span <= RAW_QUERY_SPAN and since >= now - RAW_DAYS * 86400:
+            return 0
+        for resolution in (MINUTE, HOUR):
+            if span / resolution <= max_points and since >= now - _ROLLUP_RETENTION[resolution] * 86400:
+                return resolution
+        return DAY
+
+    def query(self, node: str, target: str, since: float, until: float = None, kind: str = "ping", mode: str = "", max_points: int = 500):
+        """
+        查询 (节点, 目标) 在时间范围内的测量结果（阻塞，请在线程中调用或使用 query_async）
+
+        跨度较短时返回原始记录，否则返回汇总：已完成汇总的部分读取汇总表，
+        尚未汇总的最近部分从原始记录临时按相同粒度聚合。
+
+        返回:
+            (粒度秒数（0 为原始记录）, 按时间排列的点列表)，每个点为包含
+            ts/count/failures/loss/avg/min/max 的字典，原始记录另有 mdev/rtts/hops/path_hash
+        """
+        until = time.time() if until is None else until
+        resolution = self.choose_resolution(since, until, max_points)
+        # 读取使用独立的连接，WAL 模式下不会被写入阻塞
+        conn = sqlite3.connect(self.path)
+        try:
+            if resolution == 0:
+                rows = conn.execute(
+                    "SELECT ts, ok, loss, min, avg, max, mdev, rtts, hops, path_hash FROM measurements "
+                    "WHERE node = ? AND target = ? AND kind = ? AND mode = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                    (node, target, kind, mode, since, until)
+                ).fetchall()
+                return 0, [{
+                    "ts": ts, "count": 1, "failures": 1 - ok, "loss": loss, "avg": avg, "min": min_rtt, "max": max_rtt,
+                    "mdev": mdev, "rtts": unpack_rtts(rtts), "hops": hops, "path_hash": path_hash,
+                } for ts, ok, loss, min_rtt, avg, max_rtt, mdev, rtts, hops, path_hash in rows]
+
+            row = conn.execute("SELECT done_until FROM rollup_state WHERE resolution = ?", (resolution,)).fetchone()
+            done_until = row[0] if row is not None else since
+            rows = conn.execute(
+                "SELECT bucket, count, failures, loss_sum, loss_count, avg_sum, avg_count, min, max FROM rollups "
+                "WHERE resolution = ? AND node = ? AND target = ? AND kind = ? AND mode = ? AND bucket >= ? AND bucket < ? "
+                "ORDER BY bucket",
+                (resolution, node, target, kind, mode, since // resolution * resolution, min(until, done_until))
+            ).fetchall()
+            if until > done_until:
+                rows += conn.execute(
+                    "SELECT CAST(ts / ? AS INTEGER) * ?, COUNT(*), SUM(ok = 0), TOTAL(loss), COUNT(loss), TOTAL(avg), COUNT(avg), "
+                    "MIN(min), MAX(max) FROM measurements "
+                    "WHERE node = ? AND target = ? AND kind = ? AND mode = ? AND ts >= ? AND ts < ? "
+                    "GROUP BY CAST(ts / ? AS INTEGER) ORDER BY 1",
+                    (resolution, resolution, node, target, kind, mode, max(since, done_until), until, resolution)
+                ).fetchall()
+            return resolution, [_point(*row) for row in rows]
+        finally:
+            conn.close()
+
+    async def query_async(self, *args, **kwargs):
+        return await asyncio.to_thread(self.query, *args, **kwargs)
+
+    def stats(self) -> dict:
+        size = 0
+        if self.running:
+            for suffix in ("", "-wal"):
+                try:
+                    size += os.path.getsize(self.path + suffix)
+                except OSError:
+                    pass
+        return {
+            "written": self.written,
+            "pending": len(self._pending),
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "bytes": size,
+        }
+
+measurement_store = MeasurementStore(MEASUREMENTS_PATH)
@@ -0,0 +1,221 @@
+import time
+import asyncio
+import logging
+import threading
+from bisect import bisect_left
+
+# 远程操作（连接、执行）的耗时分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+# 本地操作（解析、线程池排队）的耗时分桶（秒）
+FAST_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        # 记录可能来自线程池中的线程（paramiko 后端），加锁保证计数准确
+        self._lock = threading.Lock()
+
+    def _header(self) -> list:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+
+class Counter(_Metric):
+    """只增不减的计数器，按标签值分别计数"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = self._header()
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}")
+        return lines
+
+class Histogram(_Metric):
+    """
+    耗时分布，按标签值分别统计各分桶的次数、总和与次数
+
+    observe 只做一次二分查找和几次加法，可以在生产环境中一直开启。
+    """
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [各分桶次数（非累计，最后一个为 +Inf）, 总和, 次数]
+        self._series = {}
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *labels) -> "_Timer":
+        """with histogram.time(标签...): 记录代码块的耗时"""
+        return _Timer(self, labels)
+
+    def render(self) -> list:
+        lines = self._header()
+        with self._lock:
+            items = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for labels, counts, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = f'le="{_format_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_number(total)}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+class Gauge(_Metric):
+    """
+    在导出时才读取的瞬时值
+
+    参数:
+        read: 无参数函数，返回数值；有标签时返回 {标签值元组: 数值}
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, help_text: str, read, labelnames: tuple = ()):
+        super().__init__(name, help_text, labelnames)
+        self.read = read
+
+    def render(self) -> list:
+        lines = self._header()
+        try:
+            value = self.read()
+        except Exception as e:
+            logging.error(f"读取指标 {self.name} 失败: {e}")
+            return lines
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for labels, v in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_number(v)}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"指标 {metric.name} 已存在")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name: str, help_text: str, read, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, read, labelnames))
+
+    def render(self) -> str:
+        """按 Prometheus 文本格式（0.0.4）导出全部指标"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+# 各阶段的耗时指标，由对应模块记录
+SSH_CONNECT_SECONDS = registry.histogram(
+    "netbot_ssh_connect_seconds", "建立并认证 SSH 连接的耗时", ("server",))
+REMOTE_EXEC_SECONDS = registry.histogram(
+    "netbot_remote_exec_seconds", "远程命令从开始执行到输出读取完毕的耗时", ("server", "operation"))
+PARSE_SECONDS = registry.histogram(
+    "netbot_parse_seconds", "解析远程命令输出的耗时", ("operation",), FAST_BUCKETS)
+THREAD_QUEUE_SECONDS = registry.histogram(
+    "netbot_thread_queue_seconds", "远程命令提交到线程池后等待空闲线程的时间（仅线程后端）", ("operation",), FAST_BUCKETS)
+REMOTE_OPERATIONS = registry.counter(
+    "netbot_remote_operations_total", "远程操作次数（含重试后的最终结果）", ("server", "operation", "outcome"))
+TELEGRAM_REQUEST_SECONDS = registry.histogram(
+    "netbot_telegram_request_seconds", "Telegram API 请求的耗时", ("method",))
+TELEGRAM_QUEUE_SECONDS = registry.histogram(
+    "netbot_telegram_queue_seconds", "Telegram 请求在发送队列中等待的时间", ("method",))
+TELEGRAM_REQUESTS = registry.counter(
+    "netbot_telegram_requests_total", "Telegram API 请求次数", ("method", "outcome"))
+
+async def _handle_request(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # 读完请求头，忽略内容
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if line in (b"\r\n", b"\n", b""):
+                break
+        parts = request_line.decode("latin-1").split()
+        path = parts[1].split("?", 1)[0] if len(parts) >= 2 else ""
+        if path in ("/metrics", "/"):
+            status, body = "200 OK", registry.render().encode("utf-8")
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def serve_metrics(host: str, port: int):
+    """启动本地 HTTP 监听，GET /metrics 返回全部指标"""
+    server = await asyncio.start_server(_handle_request, host, port)
+    logging.info(f"指标监听已启动: http://{host}:{port}/metrics")
+    return server
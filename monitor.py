@@ -0,0 +1,270 @@
+import re
+import html
+import time
+import zlib
+import asyncio
+import logging
+from collections import deque
+from config import MONITOR, MONITOR_TARGETS, SERVERS, ADMIN_USERS
+from network import ping_stats_on_server_async, nexttrace_on_server_async
+from route_diff import format_route_diff
+from node_queue import node_scheduler
+from outbox import outbox
+
+MONITOR_INTERVAL = MONITOR.get('interval', 60)
+MONITOR_PING_COUNT = MONITOR.get('ping_count', 5)
+LOSS_THRESHOLD = MONITOR.get('loss_threshold', 20)
+LATENCY_THRESHOLD = MONITOR.get('latency_threshold', 300)
+# 连续多少次超过（或恢复到）阈值才发送告警（或恢复通知），避免偶发抖动反复告警
+ALERT_CONSECUTIVE = MONITOR.get('consecutive', 2)
+MAX_POINTS = MONITOR.get('max_points', 1440)
+# 定时路由追踪的间隔（秒），路径变化时通知管理员；0 表示不追踪
+TRACE_INTERVAL = MONITOR.get('trace_interval', 0)
+# 定时监测在节点任务队列中使用的用户 ID，与真实用户轮流占用节点，不会挤占用户的测试
+MONITOR_OWNER = 0
+
+# 监测目标只允许 IP 地址和域名
+_TARGET_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9.\-:]{0,252}$")
+
+def valid_target(target: str) -> bool:
+    return bool(_TARGET_RE.match(target))
+
+class Sample:
+    """一次探测的结果；探测失败时 loss 为 100，avg 为 None，error 为失败原因"""
+
+    __slots__ = ("ts", "loss", "avg", "error")
+
+    def __init__(self, ts: float, loss: float, avg: float = None, error: str = None):
+        self.ts = ts
+        self.loss = loss
+        self.avg = avg
+        self.error = error
+
+def sample_from_result(result) -> Sample:
+    """把 ping_stats_on_server_async 的结果转换为采样"""
+    now = time.time()
+    if not result.ok:
+        return Sample(now, 100.0, error=str(result.error))
+    stats = result.value
+    if isinstance(stats, str):
+        lines = stats.strip().splitlines()
+        return Sample(now, 100.0, error=lines[-1] if lines else "命令执行错误")
+    loss = float(stats["packet_loss"]) if stats["packet_loss"] is not None else 100.0
+    avg = float(stats["avg"]) if stats["avg"] is not None else None
+    return Sample(now, loss, avg)
+
+class MemorySeriesStore:
+    """
+    内存中的监测时间序列，每个 (节点, 目标) 保留最近 max_points 个采样
+
+    参数:
+        max_points: 每个序列保留的采样数，超出后丢弃最旧的
+    """
+
+    def __init__(self, max_points: int = MAX_POINTS):
+        self.max_points = max_points
+        self._series = {}
+
+    def add(self, server: str, target: str, sample: Sample):
+        series = self._series.get((server, target))
+        if series is None:
+            series = self._series[(server, target)] = deque(maxlen=self.max_points)
+        series.append(sample)
+
+    def latest(self, server: str, target: str):
+        series = self._series.get((server, target))
+        return series[-1] if series else None
+
+    def series(self, server: str, target: str, since: float = 0) -> list:
+        return [s for s in self._series.get((server, target), ()) if s.ts >= since]
+
+    def stats(self) -> dict:
+        return {
+            "series": len(self._series),
+            "samples": sum(len(series) for series in self._series.values()),
+        }
+
+def probe_offset(server_name: str, target: str, interval: float) -> float:
+    """每个 (节点, 目标) 在每轮中的固定偏移，按哈希均匀分散在整个间隔内，重启后保持不变"""
+    return zlib.crc32(f"{server_name}\0{target}".encode()) / 2 ** 32 * interval
+
+class Monitor:
+    """
+    定时从每个节点 Ping 每个监测目标，结果写入时间序列存储，超过阈值时通知管理员
+
+    每个 (节点, 目标) 有一个独立的探测任务，在每轮间隔中的固定偏移处执行，节点不会被同时探测。
+    启用 trace_interval 时每个 (节点, 目标) 另有一个路由追踪任务，路径与上一次不同时通知管理员。
+    服务器列表或目标列表变化后调用 reconcile 增删探测任务。
+
+    参数:
+        store: 时间序列存储，需要提供 add(server, target, sample)、latest、series 和 stats
+        interval: 每个 (节点, 目标) 两次探测的间隔（秒）
+        trace_interval: 每个 (节点, 目标) 两次路由追踪的间隔（秒），0 表示不追踪
+    """
+
+    def __init__(self, store, interval: float = MONITOR_INTERVAL, trace_interval: float = TRACE_INTERVAL):
+        self.store = store
+        self.interval = interval
+        self.trace_interval = trace_interval
+        self.bot = None
+        self.probes = 0
+        self.alerts = 0
+        self.traces = 0
+        self.route_changes = 0
+        # (名称, host, port, 目标, 类型) -> 探测任务，类型为 ping 或 trace
+        self._tasks = {}
+        # (名称, 目标) -> [连续与当前状态相反的次数, 是否处于告警中]
+        self._alert_state = {}
+
+    def start(self, bot) -> asyncio.Task:
+        """开始监测，返回定期调用 reconcile 的后台任务（服务器列表可能被热加载修改）"""
+        self.bot = bot
+        self.reconcile()
+        return asyncio.create_task(self._supervise())
+
+    def stop(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    async def _supervise(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.reconcile()
+
+    def reconcile(self):
+        kinds = ("ping", "trace") if self.trace_interval else ("ping",)
+        wanted = {}
+        for server_info in SERVERS:
+            for target in MONITOR_TARGETS:
+                for kind in kinds:
+                    wanted[(server_info['name'], server_info['host'], int(server_info['port']), target, kind)] = server_info
+        for key in list(self._tasks):
+            if key not in wanted:
+                self._tasks.pop(key).cancel()
+                self._alert_state.pop((key[0], key[3]), None)
+        for key, server_info in wanted.items():
+            if key not in self._tasks:
+                self._tasks[key] = asyncio.create_task(self._run(server_info, key[3], key[4]))
+
+    async def _run(self, server_info: dict, target: str, kind: str):
+        if kind == "trace":
+            interval, probe = self.trace_interval, self.trace
+            # 与同一目标的 Ping 错开
+            offset = probe_offset(server_info['name'], f"{target}\0trace", interval)
+        else:
+            interval, probe = self.interval, self.probe
+            offset = probe_offset(server_info['name'], target, interval)
+        while True:
+            # 对齐到 offset + k * interval，探测耗时不会让后续探测逐渐漂移
+            now = time.time()
+            next_at = ((now - offset) // interval + 1) * interval + offset
+            await asyncio.sleep(next_at - now)
+            try:
+                await probe(server_info, target)
+            except Exception as e:
+                logging.error(f"监测 {server_info['name']} -> {target} 失败: {e}")
+
+    async def probe(self, server_info: dict, target: str) -> Sample:
+        async with node_scheduler.slot(server_info, MONITOR_OWNER):
+            result = await ping_stats_on_server_async(server_info, target, MONITOR_PING_COUNT)
+        sample = sample_from_result(result)
+        self.probes += 1
+        self.store.add(server_info['name'], target, sample)
+        await self._check_alert(server_info['name'], target, sample)
+        return sample
+
+    async def trace(self, server_info: dict, target: str):
+        """路由追踪一次，路径与上一次追踪不同时通知管理员"""
+        async with node_scheduler.slot(server_info, MONITOR_OWNER):
+            result = await nexttrace_on_server_async(server_info, target, "direct", "icmp")
+        self.traces += 1
+        diff = getattr(result.value, "route_diff", None) if result.ok else None
+        if diff is None or not diff.changed:
+            return diff
+        self.route_changes += 1
+        name = server_info['name']
+        logging.warning(f"路由变化: {name} -> {target}")
+        await self.notify_admins(
+            f"🔀 <b>路由变化</b>\n\n节点: {html.escape(name)}\n目标: {html.escape(target)}\n\n{format_route_diff(diff)}"
+        )
+        return diff
+
+    @staticmethod
+    def breach_reason(sample: Sample):
+        """采样超过阈值时返回原因，否则返回 None"""
+        if sample.error:
+            return f"探测失败: {sample.error}"
+        if sample.loss >= LOSS_THRESHOLD:
+            return f"丢包 {sample.loss:g}%（阈值 {LOSS_THRESHOLD}%）"
+        if sample.avg is not None and sample.avg >= LATENCY_THRESHOLD:
+            return f"平均延迟 {sample.avg:.1f} ms（阈值 {LATENCY_THRESHOLD} ms）"
+        return None
+
+    async def _check_alert(self, server: str, target: str, sample: Sample):
+        state = self._alert_state.setdefault((server, target), [0, False])
+        reason = self.breach_reason(sample)
+        if (reason is not None) == state[1]:
+            state[0] = 0
+            return
+        state[0] += 1
+        if state[0] < ALERT_CONSECUTIVE:
+            return
+        state[0] = 0
+        state[1] = reason is not None
+        if state[1]:
+            self.alerts += 1
+            text = f"🔴 <b>监测告警</b>\n\n节点: {html.escape(server)}\n目标: {html.escape(target)}\n{html.escape(reason)}"
+        else:
+            latency = f"{sample.avg:.1f} ms" if sample.avg is not None else "-"
+            text = (f"🟢 <b>监测恢复</b>\n\n节点: {html.escape(server)}\n目标: {html.escape(target)}\n"
+                    f"丢包 {sample.loss:g}%，平均延迟 {latency}")
+        logging.warning(f"监测状态变化: {server} -> {target}: {reason or '已恢复'}")
+        await self.notify_admins(text)
+
+    async def notify_admins(self, text: str):
+        if self.bot is None:
+            return
+        for admin_id in ADMIN_USERS:
+            try:
+                await outbox.send_message(self.bot, admin_id, text, parse_mode="HTML")
+            except Exception as e:
+                logging.error(f"发送监测告警给 {admin_id} 失败: {e}")
+
+    def render_status(self) -> str:
+        """/monitor list 的内容：每个目标在各节点上的最近一次结果"""
+        if not MONITOR_TARGETS:
+            return "当前没有监测目标。\n使用 /monitor add <目标> 添加。"
+        now = time.time()
+        text = f"<b>【定时监测】</b>\n\n每 {self.interval:g} 秒从每个节点 Ping {MONITOR_PING_COUNT} 次\n"
+        if self.trace_interval:
+            text += f"每 {self.trace_interval:g} 秒路由追踪一次，路径变化时通知管理员\n"
+        for target in MONITOR_TARGETS:
+            text += f"\n<b>{html.escape(target)}</b>\n"
+            for server_info in SERVERS:
+                name = server_info['name']
+                sample = self.store.latest(name, target)
+                alerting = self._alert_state.get((name, target), (0, False))[1]
+                icon = "🔴" if alerting else "🟢"
+                if sample is None:
+                    text += f"⚪ {html.escape(name)}: 尚无数据\n"
+                elif sample.error:
+                    text += f"{icon} {html.escape(name)}: 失败（{int(now - sample.ts)} 秒前）\n"
+                else:
+                    latency = f"{sample.avg:.1f} ms" if sample.avg is not None else "-"
+                    text += f"{icon} {html.escape(name)}: 丢包 {sample.loss:g}%，{latency}（{int(now - sample.ts)} 秒前）\n"
+        return text
+
+    def stats(self) -> dict:
+        return {
+            "targets": len(MONITOR_TARGETS),
+            "tasks": len(self._tasks),
+            "probes": self.probes,
+            "alerting": sum(1 for _, alerting in self._alert_state.values() if alerting),
+            "alerts": self.alerts,
+            "traces": self.traces,
+            "route_changes": self.route_changes,
+            **self.store.stats(),
+        }
+
+monitor = Monitor(MemorySeriesStore())
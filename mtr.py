@@ -0,0 +1,132 @@
+import html
+from config import MTR
+from latency import RunningStats
+
+DEFAULT_ROUNDS = MTR.get('rounds', 10)
+MAX_ROUNDS = MTR.get('max_rounds', 30)
+QUERIES = MTR.get('queries', 3)
+ROUND_TIMEOUT = MTR.get('round_timeout', 30)
+
+# 远程循环在每轮 nexttrace 结束后输出的分隔行
+ROUND_MARKER = "--- nexttrace-bot round end ---"
+# 每跳最多记录的不同地址数（负载均衡的路径上同一跳可能有多个地址）
+MAX_ADDRESSES = 3
+
+class HopStats:
+    """一跳在所有轮次中的累计统计"""
+
+    __slots__ = ("ttl", "sent", "received", "rtt", "addresses", "asn")
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.sent = 0
+        self.received = 0
+        self.rtt = RunningStats()
+        self.addresses = []
+        self.asn = ""
+
+    @property
+    def loss(self) -> float:
+        return (self.sent - self.received) * 100 / self.sent if self.sent else 0.0
+
+class MtrReport:
+    """
+    MTR 式报告：把同一条 SSH 命令中连续多轮 nexttrace 的输出逐轮累计为每跳的发送数、丢包率和时延统计
+
+    与 NexttraceStreamParser 一样逐行 feed，只缓存当前这一轮的输出；遇到 ROUND_MARKER 时解析这一轮并累计，
+    每跳的时延用 RunningStats 流式统计，轮数增加时内存不变。执行过程中可以随时 render 已完成轮次的结果。
+
+    参数:
+        rounds: 计划执行的轮数
+        queries: 每轮每跳的探测包数（nexttrace -q）
+        decode: 把一轮的完整输出解析为 TraceResult 的函数，无法解析时返回 None
+    """
+
+    def __init__(self, rounds: int, queries: int, decode):
+        self.rounds = rounds
+        self.queries = queries
+        self.decode = decode
+        self.reset()
+
+    def reset(self):
+        self.completed = 0
+        self.failed = 0
+        self.hops = {}
+        self._lines = []
+
+    def feed(self, text: str):
+        for line in text.splitlines():
+            if line.strip() == ROUND_MARKER:
+                self._finish_round()
+            else:
+                self._lines.append(line)
+
+    def _finish_round(self):
+        output = "\n".join(self._lines)
+        self._lines = []
+        trace = self.decode(output)
+        if trace is None or not trace.hops:
+            self.failed += 1
+            return
+        self.add_round(trace)
+
+    def add_round(self, trace):
+        """累计一轮的 TraceResult"""
+        self.completed += 1
+        for hop in trace.hops:
+            stats = self.hops.get(hop.ttl)
+            if stats is None:
+                stats = self.hops[hop.ttl] = HopStats(hop.ttl)
+            stats.sent += self.queries
+            stats.received += min(len(hop.rtts), self.queries)
+            for rtt in hop.rtts:
+                stats.rtt.add(rtt)
+            if hop.ip and hop.ip not in stats.addresses and len(stats.addresses) < MAX_ADDRESSES:
+                stats.addresses.append(hop.ip)
+            if hop.asn and not stats.asn:
+                stats.asn = hop.asn
+
+    def _table(self) -> str:
+        rows = []
+        first_ttl = min(self.hops)
+        for ttl in sorted(self.hops):
+            stats = self.hops[ttl]
+            if ttl == first_ttl and stats.addresses:
+                # 与路由追踪结果一样隐藏第一跳的地址
+                address = "x.x.x.x"
+            elif stats.addresses:
+                address = stats.addresses[0] + (f" (+{len(stats.addresses) - 1})" if len(stats.addresses) > 1 else "")
+            else:
+                address = "???"
+            asn = f"AS{stats.asn}" if stats.asn else ""
+            if stats.rtt.count:
+                timings = f"{stats.rtt.best:>7.1f} {stats.rtt.mean:>7.1f} {stats.rtt.worst:>7.1f} {stats.rtt.stdev:>6.1f}"
+            else:
+                timings = f"{'-':>7} {'-':>7} {'-':>7} {'-':>6}"
+            rows.append((f"{ttl:>2}", address, asn, f"{stats.loss:>5.1f}% {stats.sent:>4} {timings}"))
+        # 表头沿用 mtr 的英文列名，中文在等宽字体中占两格会破坏对齐
+        address_width = max(len("Host"), *(len(row[1]) for row in rows))
+        asn_width = max(len("AS"), *(len(row[2]) for row in rows))
+        header = (
+            f"{'#':>2}  {'Host':<{address_width}}  {'AS':<{asn_width}}  "
+            f"{'Loss%':>6} {'Snt':>4} {'Best':>7} {'Avg':>7} {'Wrst':>7} {'StDev':>6}"
+        )
+        lines = [header] + [f"{ttl}  {address:<{address_width}}  {asn:<{asn_width}}  {rest}" for ttl, address, asn, rest in rows]
+        return "\n".join(lines)
+
+    def render(self, server_name: str, target: str, finished: bool = True) -> str:
+        text = (
+            "<b>【MTR 路由报告】</b>\n\n"
+            f"节点: {html.escape(server_name)}\n"
+            f"目标: {html.escape(target)}\n"
+            f"轮数: {self.completed}/{self.rounds}（每轮每跳 {self.queries} 个探测包）\n"
+        )
+        if self.failed:
+            text += f"失败轮数: {self.failed}\n"
+        if self.hops:
+            text += "\n<pre>" + html.escape(self._table()) + "</pre>\n"
+        if not finished:
+            text += f"\n正在执行第 {min(self.completed + self.failed + 1, self.rounds)}/{self.rounds} 轮，请稍候..."
+        elif not self.hops:
+            text += "\n没有得到任何结果。"
+        return text
@@ -1,255 +1,711 @@
 import re
-import paramiko
-from utils import retry_operation
+import html
+import shlex
+import time
+import asyncio
+import unicodedata
+from config import SSH_POOL, SSH_BACKEND, NEXTTRACE_FORMAT, IPDB
+from ssh_pool import SSHConnectionPool
+from async_ssh_pool import AsyncSSHConnectionPool, asyncssh
+from resilience import OperationResult, CircuitOpenError, retry_async, get_breaker
+from metrics import REMOTE_EXEC_SECONDS, PARSE_SECONDS, THREAD_QUEUE_SECONDS, REMOTE_OPERATIONS
+from latency import PingSamples, extract_samples, analyze
+from trace_model import TraceResult, decode_nexttrace_json, hop_from_text, render_trace_result
+from measurements import measurement_store
+from route_diff import route_tracker, format_route_diff
+from mtr import MtrReport, ROUND_MARKER, ROUND_TIMEOUT
+from ipdb import ip_database
 import logging
 
-def parse_ping_output(output: str) -> str:
-    lines = output.strip().split("\n")
-    packets_line = None
-    rtt_line = None
+# 本地 IP 数据库可用时让 nexttrace 不再查询远程地理信息接口
+DISABLE_REMOTE_GEOIP = IPDB.get('disable_remote_geoip', False)
 
-    for line in lines:
-        if "packets transmitted" in line and "packet loss" in line:
-            packets_line = line.strip()
-        if "rtt min/avg/max/mdev" in line:
-            rtt_line = line.strip()
+# 所有远程命令共用的 SSH 连接池
+ssh_pool = SSHConnectionPool(**SSH_POOL)
+
+# 异步后端（可选）：SSH_BACKEND 为 "asyncssh" 且已安装 asyncssh 时启用
+async_ssh_pool = None
+if SSH_BACKEND == "asyncssh":
+    if asyncssh is None:
+        logging.warning("SSH_BACKEND 配置为 asyncssh，但未安装 asyncssh，回退到线程后端")
+    else:
+        async_ssh_pool = AsyncSSHConnectionPool(**SSH_POOL)
+ACTIVE_BACKEND = "asyncssh" if async_ssh_pool is not None else "thread"
+
+# 解析用到的正则在模块加载时编译一次
+# 兼容 iputils（"+N errors" 等附加字段）、BusyBox 和 BSD 的汇总行写法
+_PING_PACKETS_RE = re.compile(r"(\d+)\s+packets transmitted,\s+(\d+)\s+(?:packets\s+)?received,(?:\s+\+\d+\s+\w+,)*\s+(\d+(?:\.\d+)?)% packet loss")
+_PING_RTT_RE = re.compile(r"(?:rtt|round-trip) min/avg/max(?:/(?:mdev|stddev))? = ([\d\.]+)/([\d\.]+)/([\d\.]+)(?:/([\d\.]+))?\s*ms")
+_ANSI_ESCAPE_RE = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
+_HOP_START_RE = re.compile(r'^\d+\s+')
+_FIRST_HOP_ADDRESS_RE = re.compile(r'\b((?:[0-9A-Fa-f]{1,4}(?::[0-9A-Fa-f]{1,4}){7}|(?:[0-9A-Fa-f]{1,4}(?::[0-9A-Fa-f]{1,4}){0,7})?::(?:[0-9A-Fa-f]{1,4}(?::[0-9A-Fa-f]{1,4}){0,7})?))\b')
+
+def _last_line_containing(text: str, needle: str, also: str = None):
+    """返回 text 中最后一个包含 needle（以及 also）的行，找不到时返回 None"""
+    end = len(text)
+    while True:
+        idx = text.rfind(needle, 0, end)
+        if idx < 0:
+            return None
+        start = text.rfind("\n", 0, idx) + 1
+        stop = text.find("\n", idx)
+        line = text[start:] if stop < 0 else text[start:stop]
+        if also is None or also in line:
+            return line
+        end = start
+
+def parse_ping_stats(output: str, samples: PingSamples = None) -> dict:
+    """
+    从 ping 输出的汇总行中提取统计数据
+
+    参数:
+        samples: extract_samples 的结果，可选；汇总行没有 mdev（BusyBox）时用它补算
+
+    返回:
+        包含 transmitted/received/packet_loss/min/avg/max/mdev 的字典（值为原始文本，
+        未找到的字段为 None）
+    """
+    # 汇总行在输出末尾，直接从后往前查找，不拆分整个输出（同类行有多行时以最后一行为准）
+    packets_line = _last_line_containing(output, "packets transmitted", "packet loss")
+    rtt_line = _last_line_containing(output, "min/avg/max")
 
     transmitted = received = packet_loss = None
     min_rtt = avg_rtt = max_rtt = mdev = None
 
     if packets_line:
-        pattern_packets = re.compile(r"(\d+)\s+packets transmitted,\s+(\d+)\s+received,\s+(\d+)% packet loss")
-        match = pattern_packets.search(packets_line)
+        match = _PING_PACKETS_RE.search(packets_line)
         if match:
             transmitted, received, packet_loss = match.groups()
 
     if rtt_line:
-        pattern_rtt = re.compile(r"rtt min/avg/max/mdev = ([\d\.]+)/([\d\.]+)/([\d\.]+)/([\d\.]+)\s+ms")
-        match = pattern_rtt.search(rtt_line)
+        match = _PING_RTT_RE.search(rtt_line)
         if match:
             min_rtt, avg_rtt, max_rtt, mdev = match.groups()
-
-    if transmitted and received and packet_loss and min_rtt and avg_rtt and max_rtt and mdev:
+            if mdev is None:
+                if samples is None:
+                    samples = extract_samples(output)
+                if samples.rtts:
+                    mdev = f"{analyze(samples)['mdev']:.3f}"
+
+    return {
+        "transmitted": transmitted,
+        "received": received,
+        "packet_loss": packet_loss,
+        "min": min_rtt,
+        "avg": avg_rtt,
+        "max": max_rtt,
+        "mdev": mdev,
+    }
+
+def parse_ping_output(output: str, samples: PingSamples = None, stats: dict = None) -> str:
+    # 调用方已经解析过时直接使用，避免重复扫描输出
+    if samples is None:
+        samples = extract_samples(output)
+    if stats is None:
+        stats = parse_ping_stats(output, samples)
+    if all(stats.values()):
         summary = (
-            f"传输包数量: {transmitted}\n"
-            f"接收包数量: {received}\n"
-            f"丢包率: {packet_loss}%\n"
-            f"最小延迟: {min_rtt} ms\n"
-            f"平均延迟: {avg_rtt} ms\n"
-            f"最大延迟: {max_rtt} ms\n"
-            f"标准差(mdev): {mdev} ms"
+            f"传输包数量: {stats['transmitted']}\n"
+            f"接收包数量: {stats['received']}\n"
+            f"丢包率: {stats['packet_loss']}%\n"
+            f"最小延迟: {stats['min']} ms\n"
+            f"平均延迟: {stats['avg']} ms\n"
+            f"最大延迟: {stats['max']} ms\n"
+            f"标准差(mdev): {stats['mdev']} ms"
         )
+        if samples.rtts:
+            # 逐包时延的分布统计
+            samples.transmitted = int(stats['transmitted'])
+            dist = analyze(samples)
+            summary += (
+                f"\nP50/P90/P99: {dist['p50']:.3f} / {dist['p90']:.3f} / {dist['p99']:.3f} ms\n"
+                f"抖动(jitter): {dist['jitter']:.3f} ms\n"
+                f"最长连续丢包: {dist['longest_loss_burst']} 个\n"
+                f"逐包延迟: <code>{dist['sparkline']}</code>"
+            )
         return summary
     else:
         return output
 
-def format_nexttrace_result(raw_output: str, server_name: str, target: str, ip_type: str, trace_mode: str = "icmp") -> str:
-    # 1. 删除 ANSI 颜色控制符
-    ansi_escape = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
-    clean_output = ansi_escape.sub('', raw_output)
-
-    # 2. 按行拆分
-    lines = clean_output.splitlines()
-    header_lines = []
-    hop_lines = []
-    map_url_line = None
-
-    in_hops = False
-    found_icmp_mode = False
-    found_tcp_mode = False
-
-    for line in lines:
-        stripped = line.strip()
+def _display_width(text: str) -> int:
+    # 中日韩字符在等宽字体中占两个字符宽度
+    return sum(2 if unicodedata.east_asian_width(ch) in "WF" else 1 for ch in text)
+
+def _pad(text: str, width: int) -> str:
+    return text + " " * (width - _display_width(text))
+
+# 批量安装看板中各状态的图标和说明
+_INSTALL_STATES = {
+    "pending": ("⏳", "等待中"),
+    "probing": ("🔍", "检查版本…"),
+    "running": ("🔧", "安装中…"),
+    "ok": ("✅", "安装完成"),
+    "skipped": ("☑️", "已是最新，跳过"),
+    "failed": ("❌", "失败"),
+}
+
+def format_install_board(servers: list, statuses: list) -> str:
+    """
+    将批量安装 NextTrace 的进度渲染为逐节点的状态看板
+
+    参数:
+        servers: 参与安装的服务器列表
+        statuses: 与 servers 一一对应的 (状态, 说明)，状态为 _INSTALL_STATES 中的键，
+                  说明为版本号或错误信息，可以为 None
+    """
+    counts = {}
+    lines = []
+    for server_info, (state, detail) in zip(servers, statuses):
+        counts[state] = counts.get(state, 0) + 1
+        icon, label = _INSTALL_STATES[state]
+        line = f"{icon} {html.escape(server_info['name'])}: {label}"
+        if detail:
+            line += f" ({html.escape(detail)})"
+        lines.append(line)
+    finished = sum(counts.get(state, 0) for state in ("ok", "skipped", "failed"))
+
+    result = "<b>【NextTrace 批量安装】</b>\n\n"
+    result += f"进度: {finished}/{len(servers)}"
+    result += f"（成功 {counts.get('ok', 0)}，跳过 {counts.get('skipped', 0)}，失败 {counts.get('failed', 0)}）\n\n"
+    result += "\n".join(lines) + "\n"
+    return result
+
+def format_pingall_result(target: str, ping_count: int, servers: list, results: list) -> str:
+    """
+    将多节点 Ping 结果渲染为一张对齐的表格
+
+    参数:
+        servers: 参与测试的服务器列表
+        results: 与 servers 一一对应，None 表示尚未完成，dict 为 parse_ping_stats 的结果，
+                 str 为错误信息
+    """
+    finished = sum(1 for r in results if r is not None)
+    rows = []
+    for server_info, stats in zip(servers, results):
+        name = html.escape(server_info['name'])
+        if stats is None:
+            rows.append((2, 0.0, [name, "测试中…"]))
+        elif isinstance(stats, str):
+            rows.append((1, 0.0, [name, "失败"]))
+        elif stats["avg"] is None:
+            loss = f"{stats['packet_loss']}%" if stats["packet_loss"] is not None else "-"
+            rows.append((1, 0.0, [name, loss, "-", "-", "-", "-"]))
+        else:
+            rows.append((0, float(stats["avg"]), [
+                name, f"{stats['packet_loss']}%", stats["min"], stats["avg"], stats["max"], stats["mdev"]
+            ]))
+    # 已完成的按平均延迟升序，其次是失败/全部丢包的节点，最后是仍在测试中的节点
+    rows.sort(key=lambda row: (row[0], row[1]))
+
+    header = ["节点", "丢包", "min", "avg", "max", "mdev"]
+    widths = [_display_width(h) for h in header]
+    for _, _, cells in rows:
+        for i, cell in enumerate(cells):
+            widths[i] = max(widths[i], _display_width(cell))
+    table_lines = ["  ".join(_pad(h, widths[i]) for i, h in enumerate(header)).rstrip()]
+    for _, _, cells in rows:
+        table_lines.append("  ".join(_pad(cell, widths[i]) for i, cell in enumerate(cells)).rstrip())
+
+    result = "<b>【多节点 Ping 测试结果】</b>\n\n"
+    result += f"目标: {target}\n"
+    result += f"Ping 次数: {ping_count}\n"
+    result += f"进度: {finished}/{len(servers)}\n\n"
+    result += "<pre>" + "\n".join(table_lines) + "</pre>\n"
+
+    errors = [
+        f"{html.escape(server_info['name'])}: {html.escape(stats.strip().splitlines()[-1] if stats.strip() else stats)}"
+        for server_info, stats in zip(servers, results) if isinstance(stats, str)
+    ]
+    if errors:
+        result += "\n<b>失败节点</b>:\n" + "\n".join(errors) + "\n"
+    return result
+
+def _collapse_whitespace(text: str) -> str:
+    # 等价于 re.sub(r'\s+', ' ', text).strip()
+    return " ".join(text.split())
+
+class NexttraceStreamParser:
+    """
+    逐行解析 NextTrace 的文本输出
+
+    可以在命令执行过程中不断 feed 新到达的输出，随时通过 render 得到当前已解析出的跳数；
+    format_nexttrace_result 也使用同一套逻辑处理完整输出。
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.header_lines = []
+        self.condensed_hops = []
+        self.current_hop = []
+        self.map_url_line = None
+        self.in_hops = False
+        self.found_icmp_mode = False
+        self.found_tcp_mode = False
+        self.done = False
+
+    def feed(self, text: str):
+        # 1. 删除 ANSI 颜色控制符（不含 ESC 时跳过替换）
+        if "\x1b" in text:
+            text = _ANSI_ESCAPE_RE.sub('', text)
+        # 2. 按行拆分
+        for line in text.splitlines():
+            if self.done:
+                return
+            self._feed_line(line.strip())
+
+    def _feed_line(self, stripped: str):
         if stripped.startswith("MapTrace URL:"):
-            map_url_line = stripped
-            in_hops = False
-            break
+            self.map_url_line = stripped
+            self.in_hops = False
+            self.done = True
+            return
 
         if "ICMP mode" in stripped:
-            found_icmp_mode = True
-            in_hops = True
-            continue
-            
+            self.found_icmp_mode = True
+            self.in_hops = True
+            return
+
         if "TCP mode" in stripped or "TCP SYN" in stripped:  # 检测TCP模式
-            found_tcp_mode = True
-            in_hops = True
-            continue
+            self.found_tcp_mode = True
+            self.in_hops = True
+            return
+
+        if not self.in_hops:
+            self.header_lines.append(stripped)
+            return
+
+        # 3. 合并同一 hop 的多行：先收集各行，换到下一跳时再一次性合并
+        if not stripped:
+            return
+        if _HOP_START_RE.match(stripped):
+            if self.current_hop:
+                self.condensed_hops.append(_collapse_whitespace(" ".join(self.current_hop)))
+            self.current_hop = [stripped]
+        else:
+            self.current_hop.append(stripped)
+
+    def hops(self) -> list:
+        """返回目前为止合并好的跳数（包括仍可能追加内容的最后一跳）"""
+        hops = list(self.condensed_hops)
+        if self.current_hop:
+            hops.append(_collapse_whitespace(" ".join(self.current_hop)))
+
+        # 4. 隐藏第一跳的 IP 地址
+        if hops:
+            hops[0] = _FIRST_HOP_ADDRESS_RE.sub('x.x.x.x', hops[0], count=1)
+        return hops
+
+    def render(self, server_name: str, target: str, ip_type: str, trace_mode: str = "icmp", finished: bool = True) -> str:
+        condensed_hops = self.hops()
+
+        # 5. 拼接输出结果
+        trace_mode_text = "TCP模式" if trace_mode == "tcp" else "ICMP模式"
+        parts = [
+            "<b>【NextTrace 路由追踪结果】</b>\n\n",
+            f"节点: {server_name}\n",
+            f"目标: {target}\n",
+            f"执行模式: {'直接执行' if ip_type=='direct' else ip_type} ({trace_mode_text})\n\n",
+        ]
+
+        filtered_header = [h for h in self.header_lines if h]
+        if filtered_header:
+            parts.append("<b>头部信息</b>:\n<pre>")
+            parts.append("\n".join(filtered_header))
+            parts.append("</pre>\n\n")
+
+        if not finished:
+            if condensed_hops:
+                parts.append("<b>路由跳数</b>:\n<pre>")
+                parts.append("\n\n".join(condensed_hops))
+                parts.append("</pre>\n\n")
+                parts.append(f"正在执行路由追踪操作，已发现 {len(condensed_hops)} 跳...")
+            else:
+                # JSON 格式的结果在追踪结束后才一次性输出，执行过程中没有跳数可以显示
+                parts.append("正在执行路由追踪操作，请稍候...")
+            return "".join(parts)
+
+        if not (self.found_icmp_mode or self.found_tcp_mode):
+            parts.append("未找到路由信息，可能 NextTrace 输出异常。\n")
+            return "".join(parts)
+
+        if condensed_hops:
+            parts.append("<b>路由跳数</b>:\n")
+            last_hop = condensed_hops[-1]
+            formatted_hops = []
+            for hop in condensed_hops:
+                formatted_hops.append(hop)
+                # 与最后一跳内容相同的跳之后不加空行（保持原有输出格式）
+                if hop != last_hop:
+                    formatted_hops.append("")
+            parts.append("<pre>")
+            parts.append("\n".join(formatted_hops))
+            parts.append("</pre>\n\n")
+        else:
+            parts.append("未捕获到路由跳数信息。\n")
 
-        if in_hops:
-            hop_lines.append(stripped)
+        if self.map_url_line:
+            parts.append(f"<b>{self.map_url_line}</b>\n")
         else:
-            header_lines.append(stripped)
-
-    # 3. 合并同一 hop 的多行
-    condensed_hops = []
-    current_hop = ""
-    hop_start_pattern = re.compile(r'^\d+\s+')
-    for hl in hop_lines:
-        if not hl:
-            continue
-        if hop_start_pattern.match(hl):
-            if current_hop:
-                current_hop = re.sub(r'\s+', ' ', current_hop).strip()
-                condensed_hops.append(current_hop)
-            current_hop = hl
+            parts.append("未发现 MapTrace URL\n")
+
+        return "".join(parts)
+
+def format_nexttrace_result(raw_output: str, server_name: str, target: str, ip_type: str, trace_mode: str = "icmp") -> str:
+    parser = NexttraceStreamParser()
+    parser.feed(raw_output)
+    return parser.render(server_name, target, ip_type, trace_mode)
+
+def trace_result_from_text(raw_output: str) -> TraceResult:
+    """用文本解析器处理旧版 nexttrace 的输出，得到结构化结果（保留原始文本用于显示）"""
+    parser = NexttraceStreamParser()
+    parser.feed(raw_output)
+    hops = list(parser.condensed_hops)
+    if parser.current_hop:
+        hops.append(_collapse_whitespace(" ".join(parser.current_hop)))
+    map_url = parser.map_url_line[len("MapTrace URL:"):].strip() if parser.map_url_line else None
+    return TraceResult([hop_from_text(hop) for hop in hops], map_url, raw_text=raw_output)
+
+def render_trace(value, server_name: str, target: str, ip_type: str, trace_mode: str = "icmp") -> str:
+    """
+    渲染 nexttrace_on_server_async 的结果
+
+    参数:
+        value: TraceResult，或命令出错时的错误信息字符串
+    """
+    if isinstance(value, TraceResult):
+        if value.raw_text is None:
+            text = render_trace_result(value, server_name, target, ip_type, trace_mode)
         else:
-            current_hop += " " + hl
-    if current_hop:
-        current_hop = re.sub(r'\s+', ' ', current_hop).strip()
-        condensed_hops.append(current_hop)
-
-    # 4. 隐藏第一跳的 IP 地址
-    if condensed_hops:
-        pattern = r'\b((?:[0-9A-Fa-f]{1,4}(?::[0-9A-Fa-f]{1,4}){7}|(?:[0-9A-Fa-f]{1,4}(?::[0-9A-Fa-f]{1,4}){0,7})?::(?:[0-9A-Fa-f]{1,4}(?::[0-9A-Fa-f]{1,4}){0,7})?))\b'
-        condensed_hops[0] = re.sub(pattern, 'x.x.x.x', condensed_hops[0], count=1)
-
-    # 5. 拼接输出结果
-    result = "<b>【NextTrace 路由追踪结果】</b>\n\n"
-    result += f"节点: {server_name}\n"
-    result += f"目标: {target}\n"
-    trace_mode_text = "TCP模式" if trace_mode == "tcp" else "ICMP模式"
-    result += f"执行模式: {'直接执行' if ip_type=='direct' else ip_type} ({trace_mode_text})\n\n"
-
-    filtered_header = [h for h in header_lines if h]
-    if filtered_header:
-        result += "<b>头部信息</b>:\n"
-        result += "<pre>" + "\n".join(filtered_header) + "</pre>\n\n"
-
-    if not (found_icmp_mode or found_tcp_mode):
-        result += f"未找到路由信息，可能 NextTrace 输出异常。\n"
-        return result
-
-    if condensed_hops:
-        result += "<b>路由跳数</b>:\n"
-        formatted_hops = []
-        for hop in condensed_hops:
-            formatted_hops.append(hop)
-            if hop != condensed_hops[-1]:
-                formatted_hops.append("")
-        result += "<pre>" + "\n".join(formatted_hops) + "</pre>\n\n"
-    else:
-        result += "未捕获到路由跳数信息。\n"
+            text = format_nexttrace_result(value.raw_text, server_name, target, ip_type, trace_mode)
+        if value.route_diff is not None:
+            text += "\n" + format_route_diff(value.route_diff)
+        return text
+    return format_nexttrace_result(value, server_name, target, ip_type, trace_mode)
+
+def build_ping_command(target: str, ping_count: int) -> str:
+    # 目标来自用户输入，引用后再拼进 shell 命令
+    return f"ping -c {int(ping_count)} {shlex.quote(target)}"
+
+def build_nexttrace_command(target: str, ip_type: str, trace_mode: str = "icmp", json_output: bool = False, queries: int = None, geoip: bool = True) -> str:
+    # 构建命令基础部分
+    cmd_base = "nexttrace"
+
+    # 请求结构化输出
+    if json_output:
+        cmd_base += " --json"
+
+    # 添加IP类型参数
+    if ip_type == "IPv4":
+        cmd_base += " -4"
+    elif ip_type == "IPv6":
+        cmd_base += " -6"
+
+    # 添加追踪模式
+    if trace_mode == "tcp":
+        cmd_base += " --tcp"
+
+    # 每跳的探测包数
+    if queries:
+        cmd_base += f" -q {int(queries)}"
+
+    # 不查询远程地理信息接口（由本地 IP 数据库补全）
+    if not geoip:
+        cmd_base += " --data-provider disable-geoip"
+
+    # 完成命令
+    return f"{cmd_base} {shlex.quote(target)}"
+
+def build_mtr_command(target: str, rounds: int, queries: int, json_output: bool = False, geoip: bool = True) -> str:
+    """在同一条命令（同一个 SSH 会话）中连续执行 rounds 轮 nexttrace，每轮结束后输出 ROUND_MARKER"""
+    trace_cmd = build_nexttrace_command(target, "direct", "icmp", json_output, queries, geoip)
+    return f"for i in $(seq {int(rounds)}); do {trace_cmd}; echo '{ROUND_MARKER}'; done"
+
+def _ping_result(output: str, error: str) -> str:
+    if error.strip():
+        return f"命令执行错误：\n{error}"
+    return parse_ping_output(output)
+
+def _ping_measured_result(output: str, error: str):
+    # 与 _ping_result 相同，另外返回统计和逐包样本供记录测量结果，输出只解析一次
+    if error.strip():
+        return f"命令执行错误：\n{error}", None, None
+    samples = extract_samples(output)
+    stats = parse_ping_stats(output, samples)
+    return parse_ping_output(output, samples, stats), stats, samples
+
+def _ping_stats_result(output: str, error: str):
+    if error.strip():
+        return f"命令执行错误：\n{error}", None
+    samples = extract_samples(output)
+    return parse_ping_stats(output, samples), samples
+
+# nexttrace 的远程地理信息接口不可用时的结果
+GEO_SERVICE_UNAVAILABLE = "路由追踪服务暂时不可用，请稍后重试。"
+
+def remote_geoip_enabled() -> bool:
+    """是否让 nexttrace 查询远程地理信息接口（配置了 disable_remote_geoip 且本地 IP 数据库可用时不查询）"""
+    return not (DISABLE_REMOTE_GEOIP and ip_database.available)
+
+def _nexttrace_result(output: str, error: str) -> str:
+    if error.strip():
+        if "RetToken failed" in error:
+            return GEO_SERVICE_UNAVAILABLE
+        return f"命令执行错误：\n{error}"
+    return output
+
+def _nexttrace_text_result(output: str, error: str):
+    value = _nexttrace_result(output, error)
+    return value if error.strip() else trace_result_from_text(value)
+
+def _nexttrace_json_result(output: str, error: str):
+    if error.strip():
+        return _nexttrace_result(output, error)
+    result = decode_nexttrace_json(output)
+    # 没有得到 JSON 时按文本输出处理
+    return result if result is not None else trace_result_from_text(output)
+
+def decode_trace_round(output: str):
+    """解析 MTR 报告中一轮 nexttrace 的输出（JSON 或文本）"""
+    result = decode_nexttrace_json(output)
+    result = result if result is not None else trace_result_from_text(output)
+    ip_database.enrich(result)
+    return result
 
-    if map_url_line:
-        result += f"<b>{map_url_line}</b>\n"
-    else:
-        result += "未发现 MapTrace URL\n"
+def _mtr_result(output: str, error: str):
+    # 各轮的结果已经由 MtrReport 逐行累计；stderr 中的错误只在没有任何一轮成功时才作为结果
+    return _nexttrace_result(output, error) if error.strip() else None
 
+def _mtr_outcome(result: OperationResult, report: MtrReport) -> OperationResult:
+    if result.ok and (result.value is None or report.completed):
+        result.value = report
     return result
 
+def _json_unsupported(value) -> bool:
+    # 旧版 nexttrace 不认识 --json 参数时会在 stderr 中报错
+    return isinstance(value, str) and value.startswith("命令执行错误") and "json" in value.lower()
+
+def is_error_result(value) -> bool:
+    """判断命令结果是否为远程报错信息（这类结果不应缓存）"""
+    return isinstance(value, str) and (value.startswith("命令执行错误") or value == GEO_SERVICE_UNAVAILABLE)
+
+def _install_result(output: str, error: str) -> str:
+    # 检查是否安装成功
+    combined_output = output + "\n" + error
+    if "一切准备就绪" in combined_output:
+        return "✅ NextTrace 安装成功！"
+    elif error.strip():
+        return f"命令执行错误：\n{error}"
+    else:
+        return f"安装输出：\n{output}\n\n未检测到'一切准备就绪'，请手动确认安装状态。"
+
+# nexttrace --version 输出的第一行形如 "NextTrace v1.3.7 2024-..."
+_NEXTTRACE_VERSION_RE = re.compile(r"NextTrace\s+v?(\d+(?:\.\d+)+)", re.IGNORECASE)
+
+def _version_result(output: str, error: str):
+    # 未安装时 shell 会报 command not found，此时没有版本号
+    match = _NEXTTRACE_VERSION_RE.search(output + "\n" + error)
+    return match.group(1) if match else None
+
+def version_at_least(version: str, minimum: str) -> bool:
+    """按数字逐段比较版本号，如 1.3.10 高于 1.3.9"""
+    def parts(text):
+        return tuple(int(p) for p in re.findall(r"\d+", text))
+    return parts(version) >= parts(minimum)
+
+def _interpret_timed(interpret, output: str, error: str, operation: str):
+    start = time.perf_counter()
+    try:
+        return interpret(output, error)
+    finally:
+        PARSE_SECONDS.observe(time.perf_counter() - start, operation)
+
+def _execute_on_server(server_info: dict, cmd: str, timeout: int, interpret, on_line=None, on_attempt=None, operation: str = "command", submitted: float = None) -> str:
+    """
+    执行一次远程命令（阻塞，复用连接池中的连接），SSH 层面的失败会抛出异常
+
+    传入 on_line 时以流式方式读取 stdout，执行前先调用 on_attempt 通知调用方清空已收到的部分输出。
+    submitted 为提交到线程池的时刻（time.perf_counter()），用来统计排队等待线程的时间。
+    """
+    if submitted is not None:
+        THREAD_QUEUE_SECONDS.observe(time.perf_counter() - submitted, operation)
+    try:
+        with REMOTE_EXEC_SECONDS.time(server_info['name'], operation):
+            if on_line is None:
+                output, error = ssh_pool.exec_command(server_info, cmd, timeout=timeout)
+            else:
+                on_attempt()
+                output, error = ssh_pool.exec_command_stream(server_info, cmd, timeout, on_line)
+    except Exception as e:
+        raise Exception(f"SSH或执行命令异常: {str(e)}")
+    return _interpret_timed(interpret, output, error, operation)
+
+async def _run_on_server_async(server_info: dict, cmd: str, timeout: int, interpret, parser=None, operation: str = "command") -> OperationResult:
+    """
+    按配置的后端执行远程命令，失败时按 RETRY_POLICY 退避重试，并记录到该节点的熔断器
+
+    传入 parser 时以流式方式读取 stdout，每到达一行就调用 parser.feed，重试前调用 parser.reset。
+    operation 为指标中的操作名（ping、nexttrace 等）。
+    """
+    if async_ssh_pool is None:
+        # 线程后端：每次尝试把阻塞的 paramiko 调用放到线程池中执行，退避等待不占用线程
+        if parser is None:
+            def attempt():
+                return asyncio.to_thread(
+                    _execute_on_server, server_info, cmd, timeout, interpret,
+                    operation=operation, submitted=time.perf_counter()
+                )
+        else:
+            loop = asyncio.get_running_loop()
+
+            def attempt():
+                return asyncio.to_thread(
+                    _execute_on_server, server_info, cmd, timeout, interpret,
+                    lambda line: loop.call_soon_threadsafe(parser.feed, line),
+                    lambda: loop.call_soon_threadsafe(parser.reset),
+                    operation=operation, submitted=time.perf_counter()
+                )
+    else:
+        # asyncssh 后端：直接在事件循环上执行，不占用线程
+        async def attempt():
+            try:
+                with REMOTE_EXEC_SECONDS.time(server_info['name'], operation):
+                    if parser is None:
+                        output, error = await async_ssh_pool.exec_command(server_info, cmd, timeout=timeout)
+                    else:
+                        parser.reset()
+                        output, error = await async_ssh_pool.exec_command_stream(server_info, cmd, timeout, parser.feed)
+            except Exception as e:
+                raise Exception(f"SSH或执行命令异常: {str(e)}")
+            return _interpret_timed(interpret, output, error, operation)
+
+    result = await retry_async(attempt, get_breaker(server_info))
+    if result.ok:
+        outcome = "ok"
+    elif isinstance(result.error, CircuitOpenError):
+        outcome = "circuit_open"
+    else:
+        outcome = "failed"
+    REMOTE_OPERATIONS.inc(server_info['name'], operation, outcome)
+    return result
+
+# 同步版本只执行一次，SSH 失败时抛出异常；机器人内部使用下面带重试和熔断的异步版本
 def ping_on_server(server_info: dict, target: str, ping_count: int = 4) -> str:
-    host = server_info['host']
-    port = server_info['port']
-    username = server_info['username']
-    password = server_info['password']
-
-    # 定义SSH连接函数
-    def ssh_connect_and_execute():
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        try:
-            logging.info(f"正在连接到服务器 {host}:{port}")
-            ssh.connect(hostname=host, port=port, username=username, password=password, timeout=5)
-            cmd = f"ping -c {ping_count} {target}"
-            logging.info(f"正在执行命令: {cmd}")
-            stdin, stdout, stderr = ssh.exec_command(cmd, timeout=20)
-            output = stdout.read().decode('utf-8', errors='ignore')
-            error = stderr.read().decode('utf-8', errors='ignore')
-            ssh.close()
-
-            if error.strip():
-                return f"命令执行错误：\n{error}"
-            return parse_ping_output(output)
-        except Exception as e:
-            ssh.close() if 'ssh' in locals() and ssh.get_transport() and ssh.get_transport().is_active() else None
-            raise Exception(f"SSH或执行命令异常: {str(e)}")
-
-    # 使用重试函数执行SSH连接和命令
-    return retry_operation(ssh_connect_and_execute, retries=3, delay=2)
+    return _execute_on_server(server_info, build_ping_command(target, ping_count), 20, _ping_result, operation="ping")
 
 def nexttrace_on_server(server_info: dict, target: str, ip_type: str, trace_mode: str = "icmp") -> str:
-    host = server_info['host']
-    port = server_info['port']
-    username = server_info['username']
-    password = server_info['password']
-
-    # 定义SSH连接函数
-    def ssh_connect_and_execute():
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        try:
-            logging.info(f"正在连接到服务器 {host}:{port}")
-            ssh.connect(hostname=host, port=port, username=username, password=password, timeout=5)
-            
-            # 构建命令基础部分
-            cmd_base = "nexttrace"
-            
-            # 添加IP类型参数
-            if ip_type == "IPv4":
-                cmd_base += " -4"
-            elif ip_type == "IPv6":
-                cmd_base += " -6"
-            
-            # 添加追踪模式
-            if trace_mode == "tcp":
-                cmd_base += " --tcp"
-            
-            # 完成命令
-            cmd = f"{cmd_base} {target}"
-            
-            logging.info(f"正在执行命令: {cmd}")
-            stdin, stdout, stderr = ssh.exec_command(cmd, timeout=30)
-            output = stdout.read().decode('utf-8', errors='ignore')
-            error = stderr.read().decode('utf-8', errors='ignore')
-            ssh.close()
-
-            if error.strip():
-                if "RetToken failed" in error:
-                    return "路由追踪服务暂时不可用，请稍后重试。"
-                return f"命令执行错误：\n{error}"
-            return output
-        except Exception as e:
-            ssh.close() if 'ssh' in locals() and ssh.get_transport() and ssh.get_transport().is_active() else None
-            raise Exception(f"SSH或执行命令异常: {str(e)}")
-
-    # 使用重试函数执行SSH连接和命令
-    return retry_operation(ssh_connect_and_execute, retries=3, delay=2)
+    return _execute_on_server(server_info, build_nexttrace_command(target, ip_type, trace_mode), 30, _nexttrace_result, operation="nexttrace")
 
 # 添加一个安装nexttrace的函数
 def install_nexttrace_on_server(server_info: dict) -> str:
-    host = server_info['host']
-    port = server_info['port']
-    username = server_info['username']
-    password = server_info['password']
-
-    # 定义SSH连接函数
-    def ssh_connect_and_execute():
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        try:
-            logging.info(f"正在连接到服务器 {host}:{port}")
-            ssh.connect(hostname=host, port=port, username=username, password=password, timeout=5)
-            
-            # 安装nexttrace命令
-            cmd = "curl nxtrace.org/nt | bash"
-            
-            logging.info(f"正在执行命令: {cmd}")
-            stdin, stdout, stderr = ssh.exec_command(cmd, timeout=60)  # 增加超时时间以应对安装过程
-            output = stdout.read().decode('utf-8', errors='ignore')
-            error = stderr.read().decode('utf-8', errors='ignore')
-            ssh.close()
-
-            # 检查是否安装成功
-            combined_output = output + "\n" + error
-            if "一切准备就绪" in combined_output:
-                return "✅ NextTrace 安装成功！"
-            elif error.strip():
-                return f"命令执行错误：\n{error}"
-            else:
-                return f"安装输出：\n{output}\n\n未检测到'一切准备就绪'，请手动确认安装状态。"
-        except Exception as e:
-            ssh.close() if 'ssh' in locals() and ssh.get_transport() and ssh.get_transport().is_active() else None
-            raise Exception(f"SSH或执行命令异常: {str(e)}")
+    # 增加超时时间以应对安装过程
+    return _execute_on_server(server_info, "curl nxtrace.org/nt | bash", 60, _install_result, operation="install")
+
+# 以下异步版本与同步版本参数一致，按配置 SSH_BACKEND 选择执行后端，返回 OperationResult
+# 异步版本的每次测量都会记录到 measurement_store
+async def ping_on_server_async(server_info: dict, target: str, ping_count: int = 4) -> OperationResult:
+    result = await _run_on_server_async(server_info, build_ping_command(target, ping_count), 20, _ping_measured_result, operation="ping")
+    stats = samples = None
+    if result.ok:
+        result.value, stats, samples = result.value
+    measurement_store.record_ping(server_info['name'], target, result.ok, stats, samples)
+    return result
+
+async def ping_stats_on_server_async(server_info: dict, target: str, ping_count: int = 4) -> OperationResult:
+    """与 ping_on_server_async 相同，但成功时的结果为 parse_ping_stats 的字典（命令出错时为错误信息字符串）"""
+    result = await _run_on_server_async(server_info, build_ping_command(target, ping_count), 20, _ping_stats_result, operation="ping")
+    samples = None
+    if result.ok:
+        result.value, samples = result.value
+    stats = result.value if result.ok and isinstance(result.value, dict) else None
+    measurement_store.record_ping(server_info['name'], target, result.ok, stats, samples)
+    return result
+
+# 不支持 --json 的旧版 nexttrace 所在节点，之后直接使用文本输出
+_text_only_nodes = set()
+
+async def nexttrace_on_server_async(server_info: dict, target: str, ip_type: str, trace_mode: str = "icmp", parser: NexttraceStreamParser = None) -> OperationResult:
+    """
+    成功时的结果为 TraceResult（命令出错时为错误信息字符串）
+
+    NEXTTRACE_FORMAT 为 "json" 时请求结构化输出，节点上的 nexttrace 不支持时自动改用文本输出；
+    使用文本输出时传入的 parser 会逐行解析，调用方可以在执行过程中读取已发现的跳数。
+    """
+    result = await _nexttrace_on_server_async(server_info, target, ip_type, trace_mode, parser)
+    trace = result.value if result.ok and isinstance(result.value, TraceResult) else None
+    measurement_store.record_trace(server_info['name'], target, f"{ip_type}/{trace_mode}", trace)
+    if trace is not None:
+        # 用本地 IP 数据库补全缺少的 ASN 和地区；文本输出补全后改为按结构化结果渲染，才能显示补全的信息
+        if ip_database.enrich(trace) and trace.raw_text is not None:
+            trace.raw_text = None
+        # 与上一次相同参数的追踪比较路径，渲染时附加在结果后面
+        trace.route_diff = route_tracker.observe((server_info['name'], target, ip_type, trace_mode), trace)
+    return result
+
+async def _nexttrace_on_server_async(server_info: dict, target: str, ip_type: str, trace_mode: str, parser: NexttraceStreamParser) -> OperationResult:
+    geoip = remote_geoip_enabled()
+    result = await _nexttrace_attempt(server_info, target, ip_type, trace_mode, parser, geoip)
+    if geoip and result.ok and result.value == GEO_SERVICE_UNAVAILABLE and ip_database.available:
+        # 远程地理信息接口不可用时不查询它重新追踪，由本地 IP 数据库补全
+        logging.info(f"节点 {server_info['name']} 的 nexttrace 无法使用远程地理信息接口，改用本地 IP 数据库")
+        result = await _nexttrace_attempt(server_info, target, ip_type, trace_mode, parser, geoip=False)
+    return result
+
+async def _nexttrace_attempt(server_info: dict, target: str, ip_type: str, trace_mode: str, parser: NexttraceStreamParser, geoip: bool) -> OperationResult:
+    key = (server_info['host'], int(server_info['port']))
+    if NEXTTRACE_FORMAT == "json" and key not in _text_only_nodes:
+        result = await _run_on_server_async(
+            server_info, build_nexttrace_command(target, ip_type, trace_mode, json_output=True, geoip=geoip), 30, _nexttrace_json_result,
+            operation="nexttrace"
+        )
+        if not (result.ok and _json_unsupported(result.value)):
+            return result
+        logging.info(f"节点 {server_info['name']} 的 nexttrace 不支持 --json，改用文本输出")
+        _text_only_nodes.add(key)
+    return await _run_on_server_async(
+        server_info, build_nexttrace_command(target, ip_type, trace_mode, geoip=geoip), 30, _nexttrace_text_result, parser, operation="nexttrace"
+    )
+
+async def mtr_on_server_async(server_info: dict, target: str, report: MtrReport) -> OperationResult:
+    """
+    在一个 SSH 会话中连续执行 report.rounds 轮 ICMP 路由追踪，逐轮累计到 report 中
+
+    成功时的结果为 report（MtrReport），整个命令出错时为错误信息字符串。
+    """
+    key = (server_info['host'], int(server_info['port']))
+    timeout = ROUND_TIMEOUT * report.rounds
+    geoip = remote_geoip_enabled()
+    if NEXTTRACE_FORMAT == "json" and key not in _text_only_nodes:
+        result = await _run_on_server_async(
+            server_info, build_mtr_command(target, report.rounds, report.queries, json_output=True, geoip=geoip), timeout, _mtr_result,
+            report, operation="mtr"
+        )
+        if not (result.ok and not report.completed and _json_unsupported(result.value)):
+            return _mtr_outcome(result, report)
+        logging.info(f"节点 {server_info['name']} 的 nexttrace 不支持 --json，改用文本输出")
+        _text_only_nodes.add(key)
+    result = await _run_on_server_async(
+        server_info, build_mtr_command(target, report.rounds, report.queries, geoip=geoip), timeout, _mtr_result, report, operation="mtr"
+    )
+    return _mtr_outcome(result, report)
+
+async def install_nexttrace_on_server_async(server_info: dict) -> OperationResult:
+    result = await _run_on_server_async(server_info, "curl nxtrace.org/nt | bash", 60, _install_result, operation="install")
+    if result.ok:
+        # 新安装的版本可能支持 --json，重新检测
+        _text_only_nodes.discard((server_info['host'], int(server_info['port'])))
+    return result
+
+async def nexttrace_version_on_server_async(server_info: dict) -> OperationResult:
+    """成功时的结果为节点上 nexttrace 的版本号，未安装时为 None"""
+    return await _run_on_server_async(server_info, "nexttrace --version 2>&1", 15, _version_result, operation="version")
+
+def active_pool():
+    """返回当前后端正在使用的连接池"""
+    return async_ssh_pool if async_ssh_pool is not None else ssh_pool
 
-    # 使用重试函数执行SSH连接和命令
-    return retry_operation(ssh_connect_and_execute, retries=3, delay=2)
+def discard_server_connections(server_info: dict):
+    ssh_pool.discard(server_info)
+    if async_ssh_pool is not None:
+        async_ssh_pool.discard(server_info)
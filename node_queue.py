@@ -0,0 +1,160 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from config import JOB_QUEUE
+
+class _Waiter:
+    __slots__ = ("user_id", "future", "on_position", "last_position")
+
+    def __init__(self, user_id: int, future: asyncio.Future, on_position):
+        self.user_id = user_id
+        self.future = future
+        self.on_position = on_position
+        self.last_position = None
+
+class _NodeQueue:
+    """单个节点的等待队列：按用户分组，轮流出队"""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.running = 0
+        self.users = OrderedDict()
+
+    def waiting(self) -> int:
+        return sum(len(q) for q in self.users.values())
+
+    def pop_next(self) -> _Waiter:
+        user_id, queue = next(iter(self.users.items()))
+        waiter = queue.popleft()
+        if queue:
+            # 该用户还有排队的任务，放到队尾，让其他用户先执行
+            self.users.move_to_end(user_id)
+        else:
+            del self.users[user_id]
+        return waiter
+
+    def ordered(self) -> list:
+        """按实际出队顺序列出所有等待中的任务（各用户轮流）"""
+        result = []
+        queues = [list(q) for q in self.users.values()]
+        depth = max((len(q) for q in queues), default=0)
+        for i in range(depth):
+            for q in queues:
+                if i < len(q):
+                    result.append(q[i])
+        return result
+
+    def remove(self, waiter: _Waiter):
+        queue = self.users.get(waiter.user_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        if not queue:
+            del self.users[waiter.user_id]
+
+class NodeJobScheduler:
+    """
+    按节点限制同时运行的测试任务数
+
+    每个节点有独立的并发名额（SERVERS 条目中的 max_jobs，默认 node_limit），所有节点共享一个
+    全局上限 global_limit。同一节点的等待任务在不同用户之间轮流出队，避免单个用户连续提交的
+    任务占满节点；排队位置变化时通过 on_position 回调通知调用方。
+
+    参数:
+        global_limit: 所有节点同时运行的任务总数上限
+        node_limit: 单个节点默认的并发任务数
+    """
+
+    def __init__(self, global_limit: int = 20, node_limit: int = 2):
+        self.global_limit = global_limit
+        self.node_limit = node_limit
+        self.global_running = 0
+        self._nodes = OrderedDict()
+
+    def _node(self, server_info: dict) -> _NodeQueue:
+        key = (server_info['host'], int(server_info['port']))
+        node = self._nodes.get(key)
+        if node is None:
+            node = _NodeQueue(server_info['name'], int(server_info.get('max_jobs', self.node_limit)))
+            self._nodes[key] = node
+        return node
+
+    def _dispatch(self):
+        # 各节点之间也轮流分配全局名额
+        progressed = True
+        while progressed and self.global_running < self.global_limit:
+            progressed = False
+            for key in list(self._nodes):
+                node = self._nodes[key]
+                if not node.users or node.running >= node.limit:
+                    continue
+                waiter = node.pop_next()
+                node.running += 1
+                self.global_running += 1
+                waiter.future.set_result(None)
+                self._nodes.move_to_end(key)
+                progressed = True
+                break
+        for node in self._nodes.values():
+            self._notify_positions(node)
+
+    def _notify_positions(self, node: _NodeQueue):
+        for position, waiter in enumerate(node.ordered(), start=1):
+            if waiter.on_position is None or waiter.last_position == position:
+                continue
+            waiter.last_position = position
+            asyncio.create_task(self._safe_notify(waiter.on_position, position))
+
+    @staticmethod
+    async def _safe_notify(callback, position: int):
+        try:
+            await callback(position)
+        except Exception as e:
+            logging.error(f"更新排队位置失败: {e}")
+
+    def _release(self, node: _NodeQueue):
+        node.running -= 1
+        self.global_running -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, server_info: dict, user_id: int, on_position=None):
+        """
+        获取节点上的一个执行名额，退出上下文时释放
+
+        参数:
+            on_position: 可选的协程函数 on_position(position)，排队位置变化时调用
+        """
+        node = self._node(server_info)
+        waiter = _Waiter(user_id, asyncio.get_running_loop().create_future(), on_position)
+        node.users.setdefault(user_id, deque()).append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 已经分配到名额但调用方被取消，归还名额
+                self._release(node)
+            else:
+                node.remove(waiter)
+                self._notify_positions(node)
+            raise
+        try:
+            yield
+        finally:
+            self._release(node)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.global_running,
+            "queued": sum(node.waiting() for node in self._nodes.values()),
+            "busy_nodes": sum(1 for node in self._nodes.values() if node.running or node.users),
+        }
+
+# 全局唯一的节点任务调度器
+node_scheduler = NodeJobScheduler(**JOB_QUEUE)
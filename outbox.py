@@ -0,0 +1,285 @@
+import time
+import asyncio
+import logging
+import itertools
+from collections import OrderedDict
+from telegram.error import RetryAfter, BadRequest
+from config import TELEGRAM_RATE_LIMITS
+from ratelimit import TokenBucket
+from metrics import TELEGRAM_REQUEST_SECONDS, TELEGRAM_QUEUE_SECONDS, TELEGRAM_REQUESTS
+
+# 优先级：数值越小越先发送
+PRIORITY_FINAL = 0     # 最终结果
+PRIORITY_NORMAL = 1    # 普通交互消息
+PRIORITY_PROGRESS = 2  # 进度/转圈动画
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    # 新版 python-telegram-bot 可能返回 timedelta
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+class _Op:
+    __slots__ = ("bot", "method", "chat_id", "key", "kwargs", "priority", "seq", "futures", "enqueued")
+
+    def __init__(self, bot, method: str, chat_id, key, kwargs: dict, priority: int, seq: int):
+        self.bot = bot
+        self.method = method
+        self.chat_id = chat_id
+        self.key = key
+        self.kwargs = kwargs
+        self.priority = priority
+        self.seq = seq
+        self.futures = []
+        self.enqueued = time.monotonic()
+
+class TelegramOutbox:
+    """
+    所有发往 Telegram 的请求（发送、编辑、删除消息等）统一经过这里排队发送
+
+    - 全局令牌桶和按聊天的令牌桶，避免触发 Telegram 的频率限制
+    - 同一条消息尚未发出的多次编辑会合并，只发送最新的内容
+    - 与上次发送内容相同的编辑直接跳过
+    - 最终结果优先于进度动画发送
+    - 收到 429 时按 retry_after 自动暂停该聊天并重新排队
+    同一聊天内的请求按顺序逐个发出，不同聊天之间并发。
+
+    参数:
+        global_per_second: 全局每秒请求数
+        chat_per_second: 单个聊天每秒请求数
+        chat_burst: 单个聊天允许的突发请求数
+    """
+
+    def __init__(self, global_per_second: float = 30, chat_per_second: float = 1, chat_burst: int = 3, max_tracked_messages: int = 10000):
+        self.global_bucket = TokenBucket(global_per_second, global_per_second)
+        self.chat_per_second = chat_per_second
+        self.chat_burst = chat_burst
+        self.max_tracked_messages = max_tracked_messages
+        self._chat_buckets = {}
+        self._blocked_until = {}
+        self._busy_chats = set()
+        self._pending = []
+        self._pending_edits = {}
+        self._last_text = OrderedDict()
+        self._seq = itertools.count()
+        self._loop = None
+        self._wakeup = None
+        self._worker = None
+        self.sent = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.rate_limited = 0
+
+    # ---------------- 对外接口 ----------------
+    async def send_message(self, bot, chat_id, text: str, priority: int = PRIORITY_NORMAL, **kwargs):
+        return await self._submit(bot, "send_message", chat_id, None, dict(chat_id=chat_id, text=text, **kwargs), priority)
+
+    async def reply_text(self, message, text: str, priority: int = PRIORITY_NORMAL, **kwargs):
+        return await self.send_message(message.get_bot(), message.chat_id, text, priority=priority, **kwargs)
+
+    async def send_photo(self, bot, chat_id, photo, priority: int = PRIORITY_NORMAL, **kwargs):
+        return await self._submit(bot, "send_photo", chat_id, None, dict(chat_id=chat_id, photo=photo, **kwargs), priority)
+
+    async def reply_photo(self, message, photo, priority: int = PRIORITY_NORMAL, **kwargs):
+        return await self.send_photo(message.get_bot(), message.chat_id, photo, priority=priority, **kwargs)
+
+    async def edit_message_text(self, bot, text: str = None, chat_id=None, message_id=None, priority: int = PRIORITY_NORMAL, **kwargs):
+        kwargs = dict(text=text, chat_id=chat_id, message_id=message_id, **kwargs)
+        return await self._submit(bot, "edit_message_text", chat_id, (chat_id, message_id), kwargs, priority)
+
+    async def delete_message(self, bot, chat_id, message_id, priority: int = PRIORITY_NORMAL):
+        return await self._submit(bot, "delete_message", chat_id, (chat_id, message_id), dict(chat_id=chat_id, message_id=message_id), priority)
+
+    async def answer_callback_query(self, bot, callback_query_id: str, **kwargs):
+        # 回调应答不计入聊天频率限制，但需要尽快发送
+        return await self._submit(bot, "answer_callback_query", None, None, dict(callback_query_id=callback_query_id, **kwargs), PRIORITY_FINAL)
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "skipped": self.skipped,
+            "rate_limited": self.rate_limited,
+            "pending": len(self._pending),
+        }
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        for op in self._pending:
+            for fut in op.futures:
+                if not fut.done():
+                    fut.cancel()
+        self._pending.clear()
+        self._pending_edits.clear()
+
+    # ---------------- 内部实现 ----------------
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._worker = loop.create_task(self._run())
+
+    def _submit(self, bot, method: str, chat_id, key, kwargs: dict, priority: int):
+        self._ensure_worker()
+        fut = self._loop.create_future()
+
+        if method == "edit_message_text":
+            pending = self._pending_edits.get(key)
+            if pending is not None:
+                # 合并：丢弃尚未发出的旧内容，只保留最新的一次编辑
+                pending.kwargs = kwargs
+                pending.priority = min(pending.priority, priority)
+                pending.futures.append(fut)
+                self.coalesced += 1
+                return fut
+            if "reply_markup" not in kwargs and self._last_text.get(key) == kwargs["text"]:
+                self.skipped += 1
+                fut.set_result(True)
+                return fut
+        elif method == "delete_message":
+            # 消息即将被删除，之前排队的编辑已无意义
+            pending = self._pending_edits.pop(key, None)
+            if pending is not None:
+                self._pending.remove(pending)
+                self._resolve(pending, None)
+            self._last_text.pop(key, None)
+
+        op = _Op(bot, method, chat_id, key, kwargs, priority, next(self._seq))
+        op.futures.append(fut)
+        self._enqueue(op)
+        return fut
+
+    def _enqueue(self, op: _Op):
+        self._pending.append(op)
+        if op.method == "edit_message_text":
+            self._pending_edits[op.key] = op
+        self._wakeup.set()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # 清理已经回满的桶，避免长期运行后无限增长
+                now = time.monotonic()
+                self._chat_buckets = {c: b for c, b in self._chat_buckets.items() if not b.is_full(now)}
+            bucket = TokenBucket(self.chat_per_second, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _next_ready(self):
+        """返回 (可以发送的请求, None) 或 (None, 需要等待的秒数)；等待时间为 None 表示等待新请求"""
+        now = time.monotonic()
+        wait = self.global_bucket.wait_time(now)
+        if wait > 0:
+            return None, wait
+        wait = None
+        for op in sorted(self._pending, key=lambda o: (o.priority, o.seq)):
+            if op.chat_id is not None:
+                if op.chat_id in self._busy_chats:
+                    continue
+                blocked = self._blocked_until.get(op.chat_id, 0) - now
+                if blocked > 0:
+                    wait = blocked if wait is None else min(wait, blocked)
+                    continue
+                bucket = self._chat_bucket(op.chat_id)
+                chat_wait = bucket.wait_time(now)
+                if chat_wait > 0:
+                    wait = chat_wait if wait is None else min(wait, chat_wait)
+                    continue
+                bucket.consume(now)
+            self.global_bucket.consume(now)
+            return op, None
+        return None, wait
+
+    async def _run(self):
+        while True:
+            op, wait = self._next_ready()
+            if op is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._pending.remove(op)
+            if self._pending_edits.get(op.key) is op:
+                del self._pending_edits[op.key]
+            if op.chat_id is not None:
+                self._busy_chats.add(op.chat_id)
+            asyncio.create_task(self._execute(op))
+
+    async def _execute(self, op: _Op):
+        start = time.monotonic()
+        # 包含 429 后重新排队的等待时间
+        TELEGRAM_QUEUE_SECONDS.observe(start - op.enqueued, op.method)
+        outcome = "ok"
+        try:
+            result = await getattr(op.bot, op.method)(**op.kwargs)
+        except RetryAfter as e:
+            outcome = "rate_limited"
+            delay = _retry_after_seconds(e)
+            self.rate_limited += 1
+            logging.warning(f"Telegram 频率限制，{delay} 秒后重试 {op.method} (chat={op.chat_id})")
+            if op.chat_id is not None:
+                self._blocked_until[op.chat_id] = time.monotonic() + delay
+            else:
+                self.global_bucket.tokens = -delay * self.global_bucket.rate
+            self._requeue(op)
+        except BadRequest as e:
+            if "message is not modified" in str(e).lower():
+                outcome = "not_modified"
+                self._resolve(op, True)
+            else:
+                outcome = "error"
+                self._fail(op, e)
+        except Exception as e:
+            outcome = "error"
+            self._fail(op, e)
+        else:
+            self.sent += 1
+            if op.method == "edit_message_text":
+                self._remember_text(op)
+            self._resolve(op, result)
+        finally:
+            TELEGRAM_REQUEST_SECONDS.observe(time.monotonic() - start, op.method)
+            TELEGRAM_REQUESTS.inc(op.method, outcome)
+            self._busy_chats.discard(op.chat_id)
+            self._wakeup.set()
+
+    def _requeue(self, op: _Op):
+        newer = self._pending_edits.get(op.key) if op.method == "edit_message_text" else None
+        if newer is not None:
+            # 等待期间又有新的编辑，直接并入新的请求
+            newer.futures.extend(op.futures)
+            newer.priority = min(newer.priority, op.priority)
+            self.coalesced += 1
+            return
+        self._enqueue(op)
+
+    def _remember_text(self, op: _Op):
+        if "reply_markup" in op.kwargs:
+            self._last_text.pop(op.key, None)
+            return
+        self._last_text[op.key] = op.kwargs["text"]
+        self._last_text.move_to_end(op.key)
+        while len(self._last_text) > self.max_tracked_messages:
+            self._last_text.popitem(last=False)
+
+    @staticmethod
+    def _resolve(op: _Op, result):
+        for fut in op.futures:
+            if not fut.done():
+                fut.set_result(result)
+
+    @staticmethod
+    def _fail(op: _Op, error: Exception):
+        for fut in op.futures:
+            if not fut.done():
+                fut.set_exception(error)
+
+# 全局唯一的发送队列
+outbox = TelegramOutbox(**TELEGRAM_RATE_LIMITS)
@@ -0,0 +1,144 @@
+import math
+import time
+from config import RATE_LIMITS
+from state import SessionStore, SESSION_MAX_ENTRIES
+
+class TokenBucket:
+    """
+    令牌桶：以 rate 个/秒的速度补充令牌，最多积累 capacity 个
+
+    参数:
+        rate: 每秒补充的令牌数
+        capacity: 桶容量（允许的突发数量）
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float = None) -> float:
+        """距离下一个令牌可用还需要等待的秒数，0 表示现在就可以消耗"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float = None) -> bool:
+        """尝试消耗一个令牌，成功返回 True"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def is_full(self, now: float = None) -> bool:
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+class RateLimitedError(Exception):
+    """节点的令牌桶已空，本次远程执行被拒绝"""
+
+    def __init__(self, name: str, wait: float):
+        self.wait = wait
+        super().__init__(f"节点 {name} 当前请求过多，请 {math.ceil(wait)} 秒后再试")
+
+def _bucket_params(limit: dict) -> tuple:
+    """把配置中的 {"burst": N, "per": S}（每 S 秒补充一次，最多积累 N 次）换算为 (rate, capacity)"""
+    per = limit.get('per', 10)
+    burst = limit.get('burst', 1)
+    return 1 / per, burst
+
+class CommandLimiter:
+    """
+    按 (用户, 命令) 限制命令频率，并可选地按节点限制远程执行次数，管理员不受限制
+
+    每个用户的每个命令各有一个令牌桶，互不影响；桶补满后不再需要保留，
+    因此保存在过期时间为“补满所需时间”的 SessionStore 中，内存占用有上限。
+
+    参数:
+        commands: {命令名: {"burst": N, "per": S}}，未配置的命令不限制
+        node: 可选，{"burst": N, "per": S}，每个节点一个令牌桶
+    """
+
+    def __init__(self, commands: dict, node: dict = None):
+        self.limits = {}
+        self._stores = {}
+        for command, limit in commands.items():
+            rate, capacity = _bucket_params(limit)
+            self.limits[command] = (rate, capacity)
+            self._stores[command] = SessionStore(capacity / rate, SESSION_MAX_ENTRIES)
+        self.node_limit = _bucket_params(node) if node else None
+        self._node_buckets = {}
+        self.rejected = 0
+
+    def stores(self) -> tuple:
+        """供后台清理任务定期清理已补满的桶"""
+        return tuple(self._stores.values())
+
+    def describe(self, command: str) -> str:
+        rate, capacity = self.limits[command]
+        return f"每 {1 / rate:g} 秒恢复 1 次，最多连续 {capacity:g} 次"
+
+    def acquire(self, user_id: int, command: str, exempt: bool = False) -> float:
+        """
+        为用户的一次命令消耗一个令牌
+
+        返回:
+            0 表示允许执行；否则为需要等待的秒数（本次未消耗令牌）
+        """
+        if exempt or command not in self.limits:
+            return 0.0
+        store = self._stores[command]
+        bucket = store.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(*self.limits[command])
+        # 每次访问都重新写入，刷新过期时间
+        store[user_id] = bucket
+        if bucket.consume():
+            return 0.0
+        self.rejected += 1
+        return bucket.wait_time()
+
+    def acquire_node(self, server_info: dict, exempt: bool = False) -> float:
+        """为节点上的一次远程执行消耗一个令牌，返回值同 acquire"""
+        if exempt or self.node_limit is None:
+            return 0.0
+        key = (server_info['host'], int(server_info['port']))
+        bucket = self._node_buckets.get(key)
+        if bucket is None:
+            bucket = self._node_buckets[key] = TokenBucket(*self.node_limit)
+        if bucket.consume():
+            return 0.0
+        self.rejected += 1
+        return bucket.wait_time()
+
+    def node_error(self, server_info: dict, exempt: bool = False):
+        """节点令牌不足时返回 RateLimitedError，否则消耗一个令牌并返回 None"""
+        wait = self.acquire_node(server_info, exempt)
+        return RateLimitedError(server_info['name'], wait) if wait else None
+
+# 与原先固定的冷却时间一致：/ping、/pingall 每 15 秒一次，/nexttrace 每 10 秒一次
+DEFAULT_COMMAND_LIMITS = {
+    "ping": {"burst": 1, "per": 15},
+    "pingall": {"burst": 1, "per": 15},
+    "nexttrace": {"burst": 1, "per": 10},
+    "history": {"burst": 3, "per": 10},
+    "mtr": {"burst": 1, "per": 60},
+}
+
+command_limiter = CommandLimiter(
+    {**DEFAULT_COMMAND_LIMITS, **RATE_LIMITS.get('commands', {})},
+    RATE_LIMITS.get('node'),
+)
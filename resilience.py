@@ -0,0 +1,167 @@
+import time
+import random
+import asyncio
+import logging
+from config import RETRY_POLICY, CIRCUIT_BREAKER
+
+class OperationResult:
+    """
+    远程操作的结果
+
+    属性:
+        ok: 是否成功
+        value: 成功时的返回值
+        error: 失败时的异常
+        attempts: 实际尝试次数（熔断时为 0）
+    """
+
+    __slots__ = ("ok", "value", "error", "attempts")
+
+    def __init__(self, ok: bool, value=None, error: Exception = None, attempts: int = 1):
+        self.ok = ok
+        self.value = value
+        self.error = error
+        self.attempts = attempts
+
+    @property
+    def retried(self) -> bool:
+        return self.attempts > 1
+
+class CircuitOpenError(Exception):
+    """节点处于熔断状态，请求被直接拒绝"""
+
+class CircuitBreaker:
+    """
+    单个节点的熔断器
+
+    连续失败 failure_threshold 次后进入 open 状态，cooldown 秒内的请求直接失败；
+    冷却结束后进入 half_open 状态，只放行一个探测请求，成功则恢复，失败则重新熔断。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 3, cooldown: float = 60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def remaining(self) -> float:
+        """熔断剩余秒数"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def is_open(self) -> bool:
+        return self.state == self.OPEN and self.remaining() > 0
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if self.remaining() > 0:
+                return False
+            self.state = self.HALF_OPEN
+            self._probing = False
+        # half_open：同一时间只放行一个探测请求
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logging.info(f"节点 {self.name} 探测成功，解除熔断")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logging.warning(f"节点 {self.name} 连续失败 {self.failures} 次，熔断 {self.cooldown} 秒")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def abort_probe(self):
+        """探测请求被取消时释放名额，避免 half_open 状态被永久占用"""
+        self._probing = False
+
+    def open_error(self) -> CircuitOpenError:
+        if self.state != self.OPEN:
+            # half_open：冷却已结束，另一个探测请求正在检查节点是否恢复，没有可以给出的倒计时
+            return CircuitOpenError(
+                f"节点 {self.name} 连续多次连接失败，正在检测是否恢复，请稍后再试"
+            )
+        return CircuitOpenError(
+            f"节点 {self.name} 连续多次连接失败，已暂停使用，请 {int(self.remaining()) + 1} 秒后再试"
+        )
+
+_breakers = {}
+
+def get_breaker(server_info: dict) -> CircuitBreaker:
+    key = (server_info['host'], int(server_info['port']))
+    breaker = _breakers.get(key)
+    if breaker is None:
+        breaker = CircuitBreaker(server_info['name'], **CIRCUIT_BREAKER)
+        _breakers[key] = breaker
+    return breaker
+
+def breaker_is_open(server_info: dict) -> bool:
+    breaker = _breakers.get((server_info['host'], int(server_info['port'])))
+    return breaker is not None and breaker.is_open()
+
+def open_breakers() -> list:
+    return [b for b in _breakers.values() if b.is_open()]
+
+async def retry_async(func, breaker: CircuitBreaker = None, retries: int = None, base_delay: float = None, max_delay: float = None) -> OperationResult:
+    """
+    以带随机抖动的指数退避重试协程函数 func
+
+    每次失败都会记录到 breaker；熔断后不再继续重试。重试等待期间不占用任何线程。
+
+    参数:
+        func: 无参数的协程函数
+        breaker: 所属节点的熔断器，可选
+        retries: 最多尝试次数
+        base_delay: 首次重试的退避基数（秒）
+        max_delay: 单次退避上限（秒）
+
+    返回:
+        OperationResult
+    """
+    retries = RETRY_POLICY.get("retries", 3) if retries is None else retries
+    base_delay = RETRY_POLICY.get("base_delay", 1) if base_delay is None else base_delay
+    max_delay = RETRY_POLICY.get("max_delay", 8) if max_delay is None else max_delay
+
+    last_exception = None
+    for attempt in range(retries):
+        if breaker is not None and not breaker.allow():
+            return OperationResult(False, error=breaker.open_error(), attempts=attempt)
+        try:
+            value = await func()
+        except asyncio.CancelledError:
+            if breaker is not None:
+                breaker.abort_probe()
+            raise
+        except Exception as e:
+            last_exception = e
+            if breaker is not None:
+                breaker.record_failure()
+            logging.warning(f"操作失败 (尝试 {attempt+1}/{retries}): {str(e)}")
+            if attempt < retries - 1:
+                # full jitter：在 [0, min(上限, 基数 * 2^n)] 内随机等待，避免多个请求同时重试
+                await asyncio.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return OperationResult(True, value=value, attempts=attempt + 1)
+
+    return OperationResult(False, error=last_exception, attempts=retries)
@@ -0,0 +1,100 @@
+import sys
+import time
+import itertools
+from collections import OrderedDict
+from config import RESULT_CACHE
+
+class TTLCache:
+    """
+    带过期时间的 LRU 缓存，按估算的内存占用限制总大小
+
+    参数:
+        max_bytes: 缓存内容的总大小上限（字节，按 sys.getsizeof 估算）
+    """
+
+    def __init__(self, max_bytes: int = 8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _sizeof(value) -> int:
+        if hasattr(value, "approx_size"):
+            return value.approx_size()
+        if isinstance(value, dict):
+            return sys.getsizeof(value) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+        return sys.getsizeof(value)
+
+    def get(self, key):
+        """返回 (value, 已缓存的秒数)，未命中或已过期时返回 None"""
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        value, stored_at, expires_at, size = item
+        now = time.monotonic()
+        if now >= expires_at:
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value, now - stored_at
+
+    def set(self, key, value, ttl: float):
+        if ttl <= 0:
+            return
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return
+        if key in self._data:
+            self._remove(key)
+        now = time.monotonic()
+        self._data[key] = (value, now, now + ttl, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, _, _, size = self._data.pop(key)
+        self.bytes -= size
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._data),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+PING_TTL = RESULT_CACHE.get("ping_ttl", 30)
+TRACE_TTL = RESULT_CACHE.get("trace_ttl", 120)
+
+# 全局唯一的测试结果缓存
+result_cache = TTLCache(RESULT_CACHE.get("max_bytes", 8 * 1024 * 1024))
+
+def ping_cache_key(server_info: dict, target: str, ping_count: int) -> tuple:
+    return ("ping", server_info['host'], int(server_info['port']), target, ping_count)
+
+def trace_cache_key(server_info: dict, target: str, ip_type: str, trace_mode: str) -> tuple:
+    return ("trace", server_info['host'], int(server_info['port']), target, ip_type, trace_mode)
+
+# “点击刷新”按钮对应的测试参数；callback_data 长度有限，只在按钮中保存一个短编号
+_refresh_requests = OrderedDict()
+_refresh_ids = itertools.count(1)
+
+def register_refresh(request: dict) -> str:
+    token = format(next(_refresh_ids), "x")
+    _refresh_requests[token] = request
+    while len(_refresh_requests) > 1000:
+        _refresh_requests.popitem(last=False)
+    return token
+
+def get_refresh(token: str):
+    return _refresh_requests.get(token)
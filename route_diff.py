@@ -0,0 +1,147 @@
+import html
+import time
+from collections import OrderedDict
+from config import ROUTE_DIFF
+
+# 延迟变化至少达到该值（毫秒）才显示
+LATENCY_DELTA_THRESHOLD = ROUTE_DIFF.get('latency_threshold', 10)
+# 每类变化最多显示的行数
+MAX_LINES = ROUTE_DIFF.get('max_lines', 8)
+
+class PathSignature:
+    """
+    一次追踪的紧凑签名：路径哈希和逐跳的 (跳数, 地址, 平均时延)
+
+    第一跳（通常是节点所在的内网网关）不参与比较，和消息中一样不显示它的地址；超时的跳也不参与比较。
+    路径哈希只覆盖参与比较的 (跳数, 地址)，与逐跳比较的范围一致。
+    """
+
+    __slots__ = ("hash", "hops", "ts")
+
+    def __init__(self, path_hash: int, hops: tuple, ts: float):
+        self.hash = path_hash
+        self.hops = hops
+        self.ts = ts
+
+def signature(trace) -> PathSignature:
+    hops = []
+    for hop in trace.hops[1:]:
+        if hop.ip:
+            hops.append((hop.ttl, hop.ip, sum(hop.rtts) / len(hop.rtts) if hop.rtts else None))
+    return PathSignature(hash(tuple((ttl, ip) for ttl, ip, _ in hops)), tuple(hops), time.time())
+
+class RouteDiff:
+    """
+    新路径与上一次路径的差异
+
+    属性:
+        previous_ts: 上一次追踪的时间
+        changed: 路径（地址序列）是否变化
+        added: 新出现的跳 [(跳数, 地址)]
+        removed: 消失的跳 [(跳数, 地址)]
+        moved: 仍在路径上但跳数变化的地址 [(地址, 原跳数, 新跳数)]
+        latency: 两次都出现的地址中延迟变化超过阈值的 [(跳数, 地址, 原时延, 新时延)]
+    """
+
+    __slots__ = ("previous_ts", "changed", "added", "removed", "moved", "latency")
+
+    def __init__(self, previous_ts: float, changed: bool, added: list, removed: list, moved: list, latency: list):
+        self.previous_ts = previous_ts
+        self.changed = changed
+        self.added = added
+        self.removed = removed
+        self.moved = moved
+        self.latency = latency
+
+def diff_signatures(old: PathSignature, new: PathSignature) -> RouteDiff:
+    """
+    比较两次追踪的路径
+
+    路径哈希相同时只比较逐跳延迟；不同时按地址建立哈希表匹配两次的跳，
+    中间插入或删除一跳不会让后面所有的跳都被当成变化。
+    """
+    old_by_ip = {ip: (ttl, rtt) for ttl, ip, rtt in old.hops}
+    new_by_ip = {ip: (ttl, rtt) for ttl, ip, rtt in new.hops}
+    added, removed, moved = [], [], []
+    if old.hash != new.hash:
+        added = [(ttl, ip) for ttl, ip, _ in new.hops if ip not in old_by_ip]
+        removed = [(ttl, ip) for ttl, ip, _ in old.hops if ip not in new_by_ip]
+        moved = [(ip, old_by_ip[ip][0], ttl) for ttl, ip, _ in new.hops if ip in old_by_ip and old_by_ip[ip][0] != ttl]
+    # 只有能列出具体变化的跳时才算路径变化
+    changed = bool(added or removed or moved)
+    latency = []
+    for ttl, ip, rtt in new.hops:
+        previous = old_by_ip.get(ip)
+        if previous is None or previous[1] is None or rtt is None:
+            continue
+        if abs(rtt - previous[1]) >= LATENCY_DELTA_THRESHOLD:
+            latency.append((ttl, ip, previous[1], rtt))
+    return RouteDiff(old.ts, changed, added, removed, moved, latency)
+
+class RouteTracker:
+    """
+    按 (节点, 目标, IP 类型, 追踪模式) 保存最近一次追踪的路径签名，新的追踪与之比较
+
+    参数:
+        max_entries: 最多保存的路径数，超出后淘汰最久未追踪的
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.changes = 0
+        self._paths = OrderedDict()
+
+    def observe(self, key: tuple, trace):
+        """记录新的追踪结果，返回与上一次的差异（第一次追踪或没有可比较的跳时返回 None）"""
+        new = signature(trace)
+        if not new.hops:
+            return None
+        old = self._paths.pop(key, None)
+        self._paths[key] = new
+        if len(self._paths) > self.max_entries:
+            self._paths.popitem(last=False)
+        if old is None:
+            return None
+        diff = diff_signatures(old, new)
+        if diff.changed:
+            self.changes += 1
+        return diff
+
+    def stats(self) -> dict:
+        return {"paths": len(self._paths), "changes": self.changes}
+
+def _ago(seconds: float) -> str:
+    if seconds < 60:
+        return f"{int(seconds)} 秒前"
+    if seconds < 3600:
+        return f"{int(seconds // 60)} 分钟前"
+    if seconds < 86400:
+        return f"{int(seconds // 3600)} 小时前"
+    return f"{int(seconds // 86400)} 天前"
+
+def _limited(lines: list) -> list:
+    if len(lines) > MAX_LINES:
+        return lines[:MAX_LINES] + [f"…还有 {len(lines) - MAX_LINES} 项"]
+    return lines
+
+def format_route_diff(diff: RouteDiff) -> str:
+    """把路径差异渲染为附加在追踪结果后的 HTML"""
+    since = f"与 {_ago(time.time() - diff.previous_ts)}的追踪相比"
+    if not diff.changed:
+        text = f"<b>✅ 路径未变化</b>（{since}）\n"
+    else:
+        text = f"<b>🔀 路径发生变化</b>（{since}）\n"
+        lines = [f"+ 第 {ttl} 跳 {ip}" for ttl, ip in diff.added]
+        lines += [f"- 第 {ttl} 跳 {ip}" for ttl, ip in diff.removed]
+        lines += [f"~ {ip} 第 {old_ttl} 跳 → 第 {new_ttl} 跳" for ip, old_ttl, new_ttl in diff.moved]
+        if lines:
+            text += "<pre>" + html.escape("\n".join(_limited(lines))) + "</pre>\n"
+    if diff.latency:
+        lines = [
+            f"第 {ttl} 跳 {ip}: {old:.1f} → {new:.1f} ms ({new - old:+.1f})"
+            for ttl, ip, old, new in diff.latency
+        ]
+        text += "<b>延迟变化</b>:\n<pre>" + html.escape("\n".join(_limited(lines))) + "</pre>\n"
+    return text
+
+route_tracker = RouteTracker(ROUTE_DIFF.get('max_entries', 10000))
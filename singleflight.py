@@ -0,0 +1,63 @@
+import asyncio
+
+class _Flight:
+    __slots__ = ("task", "shared")
+
+    def __init__(self, task: asyncio.Task, shared):
+        self.task = task
+        self.shared = shared
+
+class SingleFlight:
+    """
+    合并相同的进行中任务：同一个 key 的任务正在执行时，新的请求直接等待它的结果，不再重复执行
+
+    共享任务在独立的 asyncio.Task 中运行，某个请求方被取消不会影响其他仍在等待的请求方。
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.executions = 0
+        self.saved = 0
+
+    def join(self, key, factory, shared=None):
+        """
+        加入 key 对应的进行中任务，不存在时用 factory() 创建
+
+        参数:
+            key: 任务标识（可哈希）
+            factory: 无参数的协程函数，只有第一个请求方会调用
+            shared: 第一个请求方提供的共享对象（如流式解析器），后续请求方通过 flight.shared 取得
+
+        返回:
+            (flight, leader)：flight.task 为共享任务，leader 表示是否由本次调用创建
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.saved += 1
+            return flight, False
+
+        task = asyncio.ensure_future(factory())
+        flight = _Flight(task, shared)
+        self._flights[key] = flight
+        self.executions += 1
+
+        def _done(_):
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        task.add_done_callback(_done)
+        return flight, True
+
+    @staticmethod
+    async def wait(flight: _Flight):
+        # shield：当前请求方被取消时共享任务继续为其他请求方执行
+        return await asyncio.shield(flight.task)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "executions": self.executions,
+            "saved": self.saved,
+        }
+
+# 全局唯一的进行中任务表
+inflight = SingleFlight()
@@ -0,0 +1,227 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+import paramiko
+from metrics import SSH_CONNECT_SECONDS
+
+class _PoolEntry:
+    """单个服务器的连接池条目：一个已认证的 SSHClient 加上会话计数"""
+
+    def __init__(self, max_sessions: int):
+        self.client = None
+        self.last_used = 0.0
+        self.active = 0
+        self.connect_lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_sessions)
+
+class SSHConnectionPool:
+    """
+    按服务器复用已认证的 SSH 连接
+
+    每个 SERVERS 条目对应一个长期存活的 paramiko Transport，每次测试只在其上
+    新开一个 channel，避免重复的 TCP 握手、密钥交换和密码认证。
+
+    参数:
+        keepalive: Transport 保活间隔（秒）
+        idle_timeout: 空闲超过该时间的连接会被关闭（秒）
+        max_sessions: 单个服务器同时打开的 channel 上限
+        connect_timeout: 建立连接的超时时间（秒）
+    """
+
+    def __init__(self, keepalive: int = 30, idle_timeout: int = 300, max_sessions: int = 8, connect_timeout: int = 5):
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.connect_timeout = connect_timeout
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(server_info: dict) -> tuple:
+        # 密码也作为键的一部分，修改凭据后会自然建立新连接
+        return (server_info['host'], int(server_info['port']), server_info['username'], server_info['password'])
+
+    def _get_entry(self, server_info: dict) -> _PoolEntry:
+        key = self._key(server_info)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _PoolEntry(int(server_info.get('max_sessions', self.max_sessions)))
+                self._entries[key] = entry
+            return entry
+
+    @staticmethod
+    def _is_healthy(client) -> bool:
+        if client is None:
+            return False
+        transport = client.get_transport()
+        if transport is None or not transport.is_active() or not transport.is_authenticated():
+            return False
+        try:
+            # 发送一个 SSH_MSG_IGNORE 包，能及时发现已断开的连接
+            transport.send_ignore()
+        except Exception:
+            return False
+        return True
+
+    def _connect(self, server_info: dict):
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        logging.info(f"正在连接到服务器 {server_info['host']}:{server_info['port']}")
+        with SSH_CONNECT_SECONDS.time(server_info['name']):
+            client.connect(
+                hostname=server_info['host'],
+                port=server_info['port'],
+                username=server_info['username'],
+                password=server_info['password'],
+                timeout=self.connect_timeout
+            )
+        client.get_transport().set_keepalive(self.keepalive)
+        return client
+
+    def _acquire_client(self, entry: _PoolEntry, server_info: dict):
+        with entry.connect_lock:
+            if self._is_healthy(entry.client):
+                with self._lock:
+                    self.hits += 1
+                return entry.client
+            with self._lock:
+                if entry.client is not None:
+                    self.reconnects += 1
+                self.misses += 1
+            if entry.client is not None:
+                self._close_client(entry.client)
+                entry.client = None
+            entry.client = self._connect(server_info)
+            return entry.client
+
+    @staticmethod
+    def _close_client(client):
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    def discard(self, server_info: dict, only_if_broken: bool = False):
+        """关闭并丢弃某个服务器的缓存连接（例如删除服务器或连接已损坏时）"""
+        with self._lock:
+            entry = self._entries.get(self._key(server_info))
+        if entry is None:
+            return
+        with entry.connect_lock:
+            if only_if_broken and self._is_healthy(entry.client):
+                return
+            if entry.client is not None:
+                self._close_client(entry.client)
+                entry.client = None
+
+    def sweep_idle(self):
+        """关闭空闲超时的连接"""
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._entries.items())
+        for key, entry in entries:
+            if entry.client is None or entry.active > 0:
+                continue
+            if now - entry.last_used < self.idle_timeout:
+                continue
+            with entry.connect_lock:
+                if entry.client is not None and entry.active == 0:
+                    logging.info(f"关闭空闲 SSH 连接 {key[0]}:{key[1]}")
+                    self._close_client(entry.client)
+                    entry.client = None
+                    with self._lock:
+                        self.evictions += 1
+
+    def close_all(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            if entry.client is not None:
+                self._close_client(entry.client)
+                entry.client = None
+
+    @contextmanager
+    def session(self, server_info: dict, timeout: int):
+        """
+        在复用的连接上打开一个新的 channel
+
+        连接失效时会自动重连一次；获取不到会话名额时最多等待 timeout 秒。
+        """
+        self.sweep_idle()
+        entry = self._get_entry(server_info)
+        if not entry.slots.acquire(timeout=timeout):
+            raise Exception(f"服务器 {server_info['name']} 的 SSH 会话数已达上限")
+        with self._lock:
+            entry.active += 1
+        try:
+            try:
+                channel = self._acquire_client(entry, server_info).get_transport().open_session(timeout=self.connect_timeout)
+            except Exception:
+                # 缓存的连接可能已被对端关闭，丢弃后重连一次
+                self.discard(server_info)
+                channel = self._acquire_client(entry, server_info).get_transport().open_session(timeout=self.connect_timeout)
+            channel.settimeout(timeout)
+            try:
+                yield channel
+            finally:
+                channel.close()
+        finally:
+            with self._lock:
+                entry.active -= 1
+            entry.last_used = time.monotonic()
+            entry.slots.release()
+
+    def exec_command(self, server_info: dict, cmd: str, timeout: int) -> tuple:
+        """执行远程命令，返回 (stdout, stderr) 文本"""
+        try:
+            with self.session(server_info, timeout) as channel:
+                logging.info(f"正在执行命令: {cmd}")
+                channel.exec_command(cmd)
+                stdout = channel.makefile('rb')
+                stderr = channel.makefile_stderr('rb')
+                output = stdout.read().decode('utf-8', errors='ignore')
+                error = stderr.read().decode('utf-8', errors='ignore')
+                return output, error
+        except Exception:
+            # 命令超时不影响同一连接上的其他会话，只有连接本身损坏时才丢弃
+            self.discard(server_info, only_if_broken=True)
+            raise
+
+    def exec_command_stream(self, server_info: dict, cmd: str, timeout: int, on_line) -> tuple:
+        """执行远程命令，stdout 每到达一行就调用 on_line(line)，结束后返回 (stdout, stderr) 文本"""
+        try:
+            with self.session(server_info, timeout) as channel:
+                logging.info(f"正在执行命令: {cmd}")
+                channel.exec_command(cmd)
+                stdout = channel.makefile('rb')
+                stderr = channel.makefile_stderr('rb')
+                chunks = []
+                for raw_line in stdout:
+                    line = raw_line.decode('utf-8', errors='ignore')
+                    chunks.append(line)
+                    on_line(line)
+                error = stderr.read().decode('utf-8', errors='ignore')
+                return "".join(chunks), error
+        except Exception:
+            self.discard(server_info, only_if_broken=True)
+            raise
+
+    def stats(self) -> dict:
+        with self._lock:
+            connected = sum(1 for e in self._entries.values() if e.client is not None)
+            active = sum(e.active for e in self._entries.values())
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "reconnects": self.reconnects,
+            "evictions": self.evictions,
+            "connections": connected,
+            "active_sessions": active,
+        }
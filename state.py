@@ -1,2 +1,146 @@
-user_data = {}
-last_ping_command_time = {}
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from config import SESSIONS
+
+# 会话参数（可选）：ttl（会话闲置多少秒后过期）, max_entries（最多保留的会话数）, sweep_interval（清理间隔秒数）
+SESSION_TTL = SESSIONS.get('ttl', 600)
+SESSION_MAX_ENTRIES = SESSIONS.get('max_entries', 10000)
+SWEEP_INTERVAL = SESSIONS.get('sweep_interval', 30)
+# 单次清理最多处理的条目数，处理完一批后让出事件循环
+SWEEP_BATCH = 1000
+
+class SessionStore:
+    """
+    带过期时间和数量上限的会话存储，用法与 dict 相同（in / [] / del / get / pop）
+
+    每个条目在最后一次读写后 ttl 秒过期；超过 max_entries 时淘汰最久未使用的条目。
+    所有条目的 ttl 相同，最后一次访问的顺序即过期顺序，因此读写和清理都是 O(1)（清理为每个过期条目 O(1)）。
+    正在执行后台任务的会话可以用 pin() 固定，固定的会话不会过期或被淘汰，由任务结束时删除。
+
+    参数:
+        ttl: 过期时间（秒）
+        max_entries: 条目数上限
+        on_evict: 可选，条目过期或被淘汰时调用 on_evict(key, value)
+    """
+
+    def __init__(self, ttl: float, max_entries: int, on_evict=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        # key -> [value, expires_at]，按最后一次访问排序
+        self._entries = OrderedDict()
+        self._pinned = {}
+        self.expired = 0
+        self.evicted = 0
+
+    def _evict(self, key, value):
+        if self.on_evict is not None:
+            try:
+                self.on_evict(key, value)
+            except Exception as e:
+                logging.error(f"清理会话 {key} 失败: {e}")
+
+    def _lookup(self, key):
+        """返回条目（过期的条目当场删除并返回 None），并刷新其过期时间"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        now = time.monotonic()
+        if entry[1] <= now:
+            del self._entries[key]
+            self.expired += 1
+            self._evict(key, entry[0])
+            return None
+        entry[1] = now + self.ttl
+        self._entries.move_to_end(key)
+        return entry
+
+    def __contains__(self, key) -> bool:
+        return key in self._pinned or self._lookup(key) is not None
+
+    def __getitem__(self, key):
+        if key in self._pinned:
+            return self._pinned[key]
+        entry = self._lookup(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry[0]
+
+    def __setitem__(self, key, value):
+        self._pinned.pop(key, None)
+        self._entries[key] = [value, time.monotonic() + self.ttl]
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            old_key, (old_value, _) = self._entries.popitem(last=False)
+            self.evicted += 1
+            self._evict(old_key, old_value)
+
+    def __delitem__(self, key):
+        if self._pinned.pop(key, None) is None:
+            del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries) + len(self._pinned)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, default=None):
+        if key in self._pinned:
+            return self._pinned.pop(key)
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def pin(self, key):
+        """固定会话（后台任务开始时调用），固定后不会过期或被淘汰"""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._pinned[key] = entry[0]
+
+    def sweep(self, limit: int = None) -> int:
+        """
+        删除已过期的条目
+
+        参数:
+            limit: 可选，本次最多删除的条目数
+
+        返回:
+            删除的条目数
+        """
+        now = time.monotonic()
+        removed = 0
+        entries = self._entries
+        while entries and (limit is None or removed < limit):
+            key = next(iter(entries))
+            value, expires_at = entries[key]
+            if expires_at > now:
+                break
+            del entries[key]
+            removed += 1
+            self._evict(key, value)
+        self.expired += removed
+        return removed
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "pinned": len(self._pinned),
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+# 进行中的交互操作（/ping、/nexttrace、/addserver 等），键为用户 ID
+user_data = SessionStore(SESSION_TTL, SESSION_MAX_ENTRIES)
+
+async def sweep_sessions(stores: tuple = (user_data,), interval: float = SWEEP_INTERVAL):
+    """后台定期清理过期会话，大量会话同时过期时分批处理，避免长时间占用事件循环"""
+    while True:
+        await asyncio.sleep(interval)
+        for store in stores:
+            while store.sweep(SWEEP_BATCH) == SWEEP_BATCH:
+                await asyncio.sleep(0)
@@ -1,83 +1,353 @@
+import html
 import asyncio
-from network import ping_on_server, nexttrace_on_server, format_nexttrace_result
-from utils import progress_spinner
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from network import ping_on_server_async, ping_stats_on_server_async, nexttrace_on_server_async, install_nexttrace_on_server_async, nexttrace_version_on_server_async, mtr_on_server_async, decode_trace_round, version_at_least, render_trace, format_pingall_result, format_install_board, NexttraceStreamParser, is_error_result
+from config import PINGALL_CONCURRENCY, INSTALL_CONCURRENCY, NEXTTRACE_MIN_VERSION, ADMIN_USERS
+from utils import progress_spinner, progress_updater, check_is_admin
+from outbox import outbox, PRIORITY_FINAL, PRIORITY_PROGRESS
 from state import user_data
+from resilience import OperationResult, CircuitOpenError
+from node_queue import node_scheduler
+from ratelimit import command_limiter, RateLimitedError
+from singleflight import inflight
+from result_cache import result_cache, ping_cache_key, trace_cache_key, register_refresh, PING_TTL, TRACE_TTL
+from mtr import MtrReport, QUERIES as MTR_QUERIES
 import logging
 
-async def do_ping_in_background(context, chat_id: int, server_info: dict, target: str, ping_count: int, user_id: int):
-    done_event = asyncio.Event()
-    base_text = (
-        "<b>【Ping 测试结果】</b>\n\n"
-        f"节点: {server_info['name']}\n"
-        f"目标: {target}\n"
-        f"Ping 次数: {ping_count}\n\n正在执行 Ping 操作，请稍候"
-    )
-    spinner_task = asyncio.create_task(progress_spinner(context, chat_id, user_data[user_id]["message_id"], base_text, done_event))
-    
-    ping_raw_result = await asyncio.to_thread(ping_on_server, server_info, target, ping_count)
-    
-    done_event.set()
-    await spinner_task
-
-    # 检查结果中是否包含重试信息
-    retry_info = ""
-    if "操作失败，已重试" in ping_raw_result:
-        # 记录到日志
-        logging.warning(f"Ping 测试重试后完成: {server_info['name']} -> {target}")
-        retry_info = "<i>⚠️ 注意: 测试过程中遇到连接问题，通过自动重试完成。</i>\n\n"
-    
-    final_text = (
+def outcome_notice(result: OperationResult) -> str:
+    """根据远程操作结果生成附加在测试结果前的提示"""
+    if not result.ok:
+        if isinstance(result.error, CircuitOpenError):
+            return f"<i>⛔ {html.escape(str(result.error))}</i>\n\n"
+        if isinstance(result.error, RateLimitedError):
+            return f"<i>⏳ {html.escape(str(result.error))}</i>\n\n"
+        return f"<i>❌ 测试失败（已尝试 {result.attempts} 次）: {html.escape(str(result.error))}</i>\n\n"
+    if result.retried:
+        return "<i>⚠️ 注意: 测试过程中遇到连接问题，通过自动重试完成。</i>\n\n"
+    return ""
+
+def queue_notifier(context, chat_id: int, message_id: int, header: str):
+    """生成排队位置回调：任务排队时在消息中显示当前位置"""
+    async def notify(position: int):
+        await outbox.edit_message_text(
+            context.bot,
+            chat_id=chat_id,
+            message_id=message_id,
+            text=f"{header}⏳ 排队中，当前第 {position} 位，请稍候...",
+            parse_mode="HTML",
+            priority=PRIORITY_PROGRESS
+        )
+    return notify
+
+def refresh_markup(request: dict, age: float) -> InlineKeyboardMarkup:
+    """缓存结果下方的“点击刷新”按钮"""
+    token = register_refresh(request)
+    return InlineKeyboardMarkup([[InlineKeyboardButton(
+        f"🔄 缓存于 {int(age)} 秒前，点击刷新", callback_data=f"refresh_{token}"
+    )]])
+
+async def do_ping_in_background(context, chat_id: int, server_info: dict, target: str, ping_count: int, user_id: int, use_cache: bool = True):
+    message_id = user_data[user_id]["message_id"]
+    # 任务执行期间会话不会过期
+    user_data.pin(user_id)
+    header = (
         "<b>【Ping 测试结果】</b>\n\n"
         f"节点: {server_info['name']}\n"
         f"目标: {target}\n"
         f"Ping 次数: {ping_count}\n\n"
-        f"{retry_info}"
-        f"{ping_raw_result}"
     )
-    await context.bot.edit_message_text(
+    cache_key = ping_cache_key(server_info, target, ping_count)
+    cached = result_cache.get(cache_key) if use_cache else None
+    if cached is not None:
+        value, age = cached
+        request = {"operation": "ping", "server": cache_key[1:3], "target": target, "ping_count": ping_count}
+        await outbox.edit_message_text(
+            context.bot,
+            chat_id=chat_id,
+            message_id=message_id,
+            text=f"{header}{value}",
+            parse_mode="HTML",
+            reply_markup=refresh_markup(request, age),
+            priority=PRIORITY_FINAL
+        )
+        user_data.pop(user_id, None)
+        return
+
+    async def execute():
+        # 只有真正在节点上执行时才消耗节点的令牌（缓存命中和合并的请求不计）
+        limited = command_limiter.node_error(server_info, exempt=check_is_admin(user_id, ADMIN_USERS))
+        if limited is not None:
+            return OperationResult(False, error=limited)
+        # 节点繁忙时先排队，拿到执行名额后才开始转圈并执行
+        async with node_scheduler.slot(server_info, user_id, on_position=queue_notifier(context, chat_id, message_id, header)):
+            done_event = asyncio.Event()
+            spinner_task = asyncio.create_task(progress_spinner(context, chat_id, message_id, f"{header}正在执行 Ping 操作，请稍候", done_event))
+            try:
+                result = await ping_on_server_async(server_info, target, ping_count)
+            finally:
+                done_event.set()
+                await spinner_task
+
+        if result.retried:
+            logging.warning(f"Ping 测试经过 {result.attempts} 次尝试: {server_info['name']} -> {target}")
+        if result.ok and not is_error_result(result.value):
+            result_cache.set(cache_key, result.value, PING_TTL)
+        return result
+
+    # 相同的测试正在执行时直接等待它的结果，不再重复执行
+    flight, leader = inflight.join(cache_key, execute)
+    if leader:
+        result = await inflight.wait(flight)
+    else:
+        done_event = asyncio.Event()
+        spinner_task = asyncio.create_task(progress_spinner(context, chat_id, message_id, f"{header}相同的测试正在进行中，等待结果", done_event))
+        try:
+            result = await inflight.wait(flight)
+        finally:
+            done_event.set()
+            await spinner_task
+
+    final_text = f"{header}{outcome_notice(result)}{result.value if result.ok else ''}"
+    await outbox.edit_message_text(
+        context.bot,
         chat_id=chat_id,
-        message_id=user_data[user_id]["message_id"],
+        message_id=message_id,
         text=final_text,
-        parse_mode="HTML"
+        parse_mode="HTML",
+        priority=PRIORITY_FINAL
     )
-    del user_data[user_id]
+    user_data.pop(user_id, None)
+
+async def do_nexttrace_in_background(context, chat_id: int, server_info: dict, target: str, ip_type: str, user_id: int, trace_mode: str = "icmp", use_cache: bool = True):
+    message_id = user_data[user_id]["message_id"]
+    # 任务执行期间会话不会过期
+    user_data.pin(user_id)
+    cache_key = trace_cache_key(server_info, target, ip_type, trace_mode)
+    cached = result_cache.get(cache_key) if use_cache else None
+    if cached is not None:
+        trace, age = cached
+        request = {"operation": "nexttrace", "server": cache_key[1:3], "target": target, "ip_type": ip_type, "trace_mode": trace_mode}
+        await outbox.edit_message_text(
+            context.bot,
+            chat_id=chat_id,
+            message_id=message_id,
+            text=render_trace(trace, server_info['name'], target, ip_type, trace_mode),
+            parse_mode="HTML",
+            reply_markup=refresh_markup(request, age),
+            priority=PRIORITY_FINAL
+        )
+        user_data.pop(user_id, None)
+        return
 
-async def do_nexttrace_in_background(context, chat_id: int, server_info: dict, target: str, ip_type: str, user_id: int, trace_mode: str = "icmp"):
-    done_event = asyncio.Event()
     trace_mode_text = "TCP模式" if trace_mode == "tcp" else "ICMP模式"
-    base_text = (
+    header = (
         "<b>【NextTrace 路由追踪结果】</b>\n\n"
         f"节点: {server_info['name']}\n"
         f"目标: {target}\n"
-        f"执行模式: {'直接执行' if ip_type=='direct' else ip_type} ({trace_mode_text})\n\n正在执行路由追踪操作，请稍候"
+        f"执行模式: {'直接执行' if ip_type=='direct' else ip_type} ({trace_mode_text})\n\n"
     )
-    spinner_task = asyncio.create_task(progress_spinner(context, chat_id, user_data[user_id]["message_id"], base_text, done_event))
-    
-    result = await asyncio.to_thread(nexttrace_on_server, server_info, target, ip_type, trace_mode)
-    
-    done_event.set()
-    await spinner_task
-
-    # 检查结果中是否包含重试信息
-    retry_info = ""
-    if "操作失败，已重试" in result:
-        # 记录到日志
-        logging.warning(f"NextTrace 测试重试后完成: {server_info['name']} -> {target}")
-        retry_info = "<i>⚠️ 注意: 测试过程中遇到连接问题，通过自动重试完成。</i>\n\n"
-        # 移除错误信息，以便格式化结果
-        result = "NextTrace 执行遇到问题，但通过重试完成。"
-    
-    final_text = format_nexttrace_result(result, server_info['name'], target, ip_type, trace_mode)
+    parser = NexttraceStreamParser()
+
+    async def execute():
+        limited = command_limiter.node_error(server_info, exempt=check_is_admin(user_id, ADMIN_USERS))
+        if limited is not None:
+            return OperationResult(False, error=limited)
+        async with node_scheduler.slot(server_info, user_id, on_position=queue_notifier(context, chat_id, message_id, header)):
+            done_event = asyncio.Event()
+            # 追踪过程中把已经解析出的跳数实时显示在消息中
+            progress_task = asyncio.create_task(progress_updater(
+                context, chat_id, message_id,
+                lambda: parser.render(server_info['name'], target, ip_type, trace_mode, finished=False),
+                done_event
+            ))
+            try:
+                result = await nexttrace_on_server_async(server_info, target, ip_type, trace_mode, parser=parser)
+            finally:
+                done_event.set()
+                await progress_task
+
+        if result.retried:
+            logging.warning(f"NextTrace 测试经过 {result.attempts} 次尝试: {server_info['name']} -> {target}")
+        if result.ok and not is_error_result(result.value):
+            result_cache.set(cache_key, result.value, TRACE_TTL)
+        return result
+
+    # 相同的追踪正在执行时共用它的解析器显示进度，并等待同一个结果
+    flight, leader = inflight.join(cache_key, execute, shared=parser)
+    if leader:
+        result = await inflight.wait(flight)
+    else:
+        shared_parser = flight.shared
+        done_event = asyncio.Event()
+        progress_task = asyncio.create_task(progress_updater(
+            context, chat_id, message_id,
+            lambda: shared_parser.render(server_info['name'], target, ip_type, trace_mode, finished=False),
+            done_event
+        ))
+        try:
+            result = await inflight.wait(flight)
+        finally:
+            done_event.set()
+            await progress_task
+
+    if result.ok:
+        final_text = render_trace(result.value, server_info['name'], target, ip_type, trace_mode)
+    else:
+        final_text = (
+            "<b>【NextTrace 路由追踪结果】</b>\n\n"
+            f"节点: {server_info['name']}\n"
+            f"目标: {target}\n"
+        )
     
-    # 在格式化后的结果中添加重试信息
-    if retry_info:
+    # 在格式化后的结果中添加重试/失败信息
+    notice = outcome_notice(result)
+    if notice:
         final_text = final_text.replace("<b>【NextTrace 路由追踪结果】</b>\n\n", 
-                                        f"<b>【NextTrace 路由追踪结果】</b>\n\n{retry_info}")
+                                        f"<b>【NextTrace 路由追踪结果】</b>\n\n{notice}")
     
-    await context.bot.edit_message_text(
+    await outbox.edit_message_text(
+        context.bot,
+        chat_id=chat_id,
+        message_id=message_id,
+        text=final_text,
+        parse_mode="HTML",
+        priority=PRIORITY_FINAL
+    )
+    user_data.pop(user_id, None)
+
+async def do_mtr_in_background(context, chat_id: int, message_id: int, server_info: dict, target: str, rounds: int, user_id: int):
+    """在节点上连续执行 rounds 轮路由追踪，每完成一轮就在消息中更新累计的 MTR 报告"""
+    report = MtrReport(rounds, MTR_QUERIES, decode_trace_round)
+    title = "<b>【MTR 路由报告】</b>\n\n"
+    header = f"{title}节点: {html.escape(server_info['name'])}\n目标: {html.escape(target)}\n\n"
+
+    limited = command_limiter.node_error(server_info, exempt=check_is_admin(user_id, ADMIN_USERS))
+    if limited is not None:
+        result = OperationResult(False, error=limited)
+    else:
+        async with node_scheduler.slot(server_info, user_id, on_position=queue_notifier(context, chat_id, message_id, header)):
+            done_event = asyncio.Event()
+            progress_task = asyncio.create_task(progress_updater(
+                context, chat_id, message_id,
+                lambda: report.render(server_info['name'], target, finished=False),
+                done_event
+            ))
+            try:
+                result = await mtr_on_server_async(server_info, target, report)
+            finally:
+                done_event.set()
+                await progress_task
+
+    if result.ok and isinstance(result.value, MtrReport):
+        final_text = result.value.render(server_info['name'], target)
+    elif result.ok:
+        final_text = f"{header}{html.escape(result.value)}"
+    else:
+        final_text = header
+    notice = outcome_notice(result)
+    if notice:
+        final_text = final_text.replace(title, f"{title}{notice}", 1)
+
+    await outbox.edit_message_text(
+        context.bot,
         chat_id=chat_id,
-        message_id=user_data[user_id]["message_id"],
+        message_id=message_id,
         text=final_text,
-        parse_mode="HTML"
+        parse_mode="HTML",
+        priority=PRIORITY_FINAL
     )
-    del user_data[user_id]
+
+async def do_pingall_in_background(context, chat_id: int, servers: list, target: str, ping_count: int, user_id: int):
+    message_id = user_data[user_id]["message_id"]
+    # 任务执行期间会话不会过期
+    user_data.pin(user_id)
+    results = [None] * len(servers)
+    semaphore = asyncio.Semaphore(PINGALL_CONCURRENCY)
+    exempt = check_is_admin(user_id, ADMIN_USERS)
+
+    async def render(final: bool = False):
+        # 每个节点完成都会提交一次编辑，尚未发出的进度编辑由 outbox 合并
+        try:
+            await outbox.edit_message_text(
+                context.bot,
+                chat_id=chat_id,
+                message_id=message_id,
+                text=format_pingall_result(target, ping_count, servers, results),
+                parse_mode="HTML",
+                priority=PRIORITY_FINAL if final else PRIORITY_PROGRESS
+            )
+        except Exception as e:
+            logging.error(f"更新进度消息失败: {e}")
+
+    async def run_one(idx: int, server_info: dict):
+        limited = command_limiter.node_error(server_info, exempt=exempt)
+        if limited is not None:
+            results[idx] = str(limited)
+            await render()
+            return
+        async with semaphore, node_scheduler.slot(server_info, user_id):
+            result = await ping_stats_on_server_async(server_info, target, ping_count)
+            results[idx] = result.value if result.ok else str(result.error)
+        await render()
+
+    await render()
+    await asyncio.gather(*(run_one(idx, server_info) for idx, server_info in enumerate(servers)))
+    await render(final=True)
+    user_data.pop(user_id, None)
+
+async def do_install_nexttrace_in_background(context, chat_id: int, message_id: int, servers: list, user_id: int):
+    """
+    在多台服务器上并行安装 NextTrace，消息中实时显示每个节点的状态
+
+    同时安装的节点数由 INSTALL_CONCURRENCY 限制；安装前先检查版本，已安装且不低于 NEXTTRACE_MIN_VERSION 的节点跳过，
+    安装后再次检查版本确认安装成功。
+    """
+    # 安装耗时较长，期间会话不会过期
+    user_data.pin(user_id)
+    statuses = [("pending", None)] * len(servers)
+    semaphore = asyncio.Semaphore(INSTALL_CONCURRENCY)
+
+    async def render(final: bool = False):
+        try:
+            await outbox.edit_message_text(
+                context.bot,
+                chat_id=chat_id,
+                message_id=message_id,
+                text=format_install_board(servers, statuses),
+                parse_mode="HTML",
+                priority=PRIORITY_FINAL if final else PRIORITY_PROGRESS
+            )
+        except Exception as e:
+            logging.error(f"更新安装进度失败: {e}")
+
+    async def run_one(idx: int, server_info: dict):
+        async with semaphore, node_scheduler.slot(server_info, user_id):
+            statuses[idx] = ("probing", None)
+            await render()
+            probe = await nexttrace_version_on_server_async(server_info)
+            if not probe.ok:
+                statuses[idx] = ("failed", str(probe.error))
+            elif probe.value and (not NEXTTRACE_MIN_VERSION or version_at_least(probe.value, NEXTTRACE_MIN_VERSION)):
+                statuses[idx] = ("skipped", f"v{probe.value}")
+            else:
+                statuses[idx] = ("running", f"当前 v{probe.value}" if probe.value else None)
+                await render()
+                statuses[idx] = await install_one(server_info)
+        logging.info(f"服务器 {server_info['name']} 安装 NextTrace: {statuses[idx][0]}")
+        await render()
+
+    async def install_one(server_info: dict):
+        result = await install_nexttrace_on_server_async(server_info)
+        if not result.ok:
+            return ("failed", str(result.error))
+        check = await nexttrace_version_on_server_async(server_info)
+        if check.ok and check.value:
+            return ("ok", f"v{check.value}")
+        # 安装脚本没有报错但找不到 nexttrace，显示安装输出的最后一行
+        lines = [line for line in result.value.strip().splitlines() if line.strip()]
+        return ("failed", lines[-1] if lines else "安装后未检测到 nexttrace")
+
+    await render()
+    await asyncio.gather(*(run_one(idx, server_info) for idx, server_info in enumerate(servers)))
+    await render(final=True)
+    user_data.pop(user_id, None)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 模块都在仓库根目录下（config.json 按当前目录读取，请在仓库根目录运行 pytest）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,50 @@
+from latency import extract_samples
+
+IPUTILS = """PING 8.8.8.8 (8.8.8.8) 56(84) bytes of data.
+64 bytes from 8.8.8.8: icmp_seq=2 ttl=117 time=1.353 ms
+64 bytes from 8.8.8.8: icmp_seq=3 ttl=117 time=1.203 ms
+64 bytes from 8.8.8.8: icmp_seq=4 ttl=117 time=1.278 ms
+
+--- 8.8.8.8 ping statistics ---
+4 packets transmitted, 3 received, 25% packet loss, time 3004ms
+"""
+
+IPUTILS_IPV6 = """PING 2001:4860:4860::8888(2001:4860:4860::8888) 56 data bytes
+64 bytes from 2001:4860:4860::8888: icmp_seq=2 ttl=117 time=24.62 ms
+64 bytes from 2001:4860:4860::8888: icmp_seq=3 ttl=117 time=25.10 ms
+64 bytes from 2001:4860:4860::8888: icmp_seq=4 ttl=117 time=24.88 ms
+"""
+
+BUSYBOX = """PING 1.1.1.1 (1.1.1.1): 56 data bytes
+64 bytes from 1.1.1.1: seq=1 ttl=57 time=31.919 ms
+64 bytes from 1.1.1.1: seq=2 ttl=57 time=38.782 ms
+64 bytes from 1.1.1.1: seq=3 ttl=57 time=31.195 ms
+
+--- 1.1.1.1 ping statistics ---
+4 packets transmitted, 3 packets received, 25% packet loss
+"""
+
+BSD = """PING 8.8.8.8 (8.8.8.8): 56 data bytes
+Request timeout for icmp_seq 0
+64 bytes from 8.8.8.8: icmp_seq=1 ttl=117 time=12.345 ms
+64 bytes from 8.8.8.8: icmp_seq=2 ttl=117 time=11.802 ms
+64 bytes from 8.8.8.8: icmp_seq=3 ttl=117 time=11.990 ms
+"""
+
+def test_first_packet_lost_iputils():
+    assert extract_samples(IPUTILS, 4).lost_mask() == [True, False, False, False]
+
+def test_first_packet_lost_iputils_ipv6():
+    assert extract_samples(IPUTILS_IPV6, 4).lost_mask() == [True, False, False, False]
+
+def test_first_packet_lost_busybox():
+    assert extract_samples(BUSYBOX, 4).lost_mask() == [True, False, False, False]
+
+def test_first_packet_lost_bsd():
+    assert extract_samples(BSD, 4).lost_mask() == [True, False, False, False]
+
+def test_corpus_without_loss():
+    with open("bench/corpus/ping_busybox.txt") as f:
+        samples = extract_samples(f.read())
+    assert samples.base == 0
+    assert not any(samples.lost_mask())
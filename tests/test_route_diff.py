@@ -0,0 +1,26 @@
+from trace_model import Hop, TraceResult
+from route_diff import signature, diff_signatures
+
+def _trace(*hops):
+    return TraceResult([Hop(ttl, ip, rtts=(10.0,) if ip else ()) for ttl, ip in hops])
+
+def test_trailing_timeout_hop_is_not_a_change():
+    old = _trace((1, "192.168.1.1"), (2, "10.0.0.1"), (3, "203.0.113.1"))
+    new = _trace((1, "192.168.1.1"), (2, "10.0.0.1"), (3, "203.0.113.1"), (4, None))
+    diff = diff_signatures(signature(old), signature(new))
+    assert not diff.changed
+    assert diff.added == diff.removed == diff.moved == []
+
+def test_different_first_hop_is_not_a_change():
+    old = _trace((1, "192.168.1.1"), (2, "10.0.0.1"), (3, "203.0.113.1"))
+    new = _trace((1, "192.168.0.254"), (2, "10.0.0.1"), (3, "203.0.113.1"))
+    diff = diff_signatures(signature(old), signature(new))
+    assert not diff.changed
+
+def test_inserted_hop_is_a_change():
+    old = _trace((1, "192.168.1.1"), (2, "10.0.0.1"), (3, "203.0.113.1"))
+    new = _trace((1, "192.168.1.1"), (2, "10.0.0.1"), (3, "198.51.100.1"), (4, "203.0.113.1"))
+    diff = diff_signatures(signature(old), signature(new))
+    assert diff.changed
+    assert diff.added == [(3, "198.51.100.1")]
+    assert diff.moved == [("203.0.113.1", 3, 4)]
@@ -0,0 +1,182 @@
+import re
+import sys
+import html
+import json
+import hashlib
+
+class Hop:
+    """
+    路由追踪中的一跳
+
+    属性:
+        ttl: 跳数
+        ip: 响应的地址，全部超时时为 None
+        hostname: 反向解析的主机名
+        rtts: 各次探测的往返时延（毫秒）
+        asn: 自治系统号（不带 "AS" 前缀）
+        whois: 网络名称，如 CHINANET-BB
+        geo: 地理位置（国家/省/市）
+        owner: 运营者或域名
+    """
+
+    __slots__ = ("ttl", "ip", "hostname", "rtts", "asn", "whois", "geo", "owner")
+
+    def __init__(self, ttl: int, ip: str = None, hostname: str = "", rtts: tuple = (), asn: str = "", whois: str = "", geo: str = "", owner: str = ""):
+        self.ttl = ttl
+        self.ip = ip
+        self.hostname = hostname
+        self.rtts = rtts
+        self.asn = asn
+        self.whois = whois
+        self.geo = geo
+        self.owner = owner
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class TraceResult:
+    """
+    一次路由追踪的结构化结果，可以直接用于缓存、比较和导出，无需重新解析
+
+    属性:
+        hops: Hop 列表
+        map_url: MapTrace 地图链接
+        raw_text: 旧版 nexttrace 的文本输出（只有通过文本解析得到的结果才有），
+                  渲染时按原有的文本格式显示
+        route_diff: 与同一节点、目标、参数的上一次追踪相比的路径差异（route_diff.RouteDiff），没有时为 None
+    """
+
+    __slots__ = ("hops", "map_url", "raw_text", "route_diff")
+
+    def __init__(self, hops: list, map_url: str = None, raw_text: str = None):
+        self.hops = hops
+        self.map_url = map_url
+        self.raw_text = raw_text
+        self.route_diff = None
+
+    def approx_size(self) -> int:
+        """估算占用的内存（字节），供结果缓存限制总大小"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.hops) + sys.getsizeof(self.raw_text) + sys.getsizeof(self.map_url)
+        for hop in self.hops:
+            size += sys.getsizeof(hop) + sys.getsizeof(hop.rtts) + 24 * len(hop.rtts)
+            size += sum(sys.getsizeof(getattr(hop, name)) for name in ("ip", "hostname", "asn", "whois", "geo", "owner"))
+        return size
+
+    def to_dict(self) -> dict:
+        return {"hops": [hop.to_dict() for hop in self.hops], "map_url": self.map_url}
+
+    def path_hash(self) -> str:
+        """逐跳地址序列的短哈希（超时的跳记为 *），路径相同的追踪哈希相同"""
+        path = "|".join(hop.ip or "*" for hop in self.hops)
+        return hashlib.blake2b(path.encode(), digest_size=8).hexdigest()
+
+def _join_nonempty(*parts) -> str:
+    return " ".join(p for p in parts if p)
+
+def decode_nexttrace_json(output: str):
+    """
+    解析 `nexttrace --json` 的输出
+
+    返回:
+        TraceResult；输出中没有 JSON 结果时返回 None
+    """
+    start = output.find("{")
+    if start < 0:
+        return None
+    try:
+        data, _ = json.JSONDecoder().raw_decode(output, start)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or "Hops" not in data:
+        return None
+
+    hops = []
+    for index, attempts in enumerate(data.get("Hops") or [], start=1):
+        ttl = index
+        ip = None
+        hostname = asn = whois = geo = owner = ""
+        rtts = []
+        for attempt in attempts or []:
+            ttl = attempt.get("TTL") or ttl
+            if not attempt.get("Success"):
+                continue
+            # RTT 为 Go 的 time.Duration（纳秒）
+            rtts.append(attempt.get("RTT", 0) / 1e6)
+            if ip is not None:
+                continue
+            address = attempt.get("Address") or {}
+            ip = address.get("IP") if isinstance(address, dict) else str(address)
+            hostname = attempt.get("Hostname") or ""
+            info = attempt.get("Geo") or {}
+            asn = str(info.get("asnumber") or "")
+            whois = info.get("whois") or ""
+            geo = _join_nonempty(info.get("country"), info.get("prov"), info.get("city"), info.get("district"))
+            owner = info.get("owner") or info.get("isp") or info.get("domain") or ""
+        hops.append(Hop(ttl, ip, hostname, tuple(rtts), asn, whois, geo, owner))
+
+    return TraceResult(hops, data.get("TraceMapUrl") or None)
+
+_HOP_RTT_RE = re.compile(r'(\d+(?:\.\d+)?)\s*ms')
+_HOP_ASN_RE = re.compile(r'^AS(\d+)$')
+
+def hop_from_text(line: str) -> Hop:
+    """
+    从 NextTrace 文本输出中合并好的一跳（如 "2 203.0.113.1 AS64500 [EXAMPLE-NET] 某地 example.net 5.12 ms / 5.20 ms"）
+    尽量提取出结构化字段，供旧版 nexttrace 的结果复用
+    """
+    tokens = _HOP_RTT_RE.sub("", line).replace("/", " ").split()
+    ttl = int(tokens[0]) if tokens and tokens[0].isdigit() else 0
+    ip = tokens[1] if len(tokens) > 1 and tokens[1] != "*" else None
+    asn = whois = ""
+    rest = []
+    for token in tokens[2:]:
+        match = _HOP_ASN_RE.match(token)
+        if match and not asn:
+            asn = match.group(1)
+        elif token.startswith("[") and token.endswith("]") and not whois:
+            whois = token[1:-1]
+        elif token != "*":
+            rest.append(token)
+    rtts = tuple(float(v) for v in _HOP_RTT_RE.findall(line))
+    return Hop(ttl, ip, "", rtts, asn, whois, " ".join(rest))
+
+def _format_hop(hop: Hop, mask_ip: bool) -> str:
+    if hop.ip is None:
+        return f"{hop.ttl}  *"
+    ip = "x.x.x.x" if mask_ip else hop.ip
+    parts = [str(hop.ttl), ip]
+    if hop.hostname and not mask_ip:
+        parts.append(f"({hop.hostname})")
+    if hop.asn:
+        parts.append(f"AS{hop.asn}")
+    if hop.whois:
+        parts.append(f"[{hop.whois}]")
+    if hop.geo:
+        parts.append(hop.geo)
+    if hop.owner:
+        parts.append(hop.owner)
+    line = "  ".join(parts)
+    if hop.rtts:
+        line += "\n   " + " / ".join(f"{rtt:.2f} ms" for rtt in hop.rtts)
+    return html.escape(line)
+
+def render_trace_result(result: TraceResult, server_name: str, target: str, ip_type: str, trace_mode: str = "icmp") -> str:
+    """把结构化的追踪结果渲染为消息文本（HTML），第一跳的地址会被隐藏"""
+    trace_mode_text = "TCP模式" if trace_mode == "tcp" else "ICMP模式"
+    parts = [
+        "<b>【NextTrace 路由追踪结果】</b>\n\n",
+        f"节点: {server_name}\n",
+        f"目标: {target}\n",
+        f"执行模式: {'直接执行' if ip_type=='direct' else ip_type} ({trace_mode_text})\n\n",
+    ]
+    if result.hops:
+        parts.append("<b>路由跳数</b>:\n<pre>")
+        parts.append("\n\n".join(_format_hop(hop, i == 0) for i, hop in enumerate(result.hops)))
+        parts.append("</pre>\n\n")
+    else:
+        parts.append("未捕获到路由跳数信息。\n")
+    if result.map_url:
+        parts.append(f"<b>MapTrace URL: {html.escape(result.map_url)}</b>\n")
+    else:
+        parts.append("未发现 MapTrace URL\n")
+    return "".join(parts)
@@ -0,0 +1,205 @@
+import hmac
+import json
+import signal
+import asyncio
+import logging
+import secrets
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# 每个处理名额最多允许多少个已接收、正在等待同一用户前一个更新的更新
+_PENDING_PER_SLOT = 8
+# webhook 请求体大小上限（字节）
+_MAX_BODY = 1 << 20
+
+def _update_owner(update):
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return None
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    并发处理不同用户的更新，同一用户的更新按到达顺序逐个处理
+
+    一个用户的慢操作不再拖慢其他用户的按钮响应，而同一用户的交互流程（选择节点、输入目标……）仍保持顺序。
+    基类的信号量限制已接收但尚未处理完的更新总数（包括排在同一用户前一个更新之后等待的），
+    实际同时运行的处理函数数由 max_concurrent_updates 限制，因此等待中的更新不会占用处理名额。
+
+    参数:
+        max_concurrent_updates: 同时运行的处理函数数上限
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates * _PENDING_PER_SLOT)
+        self.limit = max_concurrent_updates
+        self._running = asyncio.Semaphore(max_concurrent_updates)
+        # 用户 ID -> [锁, 引用计数]，没有待处理更新的用户会被删除
+        self._user_locks = {}
+
+    async def do_process_update(self, update, coroutine):
+        owner = _update_owner(update)
+        if owner is None:
+            async with self._running:
+                await coroutine
+            return
+        entry = self._user_locks.get(owner)
+        if entry is None:
+            entry = self._user_locks[owner] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock 按等待顺序唤醒，同一用户的更新按到达顺序处理
+            async with entry[0]:
+                async with self._running:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._user_locks[owner]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+class WebhookServer:
+    """
+    接收 Telegram webhook 推送的本地 HTTP 监听
+
+    只接受发往 path 的 POST 请求，并校验 X-Telegram-Bot-Api-Secret-Token，
+    校验通过的更新放入 application.update_queue，由 Application 按配置的并发方式处理。
+
+    参数:
+        application: 已启动的 Application
+        path: 监听的路径，如 "/telegram"
+        secret_token: 与 setWebhook 时相同的密钥
+    """
+
+    def __init__(self, application, path: str, secret_token: str):
+        self.application = application
+        self.path = "/" + path.strip("/")
+        self.secret_token = secret_token.encode()
+        self.received = 0
+        self.rejected = 0
+        self.port = None
+        self._server = None
+
+    async def start(self, host: str, port: int):
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        # port 为 0 时由系统分配
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info(f"Webhook 监听已启动: http://{host}:{self.port}{self.path}")
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def _accept(self, method: str, path: str, headers: dict, body: bytes) -> str:
+        """处理一个请求（path 不含查询字符串），返回 HTTP 状态"""
+        if path != self.path:
+            return "404 Not Found"
+        if method != "POST":
+            return "405 Method Not Allowed"
+        token = headers.get("x-telegram-bot-api-secret-token", "").encode()
+        if not hmac.compare_digest(token, self.secret_token):
+            self.rejected += 1
+            return "403 Forbidden"
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except Exception as e:
+            logging.error(f"无法解析 webhook 更新: {e}")
+            return "400 Bad Request"
+        self.received += 1
+        # 立即应答 Telegram，处理在 Application 中异步进行
+        self.application.update_queue.put_nowait(update)
+        return "200 OK"
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), timeout=60)
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), timeout=10)
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                parts = request_line.decode("latin-1").split()
+                if len(parts) < 2:
+                    raise ValueError("无效的请求行")
+                method, path = parts[0], parts[1].split("?", 1)[0]
+                # 不支持分块传输：POST 必须带 Content-Length，否则无法读取请求体
+                if "transfer-encoding" in headers or (method == "POST" and "content-length" not in headers):
+                    writer.write(b"HTTP/1.1 411 Length Required\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    break
+                length = int(headers.get("content-length", 0))
+                if length < 0:
+                    raise ValueError("无效的 Content-Length")
+                if length > _MAX_BODY:
+                    writer.write(b"HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    break
+                body = await asyncio.wait_for(reader.readexactly(length), timeout=10)
+                status = self._accept(method, path, headers, body)
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n\r\n".encode("latin-1"))
+                await writer.drain()
+        except ValueError:
+            # 请求行或 Content-Length 无法解析
+            writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+def run_webhook(application, webhook: dict):
+    """
+    以 webhook 方式运行机器人（代替 run_polling），收到 SIGINT/SIGTERM 时退出
+
+    参数:
+        webhook: 配置中的 WEBHOOK：url（Telegram 推送的公网地址）, listen, port, path, secret_token
+    """
+    # 没有配置密钥时每次启动随机生成，setWebhook 会把它告诉 Telegram
+    secret_token = webhook.get('secret_token') or secrets.token_urlsafe(32)
+    path = webhook.get('path', 'telegram')
+
+    async def main():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        # 启动或运行中出错时也要删除 webhook、停止监听并执行 post_stop/post_shutdown（如关闭测量结果存储）
+        try:
+            async with application:
+                if application.post_init is not None:
+                    await application.post_init(application)
+                await application.start()
+                server = None
+                try:
+                    server = await WebhookServer(application, path, secret_token).start(webhook.get('listen', '0.0.0.0'), webhook.get('port', 8443))
+                    await application.bot.set_webhook(url=webhook['url'], secret_token=secret_token, allowed_updates=Update.ALL_TYPES)
+                    await stop.wait()
+                finally:
+                    # 先让 Telegram 停止推送（未处理的更新会保留到下次启动），再关闭监听
+                    try:
+                        await application.bot.delete_webhook()
+                    except Exception as e:
+                        logging.warning(f"删除 webhook 失败: {e}")
+                    if server is not None:
+                        await server.stop()
+                    await application.stop()
+                    if application.post_stop is not None:
+                        await application.post_stop(application)
+        finally:
+            if application.post_shutdown is not None:
+                await application.post_shutdown(application)
+
+    asyncio.run(main())
@@ -1,67 +1,101 @@
-import asyncio
-import time
-import logging
-
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
-
-def check_authorization(user_id: int, authorized_users: list) -> bool:
-    return user_id in authorized_users
-
-def check_is_admin(user_id: int, admin_users: list) -> bool:
-    return user_id in admin_users
-
-async def schedule_delete_message(context, chat_id: int, message_id: int, delay: int = 10):
-    await asyncio.sleep(delay)
-    try:
-        await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-    except Exception as e:
-        logging.error(f"删除消息 {message_id} 失败: {e}")
-
-async def progress_spinner(context, chat_id: int, message_id: int, base_text: str, done_event: asyncio.Event):
-    spinner_states = [".", "..", "...", "...."]
-    i = 0
-    while not done_event.is_set():
-        spinner = spinner_states[i % len(spinner_states)]
-        try:
-            await context.bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=message_id,
-                text=f"{base_text}{spinner}",
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            logging.error(f"更新进度消息失败: {e}")
-        await asyncio.sleep(1)
-        i += 1
-
-def retry_operation(func, *args, retries=3, delay=2, **kwargs):
-    """
-    执行一个操作，如果失败则进行重试
-    
-    参数:
-        func: 要执行的函数
-        *args: 函数的位置参数
-        retries: 重试次数，默认为3
-        delay: 重试之间的延迟（秒），默认为2
-        **kwargs: 函数的关键字参数
-        
-    返回:
-        函数的执行结果或异常信息
-    """
-    last_exception = None
-    
-    for attempt in range(retries):
-        try:
-            return func(*args, **kwargs)
-        except Exception as e:
-            last_exception = e
-            logging.warning(f"操作失败 (尝试 {attempt+1}/{retries}): {str(e)}")
-            if attempt < retries - 1:  # 如果不是最后一次尝试
-                time.sleep(delay)
-                # 每次重试增加延迟时间
-                delay *= 1.5
-    
-    return f"操作失败，已重试{retries}次: {str(last_exception)}"
+import asyncio
+import logging
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from outbox import outbox, PRIORITY_PROGRESS
+from resilience import breaker_is_open
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+def check_authorization(user_id: int, authorized_users: list) -> bool:
+    return user_id in authorized_users
+
+def check_is_admin(user_id: int, admin_users: list) -> bool:
+    return user_id in admin_users
+
+def server_label(server_info: dict, with_address: bool = False) -> str:
+    """服务器按钮上显示的文字，处于熔断状态的节点会加上标记"""
+    label = server_info['name']
+    if with_address:
+        label += f" ({server_info['host']}:{server_info['port']})"
+    if breaker_is_open(server_info):
+        label = f"⛔ {label}（暂不可用）"
+    return label
+
+INSTALL_PROMPT = "请选择要安装 NextTrace 的服务器（可多选），已安装且版本满足要求的服务器会自动跳过："
+
+def install_keyboard(servers: list, selected) -> InlineKeyboardMarkup:
+    """/install_nexttrace 的服务器多选键盘，已选中的服务器前显示 ✅"""
+    keyboard = [
+        [InlineKeyboardButton(
+            ("✅ " if idx in selected else "▫️ ") + server_label(server_info, with_address=True),
+            callback_data=f"installnexttrace_{idx}"
+        )]
+        for idx, server_info in enumerate(servers)
+    ]
+    keyboard.append([
+        InlineKeyboardButton("全部安装", callback_data="installnexttrace_all"),
+        InlineKeyboardButton(f"安装所选（{len(selected)}）", callback_data="installnexttrace_start"),
+    ])
+    keyboard.append([InlineKeyboardButton("取消", callback_data="installnexttrace_cancel")])
+    return InlineKeyboardMarkup(keyboard)
+
+async def schedule_delete_message(context, chat_id: int, message_id: int, delay: int = 10):
+    await asyncio.sleep(delay)
+    try:
+        await outbox.delete_message(context.bot, chat_id=chat_id, message_id=message_id)
+    except Exception as e:
+        logging.error(f"删除消息 {message_id} 失败: {e}")
+
+async def progress_spinner(context, chat_id: int, message_id: int, base_text: str, done_event: asyncio.Event):
+    spinner_states = [".", "..", "...", "...."]
+    i = 0
+    while not done_event.is_set():
+        spinner = spinner_states[i % len(spinner_states)]
+        try:
+            await outbox.edit_message_text(
+                context.bot,
+                chat_id=chat_id,
+                message_id=message_id,
+                text=f"{base_text}{spinner}",
+                parse_mode="HTML",
+                priority=PRIORITY_PROGRESS
+            )
+        except Exception as e:
+            logging.error(f"更新进度消息失败: {e}")
+        await asyncio.sleep(1)
+        i += 1
+
+async def progress_updater(context, chat_id: int, message_id: int, render, done_event: asyncio.Event, interval: float = 1):
+    """
+    定期用 render() 的最新内容更新进度消息（内容未变化的编辑由 outbox 跳过）
+    """
+    while not done_event.is_set():
+        try:
+            await outbox.edit_message_text(
+                context.bot,
+                chat_id=chat_id,
+                message_id=message_id,
+                text=render(),
+                parse_mode="HTML",
+                priority=PRIORITY_PROGRESS
+            )
+        except Exception as e:
+            logging.error(f"更新进度消息失败: {e}")
+        try:
+            await asyncio.wait_for(done_event.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+async def delete_session_messages(bot, info: dict):
+    """删除已过期会话留下的提示消息（选择服务器的按钮、添加服务器向导的提示等）"""
+    chat_id = info.get("chat_id")
+    if chat_id is None:
+        return
+    for message_id in {info.get("message_id"), info.get("prompt_message_id")} - {None}:
+        try:
+            await outbox.delete_message(bot, chat_id=chat_id, message_id=message_id)
+        except Exception as e:
+            logging.error(f"删除过期会话的消息 {message_id} 失败: {e}")